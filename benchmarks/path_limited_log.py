@@ -0,0 +1,88 @@
+# compare path-limited rev-list with and without changed-path Bloom filters
+#
+# usage: python benchmarks/path_limited_log.py [n_commits] [n_dirs] [n_files]
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+from minimal_git import commit_graph
+from minimal_git.git_objects import AuthorInfo, Blob, Commit, Tree, TreeEntry
+from minimal_git.rev_list import CommitWalker
+
+file_mode = 0o100644
+directory_mode = 0o040000
+
+
+def write_tree(entries):
+    tree = Tree()
+    for mode, name, sha1 in sorted(entries, key=lambda e: e[1]):
+        tree.add_entry(TreeEntry(mode, name, sha1))
+    tree.write()
+    return tree.hash()
+
+
+def make_history(n_commits, n_dirs, n_files):
+    rng = random.Random(0)
+    dirs = {}
+    dir_trees = {}
+    for d in range(n_dirs):
+        dir_name = f"dir{d:04d}"
+        dirs[dir_name] = {}
+        for f in range(n_files):
+            blob = Blob(f"{dir_name}/{f}\n".encode())
+            blob.write()
+            dirs[dir_name][f"file{f:04d}"] = blob.hash()
+        entries = [(file_mode, n, s) for n, s in dirs[dir_name].items()]
+        dir_trees[dir_name] = write_tree(entries)
+
+    parents = []
+    head = None
+    for i in range(n_commits):
+        dir_name = rng.choice(list(dirs))
+        file_name = rng.choice(list(dirs[dir_name]))
+        blob = Blob(f"{dir_name}/{file_name} {i}\n".encode())
+        blob.write()
+        dirs[dir_name][file_name] = blob.hash()
+        entries = [(file_mode, n, s) for n, s in dirs[dir_name].items()]
+        dir_trees[dir_name] = write_tree(entries)
+        root = write_tree([(directory_mode, n, s) for n, s in dir_trees.items()])
+        author = AuthorInfo("bench", "bench@example.com", 1600000000 + i, "+0000")
+        commit = Commit(root, parents, author, author, f"commit {i}\n")
+        commit.write()
+        head = commit.hash()
+        parents = [head]
+    return head
+
+
+def time_query(head, path):
+    start = time.perf_counter()
+    n = sum(1 for _ in CommitWalker([head], paths=[path]))
+    return time.perf_counter() - start, n
+
+
+def main():
+    n_commits, n_dirs, n_files = (list(map(int, sys.argv[1:])) + [2000, 100, 20])[:3]
+    with tempfile.TemporaryDirectory() as repo:
+        os.chdir(repo)
+        os.makedirs(".git/objects")
+        print(f"creating {n_commits} commits over {n_dirs}x{n_files} files")
+        head = make_history(n_commits, n_dirs, n_files)
+        path = "dir0000/file0000"
+
+        commit_graph.write_commit_graph()
+        without_filters, n = time_query(head, path)
+        commit_graph.write_commit_graph(changed_paths=True)
+        with_filters, n_bloom = time_query(head, path)
+        assert n == n_bloom
+
+        print(f"rev-list -- {path}: {n} of {n_commits} commits")
+        print(f"  without Bloom filters: {without_filters:.3f}s")
+        print(f"  with Bloom filters:    {with_filters:.3f}s")
+        print(f"  speedup: {without_filters / with_filters:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
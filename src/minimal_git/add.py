@@ -0,0 +1,294 @@
+# add file contents to the index
+# see Documentation/git-add.txt in git
+#
+# like git 2.x, the files matching the pathspecs are staged as they are in
+# the worktree: new files are added, changed ones updated and deleted ones
+# removed. Tracked files are compared with the index by their stat data
+# first, so only files which look changed are read and hashed; the walk
+# over the worktree, the stat calls and the hashing all run on a thread pool
+#
+# a repository inside the worktree is staged as a gitlink to the commit
+# checked out in it, as are changes of that commit in tracked submodules
+
+import argparse
+import concurrent.futures
+import os
+import stat
+import sys
+
+from . import paths
+from . import refs
+from .object_store import get_object_store
+from .ignore import load_global_ignores
+from .lockfile import LockError
+from .ls_files import iter_matching_entries, normalize_pathspec
+from .ls_tree import matches_pathspec
+from .mode import S_IFGITLINK, is_gitlink
+from .staging import (
+    IndexChangedError,
+    IndexEntry,
+    parse_index,
+    write_worktree_blob,
+)
+from .util import die_error, get_logger
+from .worktree import WorktreeWalker, load_untracked_cache
+
+logger = get_logger(__name__)
+
+# files handed to a thread at once, to keep the overhead per file low
+batch_size = 256
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "-A",
+        "--all",
+        help="add changes from all tracked and untracked files, also without"
+        " a pathspec",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-f", "--force", help="allow adding ignored files", action="store_true"
+    )
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        dest="dry_run",
+        help="only show what would be added or removed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-v", "--verbose", dest="print_paths", help="be verbose", action="store_true"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        help="number of threads (default: chosen by the thread pool)",
+    )
+    parser.add_argument("pathspecs", nargs="*", metavar="<pathspec>")
+
+
+def lstat_batch(prefix, names):
+    """lstat results of the paths prefix + name, None for those which are gone"""
+    results = []
+    for name in names:
+        try:
+            results.append(os.lstat(prefix + name))
+        except (FileNotFoundError, NotADirectoryError):
+            results.append(None)
+    return results
+
+
+def is_file_or_link(st):
+    return stat.S_ISREG(st.st_mode) or stat.S_ISLNK(st.st_mode)
+
+
+def read_gitlink(full_path):
+    """the commit checked out in the repository at full_path, None if none is
+
+    .git may also be a file naming the git directory, as in submodules and
+    linked worktrees
+    """
+    git_dir = os.path.join(full_path, ".git")
+    if os.path.isfile(git_dir):
+        with open(git_dir) as f:
+            line = f.readline().strip()
+        if line.startswith("gitdir: "):
+            git_dir = os.path.join(full_path, line[len("gitdir: ") :])
+    common_dir = git_dir
+    commondir_file = os.path.join(git_dir, "commondir")
+    if os.path.isfile(commondir_file):
+        # a linked worktree keeps its branches in the repository it belongs to
+        with open(commondir_file) as f:
+            common_dir = os.path.join(git_dir, f.read().strip())
+    head = refs.read_loose_ref("HEAD", git_dir)
+    try:
+        if head is not None and head.startswith(refs.SYMREF_PREFIX):
+            return refs.read_ref(head[len(refs.SYMREF_PREFIX) :], common_dir)
+        return refs.read_ref("HEAD", git_dir)
+    except ValueError:  # HEAD is not an object name
+        return None
+
+
+def iter_batches(items):
+    for start in range(0, len(items), batch_size):
+        yield items[start : start + batch_size]
+
+
+def find_changed_entries(index, root, pathspecs, executor, index_mtime_ns):
+    """(paths to hash with their lstat result, paths to remove) of the index
+
+    an entry whose stat data matches the file is taken as unchanged, unless
+    the file was modified no earlier than the index; unmerged paths are
+    always staged again, submodules when another commit is checked out
+    """
+    entries = [
+        e
+        for e in iter_matching_entries(index, pathspecs, expand_sparse=False)
+        if not e.skip_worktree
+    ]
+    names = [e.file_name for e in entries]
+    prefix = os.path.join(root, "")
+    stats = executor.map(lambda b: lstat_batch(prefix, b), iter_batches(names))
+    changed = {}
+    removed = set()
+    for e, st in zip(entries, (st for batch in stats for st in batch)):
+        if st is not None and is_gitlink(e.mode) and stat.S_ISDIR(st.st_mode):
+            # a submodule changes with the commit checked out in it
+            sha1 = read_gitlink(prefix + e.file_name)
+            if sha1 not in (None, e.sha1):
+                changed[e.file_name] = st
+        elif st is None or not is_file_or_link(st):
+            removed.add(e.file_name)
+        elif e.stage:
+            # the stages of a conflict are replaced by the file
+            removed.add(e.file_name)
+            changed[e.file_name] = st
+        elif not e.stat_matches(st) or e.is_racy(index_mtime_ns):
+            changed[e.file_name] = st
+    return changed, removed
+
+
+def hash_batch(root, batch):
+    """(path, lstat result, object name) of each (path, lstat result or None)
+
+    the name of a directory is that of the commit checked out in it, or None;
+    files which vanished meanwhile are left out
+    """
+    results = []
+    for path, st in batch:
+        full_path = os.path.join(root, path)
+        try:
+            if st is None:
+                st = os.lstat(full_path)
+            if stat.S_ISDIR(st.st_mode):
+                sha1 = read_gitlink(full_path)
+            else:
+                sha1 = write_worktree_blob(full_path, st)
+            results.append((path, st, sha1))
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+    return results
+
+
+def check_pathspecs(root, pathspecs, index, untracked, force):
+    """die if a pathspec matches nothing, return those naming ignored files"""
+    ignored = []
+    for pathspec in pathspecs:
+        if not pathspec:
+            continue
+        specs = [pathspec]
+        if any(True for _ in iter_matching_entries(index, specs)):
+            continue
+        if any(
+            matches_pathspec(p.rstrip("/"), p.endswith("/"), specs) for p in untracked
+        ):
+            continue
+        name = pathspec.rstrip("/")
+        if force or not os.path.lexists(os.path.join(root, name)):
+            die_error(f"fatal: pathspec '{pathspec}' did not match any files")
+        ignored.append(name)
+    return ignored
+
+
+def add(args):
+    try:
+        root = os.fspath(paths.find_repository_root())
+    except paths.NotGitRepositoryError as e:
+        die_error(f"fatal: {e}")
+    if not args.pathspecs and not args.all:
+        print("Nothing specified, nothing added.", file=sys.stderr)
+        print("hint: Maybe you wanted to say 'min-git add .'?", file=sys.stderr)
+        return
+    cwd = paths.get_cwd_relative().as_posix()
+    prefix = "" if cwd == "." else cwd + "/"
+    pathspecs = [normalize_pathspec(prefix, p) for p in args.pathspecs]
+    index = parse_index()
+    index_file = paths.find_index_file()
+    try:
+        index_mtime_ns = os.stat(index_file).st_mtime_ns
+    except FileNotFoundError:
+        index_mtime_ns = 0
+
+    if args.force:
+        ignores, cache = None, None
+    else:
+        ignores = load_global_ignores()
+        cache = load_untracked_cache(index, root)
+    with concurrent.futures.ThreadPoolExecutor(args.jobs) as executor:
+        changed, removed = find_changed_entries(
+            index, root, pathspecs, executor, index_mtime_ns
+        )
+        walker = WorktreeWalker(root, index, ignores, cache, index_mtime_ns)
+        untracked = walker.walk(pathspecs, executor)
+        ignored = check_pathspecs(root, pathspecs, index, untracked, args.force)
+        new = []
+        for path in untracked:
+            if path.endswith("/"):
+                path = path[:-1]
+                print(
+                    f"warning: adding embedded git repository: {path}",
+                    file=sys.stderr,
+                )
+            new.append((path, None))
+        if args.dry_run:
+            added = [(path, None, None) for path in list(changed) + [p for p, _ in new]]
+        else:
+            to_hash = list(changed.items()) + new
+            with get_object_store().batch():
+                hashed = executor.map(
+                    lambda b: hash_batch(root, b), iter_batches(to_hash)
+                )
+                added = [result for batch in hashed for result in batch]
+
+    new_entries = []
+    for path, st, sha1 in added:
+        old = index.get(path)
+        if st is not None:
+            if stat.S_ISDIR(st.st_mode) and sha1 is None:
+                if old is not None:
+                    continue  # a submodule which is not checked out
+                die_error(
+                    f"error: '{path}/' does not have a commit checked out\n"
+                    "fatal: adding files failed"
+                )
+            entry = IndexEntry.from_stat(path, st, sha1)
+            if stat.S_ISDIR(st.st_mode):
+                entry.mode = S_IFGITLINK
+            new_entries.append(entry)
+            if old is not None and (old.sha1, old.mode) == (sha1, entry.mode):
+                continue
+        if args.print_paths or args.dry_run:
+            print(f"add '{path}'")
+    if args.print_paths or args.dry_run:
+        for path in sorted(removed - {path for path, _, _ in added}):
+            print(f"remove '{path}'")
+    if not args.dry_run:
+        index.remove_entries(removed)
+        index.add_entries(new_entries)
+        if walker.cache_changed:
+            index.dirty = True
+        try:
+            index.write()
+        except (LockError, IndexChangedError) as e:
+            die_error(f"fatal: {e}")
+    if ignored:
+        print(
+            "The following paths are ignored by one of your .gitignore files:",
+            file=sys.stderr,
+        )
+        print("\n".join(ignored), file=sys.stderr)
+        print("hint: Use -f if you really want to add them.", file=sys.stderr)
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    add(args)
+
+
+if __name__ == "__main__":
+    main()
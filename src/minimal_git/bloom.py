@@ -0,0 +1,142 @@
+# changed-path Bloom filters stored in the BIDX/BDAT chunks of commit-graph
+# hashing follows git's bloom.c (murmur3, hash version 1)
+
+import itertools
+import struct
+
+from .diff_tree import iter_tree_changes
+
+HASH_VERSION = 1
+NUM_HASHES = 7
+BITS_PER_ENTRY = 10
+MAX_CHANGED_PATHS = 512
+BITS_PER_WORD = 8
+
+SEED0 = 0x293AE76F
+SEED1 = 0x7E646E2C
+
+SETTINGS_HEADER = struct.pack(">III", HASH_VERSION, NUM_HASHES, BITS_PER_ENTRY)
+SETTINGS_HEADER_SIZE = len(SETTINGS_HEADER)
+
+EMPTY_FILTER = b"\x00"
+LARGE_FILTER = b"\xff"  # too many changes, every query may match
+
+mask32 = 0xFFFFFFFF
+
+
+def rotl32(x, r):
+    return ((x << r) | (x >> (32 - r))) & mask32
+
+
+def signed_char(b):
+    # hash version 1 reads path bytes as (sign-extended) signed chars
+    return b | 0xFFFFFF00 if b & 0x80 else b
+
+
+def murmur3_v1(seed: int, data: bytes) -> int:
+    c1 = 0xCC9E2D51
+    c2 = 0x1B873593
+    h = seed
+    n_blocks = len(data) // 4
+    for i in range(n_blocks):
+        b = data[4 * i : 4 * i + 4]
+        k = (
+            signed_char(b[0])
+            | (signed_char(b[1]) << 8)
+            | (signed_char(b[2]) << 16)
+            | (signed_char(b[3]) << 24)
+        ) & mask32
+        k = (k * c1) & mask32
+        k = rotl32(k, 15)
+        k = (k * c2) & mask32
+        h ^= k
+        h = rotl32(h, 13)
+        h = (h * 5 + 0xE6546B64) & mask32
+    tail = data[4 * n_blocks :]
+    k = 0
+    if len(tail) >= 3:
+        k ^= (signed_char(tail[2]) << 16) & mask32
+    if len(tail) >= 2:
+        k ^= (signed_char(tail[1]) << 8) & mask32
+    if len(tail) >= 1:
+        k ^= signed_char(tail[0])
+        k = (k * c1) & mask32
+        k = rotl32(k, 15)
+        k = (k * c2) & mask32
+        h ^= k
+    h ^= len(data)
+    h ^= h >> 16
+    h = (h * 0x85EBCA6B) & mask32
+    h ^= h >> 13
+    h = (h * 0xC2B2AE35) & mask32
+    h ^= h >> 16
+    return h
+
+
+def make_key(path: str):
+    data = path.encode()
+    hash0 = murmur3_v1(SEED0, data)
+    hash1 = murmur3_v1(SEED1, data)
+    return [(hash0 + i * hash1) & mask32 for i in range(NUM_HASHES)]
+
+
+def leading_paths(path: str):
+    """yield path and each of its leading directories"""
+    path = path.strip("/")
+    while path:
+        yield path
+        path = path.rpartition("/")[0]
+
+
+def make_path_keys(path: str):
+    return [make_key(p) for p in leading_paths(path)]
+
+
+class BloomFilter:
+    def __init__(self, data: bytes):
+        self._data = data
+
+    def add_key(self, key):
+        n_bits = len(self._data) * BITS_PER_WORD
+        for h in key:
+            pos = h % n_bits
+            self._data[pos // BITS_PER_WORD] |= 1 << (pos % BITS_PER_WORD)
+
+    def contains(self, key):
+        """False if the key is definitely absent, True if it may be present"""
+        n_bits = len(self._data) * BITS_PER_WORD
+        if n_bits == 0:
+            return True
+        for h in key:
+            pos = h % n_bits
+            if not self._data[pos // BITS_PER_WORD] & (1 << (pos % BITS_PER_WORD)):
+                return False
+        return True
+
+    def may_contain_path(self, path_keys):
+        return all(self.contains(key) for key in path_keys)
+
+    def to_bytes(self):
+        return bytes(self._data)
+
+    @staticmethod
+    def from_paths(changed_paths):
+        if not changed_paths:
+            return BloomFilter(bytearray(EMPTY_FILTER))
+        n_bytes = (len(changed_paths) * BITS_PER_ENTRY + BITS_PER_WORD - 1) // BITS_PER_WORD
+        bloom = BloomFilter(bytearray(n_bytes))
+        for path in changed_paths:
+            bloom.add_key(make_key(path))
+        return bloom
+
+
+def compute_filter(parent_tree, tree) -> bytes:
+    """filter of paths changed from the first parent (None for root commits)"""
+    changes = iter_tree_changes(parent_tree, tree, recursive=True)
+    changes = list(itertools.islice(changes, MAX_CHANGED_PATHS + 1))
+    if len(changes) > MAX_CHANGED_PATHS:
+        return LARGE_FILTER
+    changed_paths = set()
+    for _, _, _, path in changes:
+        changed_paths.update(leading_paths(path))
+    return BloomFilter.from_paths(changed_paths).to_bytes()
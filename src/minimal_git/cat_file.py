@@ -1,5 +1,8 @@
 import argparse
+import sys
 
+from .util import die_error, iter_object_content, read_object_header
+from .refs import resolve_revision
 from .git_objects import load_object
 
 
@@ -7,15 +10,41 @@ def setup_parser(parser):
     group = parser.add_mutually_exclusive_group()
     group.add_argument("-p", help="pretty-print <object> content", action="store_true")
     group.add_argument("-t", help="show object type", action="store_true")
+    group.add_argument("-s", help="show object size", action="store_true")
+    parser.add_argument(
+        "type", nargs="?", help="print the raw content of <object> of this type"
+    )
     parser.add_argument("object", help="sha1 digest of object")
 
 
+def write_content(sha1):
+    # content goes out as bytes, chunk by chunk, so binary and huge blobs work
+    sys.stdout.flush()
+    out = sys.stdout.buffer
+    for chunk in iter_object_content(sha1):
+        out.write(chunk)
+    out.flush()
+
+
 def cat_file(args):
-    obj = load_object(args.object)
-    if args.t:
-        print(obj.type_id)
-    if args.p:
-        print(obj, end="")
+    sha1 = resolve_revision(args.object)
+    # only the header is inflated to answer -t and -s
+    object_type, size = read_object_header(sha1)
+    if args.type is not None:
+        if args.p or args.t or args.s:
+            die_error("error: <type> cannot be combined with -p, -t or -s")
+        if args.type != object_type:
+            die_error(f"fatal: git cat-file {args.object}: bad file")
+        write_content(sha1)
+    elif args.t:
+        print(object_type)
+    elif args.s:
+        print(size)
+    elif args.p:
+        if object_type == "blob":
+            write_content(sha1)
+        else:
+            print(load_object(sha1), end="")
 
 
 def main():
@@ -0,0 +1,29 @@
+# the chunk-based layout shared by commit-graph and multi-pack-index files
+# see Documentation/gitformat-chunk.txt in git
+
+import hashlib
+import os
+import struct
+
+CHUNK_LOOKUP_ENTRY_SIZE = 12
+
+
+def serialize_chunk_file(signature, versions, chunks, header_tail=b""):
+    # the byte after the chunk count is the number of base files, always 0 here
+    header = signature + bytes(versions) + bytes([len(chunks), 0]) + header_tail
+    offset = len(header) + (len(chunks) + 1) * CHUNK_LOOKUP_ENTRY_SIZE
+    table = bytearray()
+    for chunk_id, content in chunks:
+        table += struct.pack(">4sQ", chunk_id, offset)
+        offset += len(content)
+    table += struct.pack(">4sQ", b"\x00" * 4, offset)
+    parts = [header, bytes(table)] + [content for _, content in chunks]
+    data = b"".join(parts)
+    return data + hashlib.sha1(data).digest()
+
+
+def write_file_atomic(path, data: bytes):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
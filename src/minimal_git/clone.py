@@ -0,0 +1,107 @@
+# clone a repository into a new directory
+# see Documentation/git-clone.txt in git
+#
+# the new repository gets "origin" pointing at the source, everything is
+# fetched in one pack and the branch of the remote HEAD is created; there is
+# no checkout, so the worktree and the index stay empty (like --no-checkout)
+
+import argparse
+import os
+import pathlib
+import shutil
+import sys
+
+from . import fetch
+from . import pack
+from . import refs
+from .pkt_line import ProtocolError
+from .util import die_error
+
+DEFAULT_BRANCH = "master"
+
+CONFIG_TEMPLATE = """\
+[core]
+\trepositoryformatversion = 0
+\tfilemode = true
+\tbare = false
+\tlogallrefupdates = true
+[remote "origin"]
+\turl = {url}
+\tfetch = +refs/heads/*:refs/remotes/origin/*
+"""
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "--upload-pack",
+        dest="upload_pack",
+        metavar="<upload-pack>",
+        help="command to run on the other side instead of min-git upload-pack",
+    )
+    parser.add_argument("repository", metavar="<repository>")
+    parser.add_argument("directory", nargs="?", metavar="<directory>")
+
+
+def guess_directory_name(repository: str):
+    name = pathlib.PurePath(repository.rstrip("/")).name
+    if name.endswith(".git"):
+        name = name[: -len(".git")]
+    return name or "repository"
+
+
+def init_repository(directory: pathlib.Path, url: str):
+    git_dir = directory / ".git"
+    for d in ["objects/pack", "objects/info", "refs/heads", "refs/tags"]:
+        (git_dir / d).mkdir(parents=True)
+    (git_dir / "HEAD").write_text(f"ref: refs/heads/{DEFAULT_BRANCH}\n")
+    (git_dir / "config").write_text(CONFIG_TEMPLATE.format(url=url))
+
+
+def clone(args):
+    source = pathlib.Path(args.repository)
+    if not (source / ".git").is_dir():
+        die_error(f"fatal: repository '{args.repository}' does not exist")
+    url = str(source.resolve())
+    directory = pathlib.Path(args.directory or guess_directory_name(url))
+    if directory.exists() and (not directory.is_dir() or any(directory.iterdir())):
+        die_error(
+            f"fatal: destination path '{directory}' already exists "
+            "and is not an empty directory."
+        )
+    print(f"Cloning into '{directory}'...", file=sys.stderr)
+    created = not directory.exists()
+    directory = directory.resolve()
+    init_repository(directory, url)
+    cwd = os.getcwd()
+    try:
+        os.chdir(directory)
+        advertised, head = fetch.fetch_pack(url, args.upload_pack)
+    except (ProtocolError, pack.PackFormatError) as e:
+        # like git, leave nothing behind of a failed clone
+        os.chdir(cwd)
+        shutil.rmtree(directory if created else directory / ".git")
+        die_error(f"fatal: {e}")
+    fetch.update_tracking_refs("origin", advertised)
+    if head is None:
+        if not advertised:
+            print(
+                "warning: You appear to have cloned an empty repository.",
+                file=sys.stderr,
+            )
+        return
+    branch = head[len("refs/heads/") :]
+    refs.write_ref(head, advertised[head])
+    refs.write_symbolic_ref("HEAD", head)
+    origin_head = f"refs/remotes/origin/{branch}"
+    refs.write_symbolic_ref("refs/remotes/origin/HEAD", origin_head)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    clone(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,385 @@
+# read and write .git/objects/info/commit-graph
+# see Documentation/gitformat-commit-graph.txt in git for the file format
+
+import argparse
+import functools
+import mmap
+import struct
+
+from . import paths
+from . import bloom
+from . import git_objects
+from .chunk_format import (
+    CHUNK_LOOKUP_ENTRY_SIZE,
+    serialize_chunk_file,
+    write_file_atomic,
+)
+from .object_id import ObjectId
+from .util import die_error, get_logger, load_raw_content, read_object_header
+
+logger = get_logger(__name__)
+
+
+class CommitGraphFormatError(BaseException):
+    pass
+
+
+SIGNATURE = b"CGPH"
+VERSION = 1
+HASH_VERSION = 1  # SHA-1
+HASH_LENGTH = 20
+
+CHUNK_OID_FANOUT = b"OIDF"
+CHUNK_OID_LOOKUP = b"OIDL"
+CHUNK_COMMIT_DATA = b"CDAT"
+CHUNK_EXTRA_EDGES = b"EDGE"
+CHUNK_BLOOM_INDEXES = b"BIDX"
+CHUNK_BLOOM_DATA = b"BDAT"
+
+HEADER_SIZE = 8
+FANOUT_SIZE = 256 * 4
+COMMIT_DATA_SIZE = HASH_LENGTH + 16
+
+PARENT_NONE = 0x70000000
+PARENT_EXTRA_EDGES = 0x80000000  # also marks the last entry of an edge list
+PARENT_POSITION_MASK = 0x7FFFFFFF
+
+GENERATION_NUMBER_MAX = 0x3FFFFFFF
+GENERATION_NUMBER_INFINITY = 0xFFFFFFFF
+
+
+def find_commit_graph_file():
+    return paths.find_info_dir() / "commit-graph"
+
+
+class CommitGraph:
+    def __init__(self, data):
+        self._data = data
+        signature, version, hash_version, num_chunks, _ = struct.unpack_from(
+            ">4sBBBB", data, 0
+        )
+        if signature != SIGNATURE:
+            raise CommitGraphFormatError("bad commit-graph signature")
+        if version != VERSION or hash_version != HASH_VERSION:
+            raise CommitGraphFormatError("unsupported commit-graph version")
+        self._chunks = {}
+        for i in range(num_chunks):
+            pos = HEADER_SIZE + i * CHUNK_LOOKUP_ENTRY_SIZE
+            chunk_id, offset = struct.unpack_from(">4sQ", data, pos)
+            self._chunks[chunk_id] = offset
+        for chunk_id in (CHUNK_OID_FANOUT, CHUNK_OID_LOOKUP, CHUNK_COMMIT_DATA):
+            if chunk_id not in self._chunks:
+                raise CommitGraphFormatError(f"missing {chunk_id.decode()} chunk")
+        self._fanout = self._chunks[CHUNK_OID_FANOUT]
+        self._lookup = self._chunks[CHUNK_OID_LOOKUP]
+        self._commit_data = self._chunks[CHUNK_COMMIT_DATA]
+        self._extra_edges = self._chunks.get(CHUNK_EXTRA_EDGES)
+        self._bloom_indexes = self._chunks.get(CHUNK_BLOOM_INDEXES)
+        self._bloom_data = self._chunks.get(CHUNK_BLOOM_DATA)
+        if self._bloom_indexes is None or self._bloom_data is None:
+            self._bloom_indexes = self._bloom_data = None
+        elif not self._check_bloom_settings():
+            logger.debug("ignoring Bloom filters with unsupported settings")
+            self._bloom_indexes = self._bloom_data = None
+        self.num_commits = self._fanout_at(255)
+
+    def __len__(self):
+        return self.num_commits
+
+    def _check_bloom_settings(self):
+        start = self._bloom_data
+        settings = self._data[start : start + bloom.SETTINGS_HEADER_SIZE]
+        return settings == bloom.SETTINGS_HEADER
+
+    def chunk_offset(self, chunk_id):
+        return self._chunks.get(chunk_id)
+
+    def _fanout_at(self, byte):
+        return struct.unpack_from(">I", self._data, self._fanout + 4 * byte)[0]
+
+    def _oid_bytes(self, pos):
+        start = self._lookup + pos * HASH_LENGTH
+        return self._data[start : start + HASH_LENGTH]
+
+    def oid(self, pos) -> ObjectId:
+        return ObjectId(self._oid_bytes(pos))
+
+    def find(self, sha1: ObjectId):
+        """binary search the position of a commit, or None if absent"""
+        key = sha1.raw
+        lo = self._fanout_at(key[0] - 1) if key[0] > 0 else 0
+        hi = self._fanout_at(key[0])
+        while lo < hi:
+            mid = (lo + hi) // 2
+            oid = self._oid_bytes(mid)
+            if oid < key:
+                lo = mid + 1
+            elif oid > key:
+                hi = mid
+            else:
+                return mid
+        return None
+
+    def _read_commit_data(self, pos):
+        start = self._commit_data + pos * COMMIT_DATA_SIZE
+        tree = ObjectId(self._data[start : start + HASH_LENGTH])
+        parent1, parent2, generation_hi, time_lo = struct.unpack_from(
+            ">IIII", self._data, start + HASH_LENGTH
+        )
+        return tree, parent1, parent2, generation_hi, time_lo
+
+    def parent_positions(self, pos):
+        _, parent1, parent2, _, _ = self._read_commit_data(pos)
+        if parent1 == PARENT_NONE:
+            return []
+        parents = [parent1]
+        if parent2 == PARENT_NONE:
+            return parents
+        if not parent2 & PARENT_EXTRA_EDGES:
+            parents.append(parent2)
+            return parents
+        if self._extra_edges is None:
+            raise CommitGraphFormatError("missing EDGE chunk")
+        edge = self._extra_edges + 4 * (parent2 & PARENT_POSITION_MASK)
+        while True:
+            value = struct.unpack_from(">I", self._data, edge)[0]
+            parents.append(value & PARENT_POSITION_MASK)
+            if value & PARENT_EXTRA_EDGES:
+                return parents
+            edge += 4
+
+    def generation(self, pos):
+        _, _, _, generation_hi, _ = self._read_commit_data(pos)
+        return generation_hi >> 2
+
+    def commit_time(self, pos):
+        _, _, _, generation_hi, time_lo = self._read_commit_data(pos)
+        return ((generation_hi & 0x3) << 32) | time_lo
+
+    def commit_header(self, pos):
+        tree, _, _, generation_hi, time_lo = self._read_commit_data(pos)
+        parents = [self.oid(p) for p in self.parent_positions(pos)]
+        commit_time = ((generation_hi & 0x3) << 32) | time_lo
+        generation = generation_hi >> 2
+        return git_objects.CommitHeader(tree, parents, commit_time, generation)
+
+    def has_bloom_filters(self):
+        return self._bloom_indexes is not None
+
+    def bloom_filter_data(self, pos):
+        if self._bloom_indexes is None:
+            return None
+        end = struct.unpack_from(">I", self._data, self._bloom_indexes + 4 * pos)[0]
+        start = 0
+        if pos > 0:
+            index = self._bloom_indexes + 4 * (pos - 1)
+            start = struct.unpack_from(">I", self._data, index)[0]
+        base = self._bloom_data + bloom.SETTINGS_HEADER_SIZE
+        return self._data[base + start : base + end]
+
+    def bloom_filter(self, pos):
+        data = self.bloom_filter_data(pos)
+        if data is None:
+            return None
+        return bloom.BloomFilter(data)
+
+    @staticmethod
+    def open(path):
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):  # missing or empty file
+            return None
+        return CommitGraph(data)
+
+
+@functools.lru_cache(maxsize=None)
+def get_commit_graph():
+    try:
+        path = find_commit_graph_file()
+    except paths.NotGitRepositoryError:
+        return None
+    return CommitGraph.open(path)
+
+
+def load_commit_header(sha1: ObjectId):
+    graph = get_commit_graph()
+    if graph is not None:
+        pos = graph.find(sha1)
+        if pos is not None:
+            return graph.commit_header(pos)
+    return git_objects.load_commit_header(sha1)
+
+
+def load_bloom_filter(sha1: ObjectId):
+    graph = get_commit_graph()
+    if graph is None:
+        return None
+    pos = graph.find(sha1)
+    if pos is None:
+        return None
+    return graph.bloom_filter(pos)
+
+
+def generation_of(header):
+    if header.generation is None:
+        return GENERATION_NUMBER_INFINITY
+    return header.generation
+
+
+# writing
+
+
+def list_commit_headers():
+    headers = {}
+    for sha1 in paths.list_objects():
+        # only the header of an object is inflated to find its type
+        object_type, _ = read_object_header(sha1)
+        if object_type == "commit":
+            headers[sha1] = git_objects.parse_commit_header(load_raw_content(sha1))
+    return headers
+
+
+def compute_generations(headers):
+    generations = {}
+    for start in headers:
+        stack = [start]
+        while stack:
+            sha1 = stack[-1]
+            if sha1 in generations:
+                stack.pop()
+                continue
+            parents = headers[sha1].parents
+            pending = [p for p in parents if p not in generations]
+            if pending:
+                stack.extend(pending)
+                continue
+            stack.pop()
+            generation = 1 + max((generations[p] for p in parents), default=0)
+            generations[sha1] = min(generation, GENERATION_NUMBER_MAX)
+    return generations
+
+
+def compute_bloom_filters(headers, old_graph):
+    filters = {}
+    n_computed = 0
+    for sha1, header in headers.items():
+        # filters already in the old commit-graph are copied as they are
+        if old_graph is not None and old_graph.has_bloom_filters():
+            pos = old_graph.find(sha1)
+            if pos is not None:
+                filters[sha1] = bytes(old_graph.bloom_filter_data(pos))
+                continue
+        parent_tree = None
+        if header.parents:
+            parent_tree = headers[header.parents[0]].tree
+        filters[sha1] = bloom.compute_filter(parent_tree, header.tree)
+        n_computed += 1
+    logger.debug(f"computed {n_computed} changed-path Bloom filters")
+    return filters
+
+
+def serialize_commit_graph(headers, bloom_filters=None):
+    oids = sorted(headers)
+    position = {sha1: i for i, sha1 in enumerate(oids)}
+    generations = compute_generations(headers)
+
+    fanout = bytearray(FANOUT_SIZE)
+    counts = [0] * 256
+    for sha1 in oids:
+        counts[sha1.raw[0]] += 1
+    total = 0
+    for byte in range(256):
+        total += counts[byte]
+        struct.pack_into(">I", fanout, 4 * byte, total)
+
+    lookup = b"".join(sha1.raw for sha1 in oids)
+
+    commit_data = bytearray(len(oids) * COMMIT_DATA_SIZE)
+    extra_edges = []
+    for i, sha1 in enumerate(oids):
+        header = headers[sha1]
+        parents = [position[p] for p in header.parents]
+        parent1 = parents[0] if len(parents) >= 1 else PARENT_NONE
+        if len(parents) <= 2:
+            parent2 = parents[1] if len(parents) == 2 else PARENT_NONE
+        else:
+            parent2 = PARENT_EXTRA_EDGES | len(extra_edges)
+            extra_edges += parents[1:-1]
+            extra_edges.append(PARENT_EXTRA_EDGES | parents[-1])
+        generation_hi = (generations[sha1] << 2) | ((header.commit_time >> 32) & 0x3)
+        time_lo = header.commit_time & 0xFFFFFFFF
+        start = i * COMMIT_DATA_SIZE
+        commit_data[start : start + HASH_LENGTH] = header.tree.raw
+        struct.pack_into(
+            ">IIII",
+            commit_data,
+            start + HASH_LENGTH,
+            parent1,
+            parent2,
+            generation_hi,
+            time_lo,
+        )
+
+    chunks = [
+        (CHUNK_OID_FANOUT, bytes(fanout)),
+        (CHUNK_OID_LOOKUP, lookup),
+        (CHUNK_COMMIT_DATA, bytes(commit_data)),
+    ]
+    if extra_edges:
+        edges = struct.pack(f">{len(extra_edges)}I", *extra_edges)
+        chunks.append((CHUNK_EXTRA_EDGES, edges))
+    if bloom_filters is not None:
+        indexes = bytearray(4 * len(oids))
+        end = 0
+        for i, sha1 in enumerate(oids):
+            end += len(bloom_filters[sha1])
+            struct.pack_into(">I", indexes, 4 * i, end)
+        filters = b"".join(bloom_filters[sha1] for sha1 in oids)
+        chunks.append((CHUNK_BLOOM_INDEXES, bytes(indexes)))
+        chunks.append((CHUNK_BLOOM_DATA, bloom.SETTINGS_HEADER + filters))
+    return serialize_chunk_file(SIGNATURE, [VERSION, HASH_VERSION], chunks)
+
+
+def write_commit_graph(*, changed_paths=False):
+    headers = list_commit_headers()
+    for sha1, header in headers.items():
+        for parent in header.parents:
+            if parent not in headers:
+                die_error(f"error: parent {parent} of {sha1} is missing")
+    old_graph = get_commit_graph()
+    bloom_filters = None
+    # keep Bloom filters once a commit-graph has them
+    if changed_paths or (old_graph is not None and old_graph.has_bloom_filters()):
+        bloom_filters = compute_bloom_filters(headers, old_graph)
+    data = serialize_commit_graph(headers, bloom_filters)
+    path = find_commit_graph_file()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    write_file_atomic(path, data)
+    get_commit_graph.cache_clear()
+    logger.debug(f"wrote {len(headers)} commits to {path}")
+
+
+def setup_parser(parser):
+    parser.add_argument("action", choices=["write"], help="write a commit-graph file")
+    parser.add_argument(
+        "--changed-paths",
+        help="compute changed-path Bloom filters for new commits",
+        action="store_true",
+    )
+
+
+def commit_graph(args):
+    if args.action == "write":
+        write_commit_graph(changed_paths=args.changed_paths)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    commit_graph(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 import argparse
 
-from .paths import find_object
+from .refs import resolve_revision
 from .git_objects import Commit
 
 
@@ -17,8 +17,8 @@ def setup_parser(parser):
 
 def commit_tree(args):
     commit_message = input()
-    tree = find_object(args.tree)
-    parents = args.parents or []
+    tree = resolve_revision(args.tree)
+    parents = [str(resolve_revision(p)) for p in args.parents or []]
     commit = Commit.from_tree(tree, parents, commit_message)
     commit.write()
     print(commit.hash())
@@ -1,21 +1,41 @@
 # use configparser to approximate gitconfig format
 
+import functools
 import os
 import pathlib
 from configparser import ConfigParser
 
 from . import paths
+from .lockfile import LockFile
+
+
+@functools.lru_cache(maxsize=4)
+def _load_config(path, mtime_ns, size, ino):
+    config = ConfigParser()
+    config.read(path)
+    return config
+
+
+def read_config_file(path):
+    """the parsed file at path, empty if there is none
+
+    the parse is kept while the file is unchanged, like git's stat_validity;
+    config files are replaced by renaming a lock file, so a rewrite always
+    has another inode
+    """
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return _load_config(path, None, None, None)
+    return _load_config(path, st.st_mtime_ns, st.st_size, st.st_ino)
 
 
 def get_config(section, key):
     config_file_local = paths.find_git_root() / "config"
     config_file_global = pathlib.Path(os.environ["HOME"]) / ".gitconfig"
 
-    config_local = ConfigParser()
-    config_local.read(config_file_local)
-
-    config_global = ConfigParser()
-    config_global.read(config_file_global)
+    config_local = read_config_file(config_file_local)
+    config_global = read_config_file(config_file_global)
 
     try:
         val = config_local[section][key]
@@ -25,3 +45,45 @@ def get_config(section, key):
         except KeyError:
             val = None
     return val
+
+
+def get_config_bool(section, key, default=False):
+    val = get_config(section, key)
+    if val is None:
+        return default
+    return val.strip().lower() in ("true", "yes", "on", "1", "")
+
+
+def set_config(section, key, value):
+    """set a key in .git/config, keeping the rest of the file as it is"""
+    config_file_local = paths.find_git_root() / "config"
+    try:
+        lines = config_file_local.read_text().splitlines(keepends=True)
+    except FileNotFoundError:
+        lines = []
+    if lines and not lines[-1].endswith("\n"):
+        lines[-1] += "\n"
+    new_line = f"\t{key} = {value}\n"
+    in_section = False
+    section_end = None
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith("["):
+            in_section = stripped.strip("[]").strip().lower() == section.lower()
+            if in_section:
+                section_end = i + 1
+            continue
+        if in_section:
+            section_end = i + 1
+            name = stripped.split("=", 1)[0].strip()
+            if name.lower() == key.lower():
+                lines[i] = new_line
+                break
+    else:
+        if section_end is None:
+            lines.append(f"[{section}]\n")
+            section_end = len(lines)
+        lines.insert(section_end, new_line)
+    with LockFile(config_file_local) as lock:
+        lock.write("".join(lines).encode())
+        lock.commit()
@@ -0,0 +1,541 @@
+# a long-running process per repository answering read-only commands
+#
+# the daemon listens on a Unix socket in the git directory and keeps what
+# every new process would read again: the parsed index, the config, the
+# names of the loose objects sorted per fan-out directory, the pack indexes
+# and the objects inflated last. The command line hands cat-file and
+# ls-files to it when it is running, and refs.resolve_revision asks it for
+# abbreviated object names
+#
+# before each request the state is checked against the disk: the index by
+# its stat data and checksum, the config files by their stat data, and the
+# objects by the stat data of each fan-out directory and of objects/pack, so
+# a fan-out directory is listed again only after an object was added to or
+# removed from it
+#
+# requests and replies are pkt-lines; the output of a command comes back in
+# packets starting with a channel byte, like git's side-band
+
+import argparse
+import bisect
+import collections
+import io
+import os
+import signal
+import socket
+import sys
+import time
+import traceback
+
+from . import cat_file
+from . import ls_files
+from . import object_store
+from . import pack
+from . import paths
+from .object_id import ObjectId, hex_length
+from .pkt_line import FLUSH_PKT, MAX_PKT_PAYLOAD, PktLineReader, ProtocolError
+from .pkt_line import pkt_line
+from .staging import keep_parsed_index
+from .util import die_error, get_logger
+
+logger = get_logger(__name__)
+
+SOCKET_NAME = "min-git-daemon.sock"
+# set to anything to make the command line work without a daemon
+NO_DAEMON_ENV = "MIN_GIT_NO_DAEMON"
+
+# the channels of the reply to a command
+STDOUT = b"\x01"
+STDERR = b"\x02"
+EXIT = b"\x03"
+# the exit packet of a command the daemon can not run for the client
+UNSERVED = b"unserved"
+
+# the commands run in the daemon: they neither read stdin nor modify anything
+SERVED_COMMANDS = {
+    "cat-file": (cat_file.setup_parser, cat_file.cat_file),
+    "ls-files": (ls_files.setup_parser, ls_files.ls_files),
+}
+
+# a directory modified this close to being listed may change again without
+# its mtime changing, as file times come from a coarse clock
+RACY_NS = 10**9
+# inflated objects kept, and the largest one worth keeping
+object_cache_bytes = 64 << 20
+max_cached_object = 1 << 20
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "--stop", help="stop the daemon of the repository", action="store_true"
+    )
+
+
+def find_socket():
+    return paths.find_git_root() / SOCKET_NAME
+
+
+def is_fanout_dir(name: str):
+    return len(name) == 2 and not name.strip("0123456789abcdef")
+
+
+# the state kept warm
+
+
+class LooseObjectIndex:
+    """the names of the loose objects, sorted per fan-out directory
+
+    a directory is listed again once its stat data changed, or on every
+    refresh while it was modified too recently to be trusted
+    """
+
+    def __init__(self, object_dir):
+        self.object_dir = os.fspath(object_dir)
+        self._dirs = {}  # "xx" -> (validity or None, sorted hex names)
+
+    def refresh(self):
+        """update the listings, return the fan-out directories which changed"""
+        now = time.time_ns()
+        found = {}
+        try:
+            with os.scandir(self.object_dir) as it:
+                for entry in it:
+                    if is_fanout_dir(entry.name):
+                        try:
+                            found[entry.name] = entry.stat(follow_symlinks=False)
+                        except FileNotFoundError:
+                            pass
+        except FileNotFoundError:
+            pass
+        changed = set(self._dirs) - set(found)
+        for name in changed:
+            del self._dirs[name]
+        for name, st in found.items():
+            validity = (st.st_mtime_ns, st.st_ino)
+            cached = self._dirs.get(name)
+            if cached is not None and cached[0] == validity:
+                continue
+            changed.add(name)
+            if st.st_mtime_ns >= now - RACY_NS:
+                validity = None
+            self._dirs[name] = (validity, self._list(name))
+        return changed
+
+    def _list(self, dir_name):
+        try:
+            names = os.listdir(os.path.join(self.object_dir, dir_name))
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        return sorted(
+            dir_name + name
+            for name in names
+            if len(name) == hex_length - 2 and not name.strip("0123456789abcdef")
+        )
+
+    def find_prefix(self, sha1_prefix: str):
+        """yield the names of loose objects starting with sha1_prefix"""
+        if len(sha1_prefix) >= 2:
+            dir_names = [sha1_prefix[:2]]
+        else:
+            dir_names = sorted(d for d in self._dirs if d.startswith(sha1_prefix))
+        for dir_name in dir_names:
+            _, names = self._dirs.get(dir_name, (None, []))
+            pos = bisect.bisect_left(names, sha1_prefix)
+            while pos < len(names) and names[pos].startswith(sha1_prefix):
+                yield ObjectId.from_hex(names[pos])
+                pos += 1
+
+
+class WarmObjectStore(object_store.ObjectStore):
+    """a loose object store with its object names and recent objects in memory
+
+    refresh() has to be called before each request to pick up changes
+    """
+
+    def __init__(self, store: object_store.LooseObjectStore):
+        self.store = store
+        self.loose = LooseObjectIndex(store.object_dir)
+        self._pack_dir_validity = None
+        self._objects = collections.OrderedDict()  # ObjectId -> raw object
+        self._cached_bytes = 0
+
+    def refresh(self):
+        now = time.time_ns()
+        try:
+            st = os.stat(os.path.join(self.store.object_dir, "pack"))
+            validity = (st.st_mtime_ns, st.st_ino)
+        except FileNotFoundError:
+            st, validity = None, None
+        if validity is None or validity != self._pack_dir_validity:
+            # packs were added or removed, or the multi-pack-index replaced
+            pack.reload_packs()
+            self._drop_objects(lambda sha1: True)
+            if st is not None and st.st_mtime_ns >= now - RACY_NS:
+                validity = None
+            self._pack_dir_validity = validity
+        changed = self.loose.refresh()
+        if changed:
+            # an object may be gone; objects never change, so the others stay
+            self._drop_objects(lambda sha1: sha1.hex()[:2] in changed)
+
+    def _drop_objects(self, predicate):
+        for sha1 in [sha1 for sha1 in self._objects if predicate(sha1)]:
+            self._cached_bytes -= len(self._objects.pop(sha1))
+
+    def _cached(self, sha1):
+        raw = self._objects.get(sha1)
+        if raw is not None:
+            self._objects.move_to_end(sha1)
+        return raw
+
+    def has(self, sha1):
+        return sha1 in self._objects or self.store.has(sha1)
+
+    def read(self, sha1):
+        raw = self._cached(sha1)
+        if raw is not None:
+            return raw
+        raw = self.store.read(sha1)
+        if len(raw) <= max_cached_object:
+            self._objects[sha1] = raw
+            self._cached_bytes += len(raw)
+            while self._cached_bytes > object_cache_bytes:
+                _, evicted = self._objects.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+        return raw
+
+    def read_header(self, sha1):
+        raw = self._cached(sha1)
+        if raw is None:
+            return self.store.read_header(sha1)
+        object_type, size, _ = object_store.split_header(raw)
+        return object_type, size
+
+    def read_chunks(self, sha1):
+        raw = self._cached(sha1)
+        if raw is None:
+            return self.store.read_chunks(sha1)
+        return iter([object_store.split_header(raw)[2]])
+
+    def write(self, raw):
+        return self.store.write(raw)
+
+    def iter(self):
+        return self.store.iter()
+
+    def resolve_prefix(self, sha1_prefix):
+        found = set(self.loose.find_prefix(sha1_prefix))
+        found.update(self.store.pack_set().find_prefix(sha1_prefix))
+        return iter(sorted(found))
+
+
+# the server
+
+
+class SideBandWriter(io.RawIOBase):
+    """writes what it is given to a socket as packets of one channel"""
+
+    def __init__(self, sock, channel: bytes):
+        self._sock = sock
+        self._channel = channel
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        step = MAX_PKT_PAYLOAD - 1
+        for start in range(0, len(data), step):
+            self._sock.sendall(pkt_line(self._channel + data[start : start + step]))
+        return len(data)
+
+
+def make_command_parser():
+    parser = argparse.ArgumentParser(prog="min_git")
+    subparsers = parser.add_subparsers()
+    for name, (setup, func) in SERVED_COMMANDS.items():
+        subparser = subparsers.add_parser(name)
+        setup(subparser)
+        subparser.set_defaults(subcommand=func)
+    return parser
+
+
+def read_request(sock):
+    """the packets of a request up to its flush packet"""
+    reader = PktLineReader(sock.makefile("rb"))
+    return list(iter(reader.read, None))
+
+
+class Daemon:
+    def __init__(self, root):
+        self.root = root
+        self.parser = make_command_parser()
+        self.store = None
+        self.stopping = False
+
+    def keep_state_warm(self):
+        keep_parsed_index()
+        store = object_store.get_object_store()
+        # other stores (sqlite, alternates) are asked as they are
+        if type(store) is object_store.LooseObjectStore:
+            self.store = WarmObjectStore(store)
+            object_store.set_object_store(self.store)
+
+    def refresh(self):
+        if self.store is not None:
+            self.store.refresh()
+
+    def serve(self, listener):
+        while not self.stopping:
+            conn, _ = listener.accept()
+            with conn:
+                try:
+                    self.handle(conn)
+                except (ConnectionError, ProtocolError) as e:
+                    # the client went away; the next one is served anyway
+                    logger.debug(f"request failed: {e}")
+                finally:
+                    os.chdir(self.root)
+
+    def handle(self, conn):
+        request = read_request(conn)
+        if not request:
+            raise ProtocolError("empty request")
+        kind, _, argument = request[0].partition(b" ")
+        if kind == b"stop":
+            self.stopping = True
+            conn.sendall(pkt_line(b"ok") + FLUSH_PKT)
+        elif kind == b"find-object":
+            self.refresh()
+            reply = self.find_object(argument.decode(errors="replace"))
+            conn.sendall(pkt_line(reply) + FLUSH_PKT)
+        elif kind == b"run":
+            self.run(conn, request[1:])
+        else:
+            raise ProtocolError(f"unknown request {kind!r}")
+
+    def find_object(self, sha1_prefix: str):
+        try:
+            sha1 = paths.find_object(sha1_prefix)
+        except paths.SHA1PrefixTooShortError:
+            return b"short"
+        except paths.SHA1NotFoundError:
+            return b"missing"
+        except paths.UmbiguousSHA1PrefixError:
+            return b"ambiguous"
+        return b"found " + sha1.hex().encode()
+
+    def in_repository(self, cwd):
+        try:
+            os.chdir(cwd)
+            return paths.find_repository_root() == self.root
+        except (OSError, paths.NotGitRepositoryError):
+            return False
+
+    def run(self, conn, request):
+        """run a command for the client, with its output sent back"""
+        fields = [packet.partition(b" ") for packet in request]
+        cwd = [os.fsdecode(value) for key, _, value in fields if key == b"cwd"]
+        argv = [os.fsdecode(value) for key, _, value in fields if key == b"arg"]
+        if len(cwd) != 1 or not self.in_repository(cwd[0]):
+            conn.sendall(pkt_line(EXIT + UNSERVED) + FLUSH_PKT)
+            return
+        self.refresh()
+        logger.debug(f"running {argv} in {cwd[0]}")
+        stdout = io.TextIOWrapper(
+            io.BufferedWriter(SideBandWriter(conn, STDOUT)), encoding="utf-8"
+        )
+        stderr = io.TextIOWrapper(
+            io.BufferedWriter(SideBandWriter(conn, STDERR)),
+            encoding="utf-8",
+            errors="backslashreplace",
+            line_buffering=True,
+        )
+        saved = sys.stdin, sys.stdout, sys.stderr
+        sys.stdin = io.TextIOWrapper(io.BytesIO())
+        sys.stdout, sys.stderr = stdout, stderr
+        try:
+            try:
+                args = self.parser.parse_args(argv)
+                args.subcommand(args)
+                code = 0
+            except SystemExit as e:
+                if e.code is None or isinstance(e.code, int):
+                    code = e.code or 0
+                else:
+                    print(e.code, file=sys.stderr)
+                    code = 1
+            except (KeyboardInterrupt, ConnectionError):
+                # stopping, or the client is gone
+                raise
+            except BaseException:
+                # what an uncaught error does to a command run on its own
+                traceback.print_exc()
+                code = 1
+            stdout.flush()
+            stderr.flush()
+        finally:
+            sys.stdin, sys.stdout, sys.stderr = saved
+        conn.sendall(pkt_line(EXIT + b"%d" % code) + FLUSH_PKT)
+
+
+def stop_on_signal(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_daemon(root):
+    socket_path = os.fspath(find_socket())
+    if os.path.exists(socket_path):
+        sock = connect(socket_path)
+        if sock is not None:
+            sock.close()
+            die_error("fatal: a daemon is already running for this repository")
+        os.unlink(socket_path)  # left behind by a daemon which was killed
+    # the commands run here must not ask the daemon themselves
+    os.environ[NO_DAEMON_ENV] = "1"
+    server = Daemon(root)
+    server.keep_state_warm()
+    listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    umask = os.umask(0o077)
+    try:
+        listener.bind(socket_path)
+    except OSError as e:
+        die_error(f"fatal: cannot listen on {socket_path}: {e}")
+    finally:
+        os.umask(umask)
+    listener.listen()
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    logger.debug(f"listening on {socket_path}")
+    try:
+        os.chdir(root)
+        server.serve(listener)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        listener.close()
+        os.unlink(socket_path)
+
+
+def daemon(args):
+    if not hasattr(socket, "AF_UNIX"):
+        die_error("fatal: the daemon needs Unix domain sockets")
+    try:
+        root = paths.find_repository_root()
+    except paths.NotGitRepositoryError as e:
+        die_error(f"fatal: {e}")
+    if not args.stop:
+        run_daemon(root)
+        return
+    sock = connect(os.fspath(find_socket()))
+    if sock is None:
+        die_error("fatal: no daemon is running for this repository")
+    with sock:
+        sock.sendall(pkt_line(b"stop") + FLUSH_PKT)
+        read_request(sock)
+
+
+# the client
+
+
+def connect(socket_path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def connect_to_daemon():
+    """a socket connected to the daemon of the repository, None if there is none"""
+    if os.environ.get(NO_DAEMON_ENV) or not hasattr(socket, "AF_UNIX"):
+        return None
+    try:
+        socket_path = os.fspath(find_socket())
+    except paths.NotGitRepositoryError:
+        return None
+    if not os.path.exists(socket_path):
+        return None
+    return connect(socket_path)
+
+
+def serves(func):
+    """check if the function of a command is run by the daemon"""
+    return any(func is served for _, served in SERVED_COMMANDS.values())
+
+
+def run_command(argv):
+    """run a command in the daemon, return its exit code
+
+    None means there is no daemon or it did not run the command, which is then
+    to be run in this process
+    """
+    sock = connect_to_daemon()
+    if sock is None:
+        return None
+    request = [b"run", b"cwd " + os.fsencode(os.getcwd())]
+    request += [b"arg " + os.fsencode(arg) for arg in argv]
+    written = False
+    with sock:
+        try:
+            sock.sendall(b"".join(pkt_line(p) for p in request) + FLUSH_PKT)
+            reader = PktLineReader(sock.makefile("rb"))
+            for packet in iter(reader.read, None):
+                channel, data = packet[:1], packet[1:]
+                if channel == STDOUT:
+                    sys.stdout.buffer.write(data)
+                elif channel == STDERR:
+                    sys.stdout.buffer.flush()
+                    sys.stderr.buffer.write(data)
+                    sys.stderr.buffer.flush()
+                elif channel == EXIT:
+                    sys.stdout.buffer.flush()
+                    return None if data == UNSERVED else int(data)
+                else:
+                    raise ProtocolError(f"bad channel {channel!r}")
+                written = True
+            raise ProtocolError("no exit code")
+        except (OSError, ProtocolError, ValueError) as e:
+            if not written:
+                logger.debug(f"daemon failed, running the command here: {e}")
+                return None
+            sys.stdout.buffer.flush()
+            die_error(f"fatal: the daemon hung up unexpectedly: {e}")
+
+
+def find_object(sha1_prefix: str):
+    """the object sha1_prefix names, found by the daemon
+
+    returns None if there is no daemon, raises like paths.find_object otherwise;
+    the command line installs it with refs.set_object_name_lookup
+    """
+    sock = connect_to_daemon()
+    if sock is None:
+        return None
+    with sock:
+        try:
+            sock.sendall(pkt_line(b"find-object " + sha1_prefix.encode()) + FLUSH_PKT)
+            reply = PktLineReader(sock.makefile("rb")).read()
+        except (OSError, ProtocolError):
+            return None
+    if reply == b"short":
+        raise paths.SHA1PrefixTooShortError
+    if reply == b"missing":
+        raise paths.SHA1NotFoundError
+    if reply == b"ambiguous":
+        raise paths.UmbiguousSHA1PrefixError
+    if reply is None or not reply.startswith(b"found "):
+        return None
+    return ObjectId.from_hex(reply[len(b"found ") :].decode())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    daemon(args)
+
+
+if __name__ == "__main__":
+    main()
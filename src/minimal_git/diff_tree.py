@@ -0,0 +1,161 @@
+import argparse
+import stat
+import sys
+
+from .util import die_error
+from .refs import resolve_revision
+from .git_objects import load_object
+from .object_id import null_oid
+
+
+def setup_parser(parser):
+    parser.add_argument("-r", help="recurse into sub-trees", action="store_true")
+    parser.add_argument("tree1", metavar="<tree-ish>")
+    parser.add_argument("tree2", metavar="<tree-ish>", nargs="?")
+
+
+def resolve_tree(tree_ish):
+    sha1 = resolve_revision(tree_ish)
+    obj = load_object(sha1)
+    if obj.type_id == "commit":
+        return obj.tree
+    if obj.type_id != "tree":
+        die_error(f"error: {tree_ish} is not a tree-ish object")
+    return sha1
+
+
+def sort_key(entry):
+    # git orders a tree "foo" as if it were named "foo/"
+    if entry.object_type == "tree":
+        return entry.name + "/"
+    return entry.name
+
+
+def tree_entries(sha1):
+    if sha1 is None:
+        return []
+    return list(load_object(sha1))
+
+
+def format_raw(old, new, status, path):
+    old_mode = old.mode if old else 0
+    new_mode = new.mode if new else 0
+    old_sha1 = old.sha1 if old else null_oid
+    new_sha1 = new.sha1 if new else null_oid
+    return f":{old_mode:06o} {new_mode:06o} {old_sha1} {new_sha1} {status}\t{path}\n"
+
+
+def diff_entries(old, new, path, recursive):
+    old_is_tree = old is not None and old.object_type == "tree"
+    new_is_tree = new is not None and new.object_type == "tree"
+    if recursive and (old_is_tree or new_is_tree):
+        yield from iter_tree_changes(
+            old.sha1 if old_is_tree else None,
+            new.sha1 if new_is_tree else None,
+            recursive=recursive,
+            prefix=path + "/",
+        )
+        return
+    if old is None:
+        yield old, new, "A", path
+    elif new is None:
+        yield old, new, "D", path
+    elif stat.S_IFMT(old.mode) != stat.S_IFMT(new.mode):
+        yield old, new, "T", path
+    else:
+        yield old, new, "M", path
+
+
+def iter_tree_changes(old_sha1, new_sha1, *, recursive=False, prefix=""):
+    """yield (old entry, new entry, status, path) between two trees"""
+    # identical subtrees are skipped without being loaded
+    if old_sha1 == new_sha1:
+        return
+    old_entries = tree_entries(old_sha1)
+    new_entries = tree_entries(new_sha1)
+    # both entry lists are sorted in git order, so one merge walk pairs them
+    i, j = 0, 0
+    while i < len(old_entries) or j < len(new_entries):
+        old = old_entries[i] if i < len(old_entries) else None
+        new = new_entries[j] if j < len(new_entries) else None
+        if old is not None and new is not None:
+            old_key, new_key = sort_key(old), sort_key(new)
+            if old_key < new_key:
+                new = None
+            elif new_key < old_key:
+                old = None
+        if old is not None:
+            i += 1
+        if new is not None:
+            j += 1
+        if old is not None and new is not None:
+            if old.sha1 == new.sha1 and old.mode == new.mode:
+                continue
+        name = old.name if old is not None else new.name
+        yield from diff_entries(old, new, prefix + name, recursive)
+
+
+def diff_trees(old_sha1, new_sha1, *, recursive=False):
+    """yield raw diff lines between two trees (None means an empty tree)"""
+    for change in iter_tree_changes(old_sha1, new_sha1, recursive=recursive):
+        yield format_raw(*change)
+
+
+def find_entry(tree_sha1, name):
+    return load_object(tree_sha1).lookup(name)
+
+
+def path_changed(old_sha1, new_sha1, path: str):
+    """check if anything at or below path differs between two trees"""
+    # only the trees along the path are loaded
+    names = [n for n in path.split("/") if n]
+    for i, name in enumerate(names):
+        if old_sha1 == new_sha1:
+            return False
+        old = find_entry(old_sha1, name) if old_sha1 else None
+        new = find_entry(new_sha1, name) if new_sha1 else None
+        is_last = i == len(names) - 1
+        if not is_last:
+            # only a tree can contain the rest of the path
+            old = old if old is not None and old.object_type == "tree" else None
+            new = new if new is not None and new.object_type == "tree" else None
+        if old is None and new is None:
+            return False
+        if old is None or new is None:
+            return True
+        if old.sha1 == new.sha1 and old.mode == new.mode:
+            return False
+        if is_last:
+            return True
+        old_sha1, new_sha1 = old.sha1, new.sha1
+    return old_sha1 != new_sha1
+
+
+def diff_tree(args):
+    out = sys.stdout
+    if args.tree2 is None:
+        commit_sha1 = resolve_revision(args.tree1)
+        commit = load_object(commit_sha1)
+        if commit.type_id != "commit":
+            die_error(f"error: {args.tree1} is not a commit object")
+        if not commit.parents:
+            return
+        out.write(f"{commit_sha1}\n")
+        old_tree = load_object(commit.parents[0]).tree
+        new_tree = commit.tree
+    else:
+        old_tree = resolve_tree(args.tree1)
+        new_tree = resolve_tree(args.tree2)
+    for line in diff_trees(old_tree, new_tree, recursive=args.r):
+        out.write(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    diff_tree(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# EWAH compressed bitmaps as serialized by git's ewah/ewah_io.c
+#
+# Bitmaps are handled as python ints (bit i of the int is bit i of the
+# bitmap), so OR / AND-NOT of whole bitmaps are single int operations.
+
+import struct
+
+WORD_BITS = 64
+ALL_ONES = (1 << WORD_BITS) - 1
+RUNNING_BITS = 32
+LITERAL_BITS = 31
+MAX_RUNNING_LENGTH = (1 << RUNNING_BITS) - 1
+MAX_LITERAL_WORDS = (1 << LITERAL_BITS) - 1
+
+
+class EWAHFormatError(BaseException):
+    pass
+
+
+def to_words(bits: int, bit_size: int):
+    n_words = (bit_size + WORD_BITS - 1) // WORD_BITS
+    data = bits.to_bytes(n_words * 8, byteorder="little")
+    return list(struct.unpack(f"<{n_words}Q", data))
+
+
+def from_words(words):
+    data = struct.pack(f"<{len(words)}Q", *words)
+    return int.from_bytes(data, byteorder="little")
+
+
+def encode(bits: int, bit_size: int) -> bytes:
+    words = to_words(bits, bit_size)
+    buffer = []
+    rlw_pos = 0
+    i = 0
+    while True:
+        run_bit = 0
+        run_length = 0
+        if i < len(words) and words[i] in (0, ALL_ONES):
+            clean = words[i]
+            run_bit = 1 if clean == ALL_ONES else 0
+            while (
+                i < len(words) and words[i] == clean and run_length < MAX_RUNNING_LENGTH
+            ):
+                run_length += 1
+                i += 1
+        literal_start = i
+        while (
+            i < len(words)
+            and words[i] not in (0, ALL_ONES)
+            and i - literal_start < MAX_LITERAL_WORDS
+        ):
+            i += 1
+        rlw_pos = len(buffer)
+        n_literals = i - literal_start
+        buffer.append(run_bit | (run_length << 1) | (n_literals << (1 + RUNNING_BITS)))
+        buffer += words[literal_start:i]
+        if i >= len(words):
+            break
+    header = struct.pack(">II", bit_size, len(buffer))
+    body = struct.pack(f">{len(buffer)}Q", *buffer)
+    return header + body + struct.pack(">I", rlw_pos)
+
+
+def serialized_size(data, offset=0):
+    _, n_words = struct.unpack_from(">II", data, offset)
+    return 8 + 8 * n_words + 4
+
+
+def decode(data, offset=0):
+    """return (bits, bit_size) of the bitmap serialized at offset"""
+    bit_size, n_words = struct.unpack_from(">II", data, offset)
+    buffer = struct.unpack_from(f">{n_words}Q", data, offset + 8)
+    words = []
+    i = 0
+    while i < n_words:
+        rlw = buffer[i]
+        run_bit = rlw & 1
+        run_length = (rlw >> 1) & MAX_RUNNING_LENGTH
+        n_literals = rlw >> (1 + RUNNING_BITS)
+        words += [ALL_ONES if run_bit else 0] * run_length
+        words += buffer[i + 1 : i + 1 + n_literals]
+        i += 1 + n_literals
+    if i != n_words:
+        raise EWAHFormatError("truncated EWAH bitmap")
+    bits = from_words(words)
+    # bits past bit_size may be set by a trailing run of ones
+    return bits & ((1 << bit_size) - 1), bit_size
+
+
+def iter_bits(bits: int):
+    """yield positions of set bits in increasing order"""
+    data = bits.to_bytes((bits.bit_length() + 7) // 8, byteorder="little")
+    for i, byte in enumerate(data):
+        while byte:
+            low = byte & -byte
+            yield 8 * i + low.bit_length() - 1
+            byte ^= low
+
+
+def popcount(bits: int):
+    return bin(bits).count("1")
+
+
+class BitSet:
+    """mutable bitmap with O(1) single bit access, used while walking"""
+
+    def __init__(self, size: int, bits: int = 0):
+        self.size = size
+        self._data = bytearray(bits.to_bytes((size + 7) // 8, byteorder="little"))
+
+    def __contains__(self, pos):
+        return bool(self._data[pos >> 3] & (1 << (pos & 7)))
+
+    def add(self, pos):
+        self._data[pos >> 3] |= 1 << (pos & 7)
+
+    def to_int(self):
+        return int.from_bytes(self._data, byteorder="little")
@@ -0,0 +1,274 @@
+# write history as a git fast-import stream to stdout
+# see Documentation/git-fast-export.txt in git
+
+import argparse
+import sys
+
+from . import refs
+from .util import (
+    die_error,
+    iter_object_content,
+    load_raw_content,
+    quote_path,
+    read_object_header,
+)
+from .commit_graph import load_commit_header
+from .diff_tree import iter_tree_changes
+from .fast_import import read_marks, write_marks
+from .git_objects import peel_object
+from .rev_list import CommitWalker, resolve_commit
+
+
+def setup_parser(parser):
+    parser.add_argument("--all", help="export all refs", action="store_true")
+    parser.add_argument(
+        "--import-marks",
+        metavar="<file>",
+        help="skip objects listed in <file>, exported by an earlier run",
+    )
+    parser.add_argument(
+        "--export-marks", metavar="<file>", help="write all marks to <file> when done"
+    )
+    parser.add_argument(
+        "revisions",
+        nargs="*",
+        metavar="<commit>",
+        help="refs or commits to export (^<commit> or <commit>..<commit> to exclude)",
+    )
+
+
+def peel_tip(ref, sha1):
+    """(object, its type, annotated tag to export on ref or None) of a ref
+
+    fast-import makes a tag of the object named by "from" under the ref
+    refs/tags/<name>, so a tag of a tag or one under another ref cannot be
+    recreated; those refs are exported as the object the tags lead to
+    """
+    tags, target, target_type = peel_object(sha1)
+    if not tags:
+        return target, target_type, None
+    if len(tags) == 1 and ref.startswith("refs/tags/"):
+        return target, target_type, tags[0]
+    sys.stderr.write(f"warning: {ref}: exporting {target} without the tag {sha1}\n")
+    return target, target_type, None
+
+
+def resolve_tip(name):
+    """return the ref name to export a revision under, its commit and its tag"""
+    for ref in (name, f"refs/heads/{name}", f"refs/tags/{name}"):
+        if ref.startswith("refs/"):
+            sha1 = refs.read_ref(ref)
+            if sha1 is not None:
+                target, target_type, tag = peel_tip(ref, sha1)
+                if target_type != "commit":
+                    die_error(f"error: {name} is not a commit object")
+                return ref, target, tag
+    # like git, a commit given by its name is exported under that name
+    return name, resolve_commit(name), None
+
+
+def list_all_tips():
+    """(ref, commit) of the refs naming commits, (ref, tag, object) of tags
+
+    tags of blobs are exported with the blob; refs to trees are left out
+    """
+    tips = []
+    tags = []
+    for ref, sha1 in refs.list_refs():
+        target, target_type, tag = peel_tip(ref, sha1)
+        if target_type == "commit":
+            tips.append((ref, target))
+        elif tag is None or target_type != "blob":
+            sys.stderr.write(f"warning: skipping {ref}, which is not a commit\n")
+            continue
+        if tag is not None:
+            tags.append((ref, tag, target))
+    return tips, tags
+
+
+def parse_tips(revisions):
+    tips = []
+    tags = []
+    exclude = []
+    for rev in revisions:
+        if ".." in rev:
+            a, b = rev.split("..", 1)
+            exclude.append(resolve_tip(a)[1])
+            rev = b
+        elif rev.startswith("^"):
+            exclude.append(resolve_tip(rev[1:])[1])
+            continue
+        ref, commit, tag = resolve_tip(rev)
+        tips.append((ref, commit))
+        if tag is not None:
+            tags.append((ref, tag, commit))
+    return tips, tags, exclude
+
+
+def topo_order(parents, tips):
+    """yield (commit, ref) with parents before their children
+
+    parents maps the commits to export to their parents; each commit is
+    exported on the ref of the first tip it is reached from
+    """
+    done = set()
+    for ref, tip in tips:
+        stack = [(tip, False)]
+        while stack:
+            sha1, parents_done = stack.pop()
+            if parents_done:
+                yield sha1, ref
+                continue
+            if sha1 in done or sha1 not in parents:
+                continue
+            done.add(sha1)
+            stack.append((sha1, True))
+            # the first parent is exported first
+            for parent in reversed(parents[sha1]):
+                if parent not in done:
+                    stack.append((parent, False))
+
+
+def parse_raw_commit(raw: bytes):
+    """return the header lines (without continuation lines) and message"""
+    content = raw.partition(b"\x00")[2]
+    header, _, message = content.partition(b"\n\n")
+    fields = {}
+    for line in header.split(b"\n"):
+        if not line.startswith(b" "):
+            key, _, value = line.partition(b" ")
+            fields.setdefault(key, value)
+    return fields, message
+
+
+class FastExport:
+    def __init__(self, out, marks=None):
+        self._out = out
+        self.marks = marks or {}
+        self._last_mark = max(self.marks.values(), default=0)
+        self._last_on_ref = {}  # ref -> last commit exported on it
+
+    def _new_mark(self, sha1):
+        self._last_mark += 1
+        self.marks[sha1] = self._last_mark
+        return self._last_mark
+
+    def _commit_ish(self, sha1):
+        if sha1 in self.marks:
+            return b":%d" % self.marks[sha1]
+        return sha1.hex().encode()
+
+    def export_blob(self, sha1):
+        if sha1 in self.marks:
+            return
+        out = self._out
+        _, size = read_object_header(sha1)
+        out.write(b"blob\nmark :%d\ndata %d\n" % (self._new_mark(sha1), size))
+        # blobs are copied in chunks instead of being held in memory
+        for chunk in iter_object_content(sha1):
+            out.write(chunk)
+        out.write(b"\n")
+
+    def file_changes(self, parents, tree):
+        """D lines first (so that a file can become a directory), then M lines"""
+        parent_tree = load_commit_header(parents[0]).tree if parents else None
+        deletions = []
+        modifications = []
+        # unchanged subtrees are skipped without being read
+        changes = iter_tree_changes(parent_tree, tree, recursive=True)
+        for _, new, status, path in changes:
+            if status == "D":
+                deletions.append(b"D %s\n" % quote_path(path))
+                continue
+            if new.object_type == "commit":  # submodules are given by object name
+                data_ref = new.sha1.hex().encode()
+            else:
+                self.export_blob(new.sha1)
+                data_ref = b":%d" % self.marks[new.sha1]
+            path = quote_path(path)
+            modifications.append(b"M %o %s %s\n" % (new.mode, data_ref, path))
+        return deletions + modifications
+
+    def export_commit(self, sha1, ref):
+        header = load_commit_header(sha1)
+        fields, message = parse_raw_commit(load_raw_content(sha1))
+        changes = self.file_changes(header.parents, header.tree)
+
+        ref_b = ref.encode()
+        lines = []
+        if not header.parents and ref in self._last_on_ref:
+            # the importer would otherwise build on the branch's last commit
+            lines.append(b"reset %s\n" % ref_b)
+        lines.append(b"commit %s\nmark :%d\n" % (ref_b, self._new_mark(sha1)))
+        lines.append(b"author %s\n" % fields[b"author"])
+        lines.append(b"committer %s\n" % fields[b"committer"])
+        if b"encoding" in fields:
+            lines.append(b"encoding %s\n" % fields[b"encoding"])
+        lines.append(b"data %d\n%s\n" % (len(message), message))
+        if header.parents:
+            if self._last_on_ref.get(ref) != header.parents[0]:
+                lines.append(b"from %s\n" % self._commit_ish(header.parents[0]))
+            for parent in header.parents[1:]:
+                lines.append(b"merge %s\n" % self._commit_ish(parent))
+        lines += changes
+        lines.append(b"\n")
+        self._out.write(b"".join(lines))
+        self._last_on_ref[ref] = sha1
+
+    def export_tag(self, ref, sha1, target):
+        """a tag command recreating the annotated tag sha1 as ref"""
+        if read_object_header(target)[0] == "blob":
+            self.export_blob(target)
+        fields, message = parse_raw_commit(load_raw_content(sha1))
+        lines = [b"tag %s\n" % ref[len("refs/tags/") :].encode()]
+        lines.append(b"from %s\n" % self._commit_ish(target))
+        if b"tagger" in fields:
+            lines.append(b"tagger %s\n" % fields[b"tagger"])
+        lines.append(b"data %d\n%s\n" % (len(message), message))
+        self._out.write(b"".join(lines))
+
+    def export(self, tips, exclude, tags=()):
+        # only commit ids and parents are kept for the whole history
+        walker = CommitWalker([tip for _, tip in tips], exclude)
+        parents = {sha1: header.parents for sha1, header in walker}
+        for sha1, ref in topo_order(parents, tips):
+            self.export_commit(sha1, ref)
+        tag_refs = {ref for ref, _, _ in tags}
+        for ref, tip in tips:
+            if self._last_on_ref.get(ref) != tip and ref not in tag_refs:
+                from_commit = self._commit_ish(tip)
+                self._out.write(b"reset %s\nfrom %s\n\n" % (ref.encode(), from_commit))
+        for ref, sha1, target in tags:
+            self.export_tag(ref, sha1, target)
+
+
+def fast_export(args):
+    if args.all:
+        (tips, tags), exclude = list_all_tips(), []
+    else:
+        tips, tags, exclude = parse_tips(args.revisions)
+    if not tips and not tags:
+        die_error("fatal: no commits to export (give <commit> or --all)")
+    marks = {}
+    if args.import_marks:
+        marks = {sha1: mark for mark, sha1 in read_marks(args.import_marks).items()}
+        # commits of an earlier export are not exported again
+        exclude += [s for s in marks if read_object_header(s)[0] == "commit"]
+    exporter = FastExport(sys.stdout.buffer, marks)
+    exporter.export(tips, exclude, tags)
+    sys.stdout.buffer.flush()
+    if args.export_marks:
+        write_marks(
+            args.export_marks, {mark: sha1 for sha1, mark in exporter.marks.items()}
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    fast_export(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,531 @@
+# import history from a git fast-import stream read on stdin
+# see Documentation/git-fast-import.txt in git for the stream format
+
+import argparse
+import hashlib
+import os
+import stat
+import sys
+import zlib
+
+from . import object_store
+from . import pack
+from . import paths
+from . import refs
+from .util import decode_path, die_error, get_logger
+from .commit_graph import load_commit_header
+from .merge_base import is_ancestor
+from .diff_tree import sort_key
+from .git_objects import TreeEntry, iter_tree_entries
+from .object_id import ObjectId, null_oid
+
+logger = get_logger(__name__)
+
+directory_mode = 0o040000
+
+
+class FastImportError(BaseException):
+    pass
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "--import-marks", metavar="<file>", help="load marks from <file> first"
+    )
+    parser.add_argument(
+        "--export-marks", metavar="<file>", help="write all marks to <file> when done"
+    )
+    parser.add_argument(
+        "--force",
+        help="update branches even if that discards existing commits",
+        action="store_true",
+    )
+
+
+class StreamReader:
+    def __init__(self, f):
+        self._f = f
+        self._pending = None
+
+    def read_line(self):
+        """next line without its LF, or None at the end of the stream"""
+        if self._pending is not None:
+            line, self._pending = self._pending, None
+            return line
+        while True:
+            line = self._f.readline()
+            if not line:
+                return None
+            if not line.startswith(b"#"):
+                return line[:-1] if line.endswith(b"\n") else line
+
+    def unread_line(self, line):
+        self._pending = line
+
+    def read_optional(self, prefix: bytes):
+        """argument of the next line if it starts with prefix, else None"""
+        line = self.read_line()
+        if line is not None and line.startswith(prefix):
+            return line[len(prefix) :]
+        if line is not None:
+            self.unread_line(line)
+        return None
+
+    def read_data(self, line):
+        """payload of a data command, given the command line"""
+        if line is None or not line.startswith(b"data "):
+            raise FastImportError(f"expected data command, got {line!r}")
+        length = line[len(b"data ") :]
+        if length.startswith(b"<<"):
+            delimiter = length[2:] + b"\n"
+            lines = []
+            while True:
+                data_line = self._f.readline()
+                if not data_line:
+                    raise FastImportError("unterminated delimited data")
+                if data_line == delimiter:
+                    return b"".join(lines)
+                lines.append(data_line)
+        n = int(length)
+        data = self._f.read(n)
+        if len(data) != n:
+            raise FastImportError("truncated data")
+        # an LF after the data is optional
+        if self._f.peek(1)[:1] == b"\n":
+            self._f.read(1)
+        return data
+
+
+class TreeNode:
+    """a directory of an in-memory tree
+
+    entries map names to (mode, ObjectId) for files and (mode, TreeNode)
+    for directories; they are read from the tree object on first use
+    """
+
+    __slots__ = ("sha1", "entries")
+
+    def __init__(self, sha1=None):
+        self.sha1 = sha1  # None while the directory differs from any tree object
+        self.entries = None if sha1 is not None else {}
+
+
+class Branch:
+    def __init__(self, tip, root):
+        self.tip = tip
+        self.root = root
+
+
+class FastImport:
+    def __init__(self, reader, pack_file, store):
+        """objects go to one new pack, or straight to store if pack_file is None"""
+        self._reader = reader
+        self._f = pack_file
+        self._store = store
+        self._writer = pack.PackWriter(pack_file, None) if pack_file else None
+        # sha1 -> (start, end) of its entry in the new pack (None if in store)
+        self._written = {}
+        self._commit_trees = {}  # commits of this import -> their trees
+        self.marks = {}
+        self.branches = {}
+        self.tags = {}  # refs/tags/<name> -> tag object
+        self.n_commits = 0
+
+    @property
+    def n_objects(self):
+        return len(self._written)
+
+    # objects
+
+    def has_object(self, sha1):
+        return sha1 in self._written or self._store.has(sha1)
+
+    def write_object(self, object_type, content: bytes):
+        header = f"{object_type} {len(content)}\0".encode()
+        h = hashlib.sha1(header)
+        h.update(content)
+        sha1 = ObjectId(h.digest())
+        if self.has_object(sha1):
+            return sha1
+        if self._writer is None:
+            self._store.write(header + content)
+            self._written[sha1] = None
+        else:
+            start = self._writer.size
+            self._writer.add_object(sha1, object_type, content)
+            self._written[sha1] = (start, self._writer.size)
+        return sha1
+
+    def read_object(self, sha1):
+        """content of an object, which may be in the pack being written"""
+        if self._written.get(sha1) is None:
+            return self._store.read(sha1).partition(b"\x00")[2]
+        start, end = self._written[sha1]
+        self._f.flush()
+        entry = os.pread(self._f.fileno(), end - start, start)
+        _, _, pos = pack.decode_entry_header(entry, 0)
+        return zlib.decompress(entry[pos:])
+
+    def object_type(self, sha1):
+        """type of an object, which may be in the pack being written"""
+        if self._written.get(sha1) is None:
+            return self._store.read_header(sha1)[0]
+        start, end = self._written[sha1]
+        self._f.flush()
+        # a type and size header fits in 16 bytes
+        header = os.pread(self._f.fileno(), min(end - start, 16), start)
+        return pack.type_names[pack.decode_entry_header(header, 0)[0]]
+
+    # in-memory trees
+
+    def load_entries(self, node):
+        if node.entries is None:
+            node.entries = {}
+            for e in iter_tree_entries(self.read_object(node.sha1)):
+                value = TreeNode(e.sha1) if stat.S_ISDIR(e.mode) else e.sha1
+                node.entries[e.name] = (e.mode, value)
+        return node.entries
+
+    def set_path(self, root, path, mode, sha1):
+        *dir_names, name = path.split("/")
+        node = root
+        for dir_name in dir_names:
+            entries = self.load_entries(node)
+            node.sha1 = None
+            _, child = entries.get(dir_name, (None, None))
+            if not isinstance(child, TreeNode):
+                child = TreeNode()
+                entries[dir_name] = (directory_mode, child)
+            node = child
+        entries = self.load_entries(node)
+        node.sha1 = None
+        entries[name] = (mode, TreeNode(sha1) if stat.S_ISDIR(mode) else sha1)
+
+    def remove_path(self, node, names):
+        """remove names[0]/names[1]/..., returning whether anything changed"""
+        entries = self.load_entries(node)
+        if names[0] not in entries:
+            return False
+        if len(names) > 1:
+            _, child = entries[names[0]]
+            if not isinstance(child, TreeNode):
+                return False
+            if not self.remove_path(child, names[1:]):
+                return False
+            # directories left empty disappear
+            if not child.entries:
+                del entries[names[0]]
+        else:
+            del entries[names[0]]
+        node.sha1 = None
+        return True
+
+    def write_tree(self, node):
+        """write the changed directories of a tree bottom up"""
+        if node.sha1 is not None:
+            return node.sha1
+        tree_entries = []
+        for name, (mode, value) in node.entries.items():
+            if isinstance(value, TreeNode):
+                if value.sha1 is None and not value.entries:
+                    continue
+                value = self.write_tree(value)
+            tree_entries.append(TreeEntry(mode, name, value))
+        tree_entries.sort(key=sort_key)
+        content = b"".join(e.serialize() for e in tree_entries)
+        node.sha1 = self.write_object("tree", content)
+        return node.sha1
+
+    # commands
+
+    def resolve_commit(self, commit_ish: bytes):
+        name = commit_ish.decode()
+        # "refs/heads/x^0" is how streams continue a branch of an earlier import
+        if name.endswith("^0"):
+            name = name[:-2]
+        if name.startswith(":"):
+            try:
+                return self.marks[int(name[1:])]
+            except (KeyError, ValueError):
+                raise FastImportError(f"unknown mark: {name}")
+        if name in self.branches and self.branches[name].tip is not None:
+            return self.branches[name].tip
+        sha1 = refs.read_ref(name) if name.startswith("refs/") else None
+        return sha1 or paths.find_object(name)
+
+    def commit_root(self, commit):
+        if commit == null_oid:
+            return TreeNode()
+        tree = self._commit_trees.get(commit)
+        if tree is None:
+            tree = load_commit_header(commit).tree
+        return TreeNode(tree)
+
+    def get_branch(self, name):
+        # like git, a branch not mentioned before starts without parents
+        # even if the ref exists; streams continue one with "from"
+        if name not in self.branches:
+            refs.check_ref_name(name)
+            self.branches[name] = Branch(None, TreeNode())
+        return self.branches[name]
+
+    def read_mark(self):
+        mark = self._reader.read_optional(b"mark :")
+        # original-oid only matters to other tools
+        self._reader.read_optional(b"original-oid ")
+        return int(mark) if mark is not None else None
+
+    def read_data(self):
+        return self._reader.read_data(self._reader.read_line())
+
+    def read_blob_ref(self, dataref: bytes):
+        if dataref == b"inline":
+            return self.write_object("blob", self.read_data())
+        if dataref.startswith(b":"):
+            try:
+                return self.marks[int(dataref[1:])]
+            except (KeyError, ValueError):
+                raise FastImportError(f"unknown mark: {dataref.decode()}")
+        return ObjectId.from_hex(dataref.decode())
+
+    def file_modify(self, root, line):
+        _, mode, dataref, path = line.split(b" ", 3)
+        mode = int(mode, base=8)
+        if mode in (0o644, 0o755):
+            mode |= stat.S_IFREG
+        sha1 = self.read_blob_ref(dataref)
+        self.set_path(root, decode_path(path), mode, sha1)
+
+    def cmd_blob(self):
+        mark = self.read_mark()
+        sha1 = self.write_object("blob", self.read_data())
+        if mark is not None:
+            self.marks[mark] = sha1
+
+    def cmd_commit(self, ref):
+        reader = self._reader
+        branch = self.get_branch(ref)
+        mark = self.read_mark()
+        author = reader.read_optional(b"author ")
+        committer = reader.read_optional(b"committer ")
+        if committer is None:
+            raise FastImportError(f"missing committer in commit to {ref}")
+        encoding = reader.read_optional(b"encoding ")
+        message = reader.read_data(reader.read_line())
+
+        parents = []
+        from_commit = reader.read_optional(b"from ")
+        if from_commit is not None:
+            parent = self.resolve_commit(from_commit)
+            # continuing the branch keeps the directories loaded so far
+            if parent != branch.tip:
+                branch.root = self.commit_root(parent)
+            if parent != null_oid:
+                parents.append(parent)
+        elif branch.tip is not None:
+            parents.append(branch.tip)
+        while True:
+            merge = reader.read_optional(b"merge ")
+            if merge is None:
+                break
+            parents.append(self.resolve_commit(merge))
+
+        while True:
+            line = reader.read_line()
+            if line is None or line == b"":
+                break
+            if line.startswith(b"M "):
+                self.file_modify(branch.root, line)
+            elif line.startswith(b"D "):
+                names = decode_path(line[2:]).split("/")
+                self.remove_path(branch.root, names)
+            elif line == b"deleteall":
+                branch.root = TreeNode()
+            else:
+                reader.unread_line(line)
+                break
+
+        tree = self.write_tree(branch.root)
+        lines = [b"tree %s\n" % tree.hex().encode()]
+        lines += [b"parent %s\n" % p.hex().encode() for p in parents]
+        lines.append(b"author %s\n" % (author or committer))
+        lines.append(b"committer %s\n" % committer)
+        if encoding is not None:
+            lines.append(b"encoding %s\n" % encoding)
+        lines += [b"\n", message]
+        sha1 = self.write_object("commit", b"".join(lines))
+        self._commit_trees[sha1] = tree
+        branch.tip = sha1
+        if mark is not None:
+            self.marks[mark] = sha1
+        self.n_commits += 1
+
+    def cmd_reset(self, ref):
+        from_commit = self._reader.read_optional(b"from ")
+        refs.check_ref_name(ref)
+        if from_commit is None:
+            self.branches[ref] = Branch(None, TreeNode())
+        else:
+            tip = self.resolve_commit(from_commit)
+            self.branches[ref] = Branch(tip, self.commit_root(tip))
+
+    def cmd_tag(self, name):
+        reader = self._reader
+        ref = f"refs/tags/{name}"
+        refs.check_ref_name(ref)
+        mark = reader.read_optional(b"mark :")
+        from_object = reader.read_optional(b"from ")
+        if from_object is None:
+            raise FastImportError(f"missing from in tag {name}")
+        reader.read_optional(b"original-oid ")
+        tagger = reader.read_optional(b"tagger ")
+        message = reader.read_data(reader.read_line())
+        target = self.resolve_commit(from_object)
+        lines = [
+            b"object %s\n" % target.hex().encode(),
+            b"type %s\n" % self.object_type(target).encode(),
+            b"tag %s\n" % name.encode(),
+        ]
+        if tagger is not None:
+            lines.append(b"tagger %s\n" % tagger)
+        lines += [b"\n", message]
+        sha1 = self.write_object("tag", b"".join(lines))
+        self.tags[ref] = sha1
+        if mark is not None:
+            self.marks[int(mark)] = sha1
+
+    def run(self):
+        while True:
+            line = self._reader.read_line()
+            if line is None or line == b"done":
+                break
+            if not line:
+                continue
+            try:
+                self.run_command(line)
+            except (ValueError, IndexError) as e:
+                # a bad number, a short line or a path which is no UTF-8
+                command = line.partition(b" ")[0].decode(errors="replace")
+                raise FastImportError(f"malformed {command} command: {e}")
+
+    def run_command(self, line):
+        command, _, arg = line.partition(b" ")
+        if command == b"blob":
+            self.cmd_blob()
+        elif command == b"commit":
+            self.cmd_commit(arg.decode())
+        elif command == b"reset":
+            self.cmd_reset(arg.decode())
+        elif command == b"tag":
+            self.cmd_tag(arg.decode())
+        elif command == b"progress":
+            sys.stdout.buffer.write(line + b"\n")
+            sys.stdout.flush()
+        elif command == b"checkpoint":
+            pass  # everything is made visible at the end of the import
+        elif command == b"option":
+            pass  # options are addressed to other importers
+        elif command == b"feature":
+            if arg not in (b"done", b"date-format=raw"):
+                raise FastImportError(f"unsupported feature: {arg.decode()}")
+        else:
+            raise FastImportError(f"unsupported command: {line.decode()}")
+
+    def finish(self, tmp_pack_path, *, force=False):
+        """make the new objects visible, then point the branches and tags at them
+
+        return False if a branch was left alone to not lose commits
+        """
+        if self._writer is not None and self._written:
+            checksum = self._writer.finish()
+            self._f.close()
+            pack.install_pack(tmp_pack_path, self._writer.entries, checksum)
+            pack.reload_packs()
+        elif self._writer is not None:
+            self._f.close()
+            os.remove(tmp_pack_path)
+        ok = True
+        for name, branch in sorted(self.branches.items()):
+            if branch.tip is None:
+                continue
+            old = refs.read_ref(name)
+            if not force and old is not None and not is_ancestor(old, branch.tip):
+                sys.stderr.write(
+                    f"warning: Not updating {name}"
+                    f" (new tip {branch.tip} does not contain {old})\n"
+                )
+                ok = False
+                continue
+            refs.write_ref(name, branch.tip)
+        # like git, tags are replaced without asking
+        for name, sha1 in sorted(self.tags.items()):
+            refs.write_ref(name, sha1)
+        return ok
+
+
+def read_marks(path):
+    marks = {}
+    with open(path) as f:
+        for line in f:
+            try:
+                mark, sha1 = line.split()
+                marks[int(mark.lstrip(":"))] = ObjectId.from_hex(sha1)
+            except ValueError:
+                raise FastImportError(f"corrupt mark line: {line.rstrip()}")
+    return marks
+
+
+def write_marks(path, marks):
+    with open(path, "w") as f:
+        for mark, sha1 in sorted(marks.items()):
+            f.write(f":{mark} {sha1}\n")
+
+
+def fast_import(args):
+    store = object_store.get_object_store()
+    tmp_pack_path = pack_file = None
+    # only the loose store reads packs; other stores get the objects directly
+    if isinstance(store.local, object_store.LooseObjectStore):
+        pack_dir = pack.find_pack_dir()
+        pack_dir.mkdir(parents=True, exist_ok=True)
+        tmp_pack_path = pack_dir / f"tmp_pack_{os.getpid()}"
+        pack_file = open(tmp_pack_path, "w+b")
+    importer = FastImport(StreamReader(sys.stdin.buffer), pack_file, store)
+    try:
+        try:
+            if args.import_marks:
+                importer.marks.update(read_marks(args.import_marks))
+            # one transaction for the stream, committed before refs move
+            with store.batch():
+                importer.run()
+        except (
+            FastImportError,
+            paths.SHA1NotFoundError,
+            refs.InvalidRefNameError,
+        ) as e:
+            die_error(f"fatal: {e}")
+        ok = importer.finish(tmp_pack_path, force=args.force)
+    finally:
+        # an installed pack was renamed, so this only cleans up after errors
+        if pack_file is not None:
+            pack_file.close()
+            if os.path.exists(tmp_pack_path):
+                os.remove(tmp_pack_path)
+    if args.export_marks:
+        write_marks(args.export_marks, importer.marks)
+    logger.debug(
+        f"imported {importer.n_objects} objects ({importer.n_commits} commits)"
+    )
+    if not ok:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    fast_import(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+# download objects and refs from another repository
+# see Documentation/git-fetch.txt in git
+#
+# the other repository is reached by running upload-pack on it and speaking
+# the pack protocol over its stdin and stdout; only the commits not already
+# here are negotiated, so an incremental fetch costs about the new history
+
+import argparse
+import itertools
+import mmap
+import os
+import pathlib
+import shlex
+import subprocess
+import sys
+
+from . import pack
+from . import paths
+from . import refs
+from .config import get_config
+from .merge_base import is_ancestor
+from .object_id import ObjectId, null_oid
+from .pkt_line import FLUSH_PKT, PktLineReader, ProtocolError, pkt_line
+from .rev_list import CommitWalker
+from .util import die_error, get_logger, read_object_header
+
+logger = get_logger(__name__)
+
+HAVES_PER_ROUND = 32
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "--upload-pack",
+        dest="upload_pack",
+        metavar="<upload-pack>",
+        help="command to run on the other side instead of min-git upload-pack",
+    )
+    parser.add_argument(
+        "repository",
+        nargs="?",
+        metavar="<repository>",
+        help="path of the repository (remote.origin.url by default)",
+    )
+
+
+def spawn_upload_pack(path, upload_pack=None):
+    if upload_pack is None:
+        command = [sys.executable, "-m", "minimal_git.min_git", "upload-pack"]
+    else:
+        command = shlex.split(upload_pack)
+    return subprocess.Popen(
+        command + [path], stdin=subprocess.PIPE, stdout=subprocess.PIPE
+    )
+
+
+def read_advertisement(reader):
+    """return the advertised refs as {name: sha1} and the branch of HEAD"""
+    advertised = {}
+    head = None
+    for i, line in enumerate(iter(reader.read_line, None)):
+        if i == 0:
+            line, _, capabilities = line.partition(b"\0")
+            for capability in capabilities.decode().split():
+                if capability.startswith("symref=HEAD:"):
+                    head = capability[len("symref=HEAD:") :]
+        sha1, _, name = line.decode().partition(" ")
+        # peeled tags and the placeholder of an empty repository
+        if name.endswith("^{}"):
+            continue
+        try:
+            advertised[name] = ObjectId.from_hex(sha1)
+        except ValueError:
+            raise ProtocolError(f"invalid ref advertisement {line!r}")
+    return advertised, head
+
+
+def send_haves(reader, out):
+    """send the local commits newest first until the remote knows one"""
+    tips = [
+        sha1
+        for _, sha1 in refs.list_refs()
+        if read_object_header(sha1)[0] == "commit"
+    ]
+    walker = iter(CommitWalker(dict.fromkeys(tips)))
+    while True:
+        batch = [sha1 for sha1, _ in itertools.islice(walker, HAVES_PER_ROUND)]
+        if not batch:
+            return
+        for sha1 in batch:
+            out.write(pkt_line(b"have %s\n" % sha1.hex().encode()))
+        out.write(FLUSH_PKT)
+        out.flush()
+        response = reader.read_line()
+        if response is not None and response.startswith(b"ACK "):
+            return
+        if response != b"NAK":
+            raise ProtocolError(f"expected ACK/NAK, got {response!r}")
+
+
+def skip_acknowledgements(f):
+    """read the ACK and NAK lines left before the pack and return its start
+
+    git upload-pack acknowledges every common commit among the haves, not
+    only the first one, so there may be more of them than were waited for
+    """
+    while True:
+        start = f.read(4)
+        if start == pack.PACK_SIGNATURE or len(start) < 4:
+            return start
+        try:
+            line = f.read(int(start, 16) - 4)
+        except ValueError:
+            raise ProtocolError(f"bad packet length {start!r}")
+        if not line.startswith((b"ACK ", b"NAK")):
+            raise ProtocolError(f"expected ACK/NAK, got {line!r}")
+
+
+def receive_pack(f, start=b""):
+    """store the pack read from f and return the installed pack"""
+    tmp_pack_path = pack.find_pack_dir() / f"tmp_pack_{os.getpid()}"
+    try:
+        with open(tmp_pack_path, "w+b") as tmp:
+            tmp.write(start)
+            for chunk in iter(lambda: f.read(1 << 16), b""):
+                tmp.write(chunk)
+            tmp.flush()
+            if tmp.tell() == 0:
+                raise pack.PackFormatError("the remote end hung up unexpectedly")
+            with mmap.mmap(tmp.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                entries, checksum = pack.index_pack(data)
+        installed = pack.install_pack(tmp_pack_path, entries, checksum)
+    except BaseException:
+        if tmp_pack_path.exists():
+            os.unlink(tmp_pack_path)
+        raise
+    pack.reload_packs()
+    logger.debug(f"received {len(entries)} objects")
+    return installed
+
+
+def fetch_pack(path, upload_pack=None, names=None):
+    """get what is missing of the refs of the repository at path
+
+    only the refs called names are fetched if given; returns the advertised
+    refs as {name: sha1} and the branch of HEAD
+    """
+    process = spawn_upload_pack(path, upload_pack)
+    out = process.stdin
+    reader = PktLineReader(process.stdout)
+    try:
+        advertised, head = read_advertisement(reader)
+        wanted = advertised if names is None else names
+        wants = dict.fromkeys(
+            sha1
+            for sha1 in (advertised[name] for name in wanted if name in advertised)
+            if sha1 != null_oid and not paths.has_object(sha1)
+        )
+        for sha1 in wants:
+            out.write(pkt_line(b"want %s\n" % sha1.hex().encode()))
+        out.write(FLUSH_PKT)
+        out.flush()
+        if wants:
+            send_haves(reader, out)
+            out.write(pkt_line(b"done\n"))
+            out.flush()
+            start = skip_acknowledgements(process.stdout)
+            receive_pack(process.stdout, start)
+    except BrokenPipeError:
+        raise ProtocolError("the remote end hung up unexpectedly")
+    finally:
+        # closing stdin also ends an upload-pack still waiting for us
+        try:
+            out.close()
+        except BrokenPipeError:
+            pass
+        status = process.wait()
+    if status != 0:
+        raise ProtocolError("the remote end hung up unexpectedly")
+    return advertised, head
+
+
+def update_tracking_refs(remote, advertised):
+    """point refs/remotes/<remote>/* and new tags at what was fetched
+
+    returns a summary line for each ref that changed, like git fetch prints
+    """
+    summary = []
+    for name, sha1 in sorted(advertised.items()):
+        if name.startswith("refs/heads/"):
+            branch = name[len("refs/heads/") :]
+            local_name = f"refs/remotes/{remote}/{branch}"
+            short_name = f"{remote}/{branch}"
+            old = refs.read_ref(local_name)
+            if old == sha1:
+                continue
+            if old is None:
+                flag, what = "*", "[new branch]"
+            elif is_ancestor(old, sha1):
+                flag, what = " ", f"{old.hex()[:7]}..{sha1.hex()[:7]}"
+            else:
+                flag, what = "+", f"{old.hex()[:7]}...{sha1.hex()[:7]}"
+                short_name += "  (forced update)"
+        elif name.startswith("refs/tags/"):
+            branch = short_name = name[len("refs/tags/") :]
+            local_name = name
+            # tags are not moved once they exist here
+            if refs.read_ref(local_name) is not None:
+                continue
+            flag, what = "*", "[new tag]"
+        else:
+            continue
+        refs.write_ref(local_name, sha1)
+        summary.append(f" {flag} {what:<17} {branch:<10} -> {short_name}")
+    return summary
+
+
+def write_fetch_head(sha1, url):
+    """record what a fetch of a repository without a remote brought"""
+    with open(os.path.join(refs.find_git_dir(), "FETCH_HEAD"), "w") as f:
+        f.write(f"{sha1}\t\t{url}\n")
+
+
+def is_origin(path, origin_url):
+    if origin_url is None:
+        return False
+    return path == origin_url or os.path.realpath(path) == os.path.realpath(origin_url)
+
+
+def fetch(args):
+    origin_url = get_config('remote "origin"', "url")
+    path = args.repository
+    if path is None:
+        path = origin_url
+        if path is None:
+            die_error("fatal: no remote repository specified.")
+    # like git, a repository given by path only fetches its HEAD into
+    # FETCH_HEAD and leaves the refs of the remote named origin alone
+    to_origin = is_origin(path, origin_url)
+    try:
+        paths.find_repository_root()
+        names = None if to_origin else ["HEAD"]
+        advertised, _ = fetch_pack(path, args.upload_pack, names)
+    except (paths.NotGitRepositoryError, ProtocolError, pack.PackFormatError) as e:
+        die_error(f"fatal: {e}")
+    if to_origin:
+        summary = update_tracking_refs("origin", advertised)
+    elif "HEAD" in advertised:
+        write_fetch_head(advertised["HEAD"], path)
+        summary = [f" * {'branch':<17} {'HEAD':<10} -> FETCH_HEAD"]
+    else:
+        die_error("fatal: couldn't find remote ref HEAD")
+    if summary:
+        print(f"From {pathlib.Path(path).resolve()}", file=sys.stderr)
+        print("\n".join(summary), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    fetch(args)
+
+
+if __name__ == "__main__":
+    main()
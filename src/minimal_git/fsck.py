@@ -0,0 +1,234 @@
+import argparse
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import sys
+import time
+import zlib
+
+from . import object_store
+from . import pack
+from . import paths
+from . import refs
+from .util import get_logger
+from .git_objects import UnknownObjectTypeError, parse_object, parse_tag_target
+from .mode import is_gitlink, object_type_from_mode
+from .staging import parse_index
+
+logger = get_logger(__name__)
+
+# objects handed to a worker at once
+chunk_size = 256
+progress_interval = 0.5  # seconds
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count(),
+        help="number of worker processes (default: number of CPUs)",
+    )
+    parser.add_argument(
+        "--progress",
+        help="show progress even if stderr is not a terminal",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-dangling",
+        dest="dangling",
+        help="do not report dangling objects",
+        action="store_false",
+    )
+
+
+def references_of(obj):
+    """(sha1, type) of objects an object points to"""
+    if obj.type_id == "tree":
+        # submodule commits live in another repository
+        return [(e.sha1, e.object_type) for e in obj if e.object_type != "commit"]
+    if obj.type_id == "commit":
+        return [(obj.tree, "tree")] + [(p, "commit") for p in obj.parents]
+    return []
+
+
+def read_object(sha1, source):
+    if source == "packed":
+        return pack.read_packed_object(sha1)
+    if source == "store":
+        return object_store.get_object_store().local.read(sha1)
+    with open(paths.make_object_path(sha1), "rb") as f:
+        return zlib.decompress(f.read())
+
+
+def check_object(item):
+    """return (sha1, type, error, references); runs in a worker process"""
+    sha1, source = item
+    try:
+        raw = read_object(sha1, source)
+        if hashlib.sha1(raw).digest() != sha1.raw:
+            return sha1, None, "hash mismatch", []
+        if raw.startswith(b"tag "):
+            target, target_type = parse_tag_target(raw)
+            if target is None or target_type is None:
+                return sha1, None, "tag without object or type", []
+            return sha1, "tag", None, [(target, target_type)]
+        obj = parse_object(raw)
+        return sha1, obj.type_id, None, references_of(obj)
+    except UnknownObjectTypeError:
+        return sha1, None, "unknown object type", []
+    except Exception as e:
+        return sha1, None, f"corrupt object ({type(e).__name__}: {e})", []
+
+
+def check_pack_checksums(p: pack.Pack):
+    errors = []
+    with open(p.pack_path, "rb") as f:
+        h = hashlib.sha1()
+        size = os.fstat(f.fileno()).st_size
+        remaining = size - pack.HASH_LENGTH
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 20))
+            h.update(chunk)
+            remaining -= len(chunk)
+        trailer = f.read()
+    if h.digest() != trailer:
+        errors.append(f"error: {p.pack_path.name}: pack checksum mismatch")
+    elif trailer != p.index.pack_checksum():
+        errors.append(f"error: {p.idx_path.name}: does not match its pack")
+    return errors
+
+
+def list_fsck_items(store):
+    """(sha1, "loose", "packed" or "store") of the objects of the repository
+
+    the objects of a store other than the loose one are listed by the store
+    """
+    if not isinstance(store, object_store.LooseObjectStore):
+        return [(sha1, "store") for sha1 in store.iter()]
+    items = [(sha1, "loose") for sha1 in paths.list_loose_objects()]
+    for p in pack.get_packs():
+        items += [(sha1, "packed") for sha1 in p.index]
+    return items
+
+
+class Progress:
+    def __init__(self, title, total, enabled):
+        self._title = title
+        self._total = total
+        self._enabled = enabled
+        self._start = time.monotonic()
+        self._last = 0
+        self.count = 0
+
+    def _show(self, end="\r"):
+        elapsed = time.monotonic() - self._start
+        rate = self.count / elapsed if elapsed > 0 else 0
+        percent = 100 * self.count // self._total if self._total else 100
+        sys.stderr.write(
+            f"{self._title}: {percent}% ({self.count}/{self._total}),"
+            f" {rate:.0f} objects/s{end}"
+        )
+
+    def update(self, n=1):
+        self.count += n
+        now = time.monotonic()
+        if self._enabled and now - self._last >= progress_interval:
+            self._last = now
+            self._show()
+
+    def done(self):
+        if self._enabled:
+            self._show(end=", done.\n")
+
+
+def fsck(args):
+    out = sys.stdout
+    ok = True
+    store = object_store.get_object_store()
+    loose = isinstance(store.local, object_store.LooseObjectStore)
+    for p in pack.get_packs() if loose else []:
+        for error in check_pack_checksums(p):
+            out.write(error + "\n")
+            ok = False
+
+    items = list_fsck_items(store.local)
+    show_progress = args.progress or sys.stderr.isatty()
+    progress = Progress("Checking objects", len(items), show_progress)
+    types = {}
+    referenced = {}
+    corrupt = set()
+    jobs = max(1, args.jobs or 1)
+    with contextlib.ExitStack() as stack:
+        if loose:
+            pool = stack.enter_context(multiprocessing.Pool(jobs))
+            results = pool.imap_unordered(check_object, items, chunksize=chunk_size)
+        else:
+            # a database connection does not survive a fork into the workers
+            jobs = 1
+            results = map(check_object, items)
+        for sha1, obj_type, error, references in results:
+            progress.update()
+            if error is not None:
+                out.write(f"error: {sha1}: {error}\n")
+                corrupt.add(sha1)
+                ok = False
+                continue
+            types[sha1] = obj_type
+            for ref, ref_type in references:
+                referenced.setdefault(ref, ref_type)
+    progress.done()
+
+    # objects borrowed from an alternate are present without being checked
+    def is_missing(sha1):
+        found = sha1 in types or sha1 in corrupt
+        return not found and not store.in_alternate(sha1)
+
+    for sha1, ref_type in sorted(referenced.items()):
+        if is_missing(sha1):
+            out.write(f"missing {ref_type} {sha1}\n")
+            ok = False
+    # refs and HEAD are where reachability starts, like the index
+    tips = list(refs.list_refs())
+    head = refs.read_ref("HEAD")
+    if head is not None:
+        tips.append(("HEAD", head))
+    for name, sha1 in tips:
+        if is_missing(sha1):
+            out.write(f"error: {name}: invalid sha1 pointer {sha1}\n")
+            ok = False
+        referenced.setdefault(sha1, types.get(sha1))
+    for sha1 in refs.iter_reflog_objects():
+        referenced.setdefault(sha1, types.get(sha1))
+    for entry in parse_index():
+        if is_gitlink(entry.mode):
+            continue  # the commit of a submodule is in its own repository
+        # sparse directory entries name trees
+        entry_type = object_type_from_mode(entry.mode)
+        if is_missing(entry.sha1):
+            out.write(
+                f"missing {entry_type} {entry.sha1}"
+                f" (index entry {entry.file_name})\n"
+            )
+            ok = False
+        referenced.setdefault(entry.sha1, entry_type)
+    if args.dangling:
+        for sha1, obj_type in sorted(types.items()):
+            if sha1 not in referenced:
+                out.write(f"dangling {obj_type} {sha1}\n")
+    logger.debug(f"checked {len(items)} objects with {jobs} processes")
+    if not ok:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    fsck(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import argparse
+import os
+import re
+import time
+
+from . import paths
+from .util import die_error, get_logger
+from .config import get_config
+from .repack import repack_objects, remove_loose_object
+
+logger = get_logger(__name__)
+
+# unreachable loose objects younger than this are kept, as another command
+# may be about to point a ref at them; the default of git's gc.pruneExpire
+default_prune_expire = "2.weeks.ago"
+
+time_units = {
+    "second": 1,
+    "minute": 60,
+    "hour": 60 * 60,
+    "day": 24 * 60 * 60,
+    "week": 7 * 24 * 60 * 60,
+    "month": 30 * 24 * 60 * 60,
+    "year": 365 * 24 * 60 * 60,
+}
+RELATIVE_DATE = re.compile(r"(\d+)[. ]({})s?[. ]ago".format("|".join(time_units)))
+DATE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d"]
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "--prune",
+        nargs="?",
+        const="",
+        metavar="<date>",
+        help="remove unreachable loose objects older than <date>"
+        f" (default: gc.pruneExpire or {default_prune_expire})",
+    )
+
+
+def parse_expiry(value: str, now: float):
+    """the time before which objects are pruned, None if none are
+
+    takes "now", "never", "<n>.<unit>.ago" and dates like "2024-01-31"
+    """
+    value = value.strip().lower()
+    if value in ("now", "all"):
+        return now
+    if value == "never":
+        return None
+    m = RELATIVE_DATE.fullmatch(value)
+    if m is not None:
+        return now - int(m.group(1)) * time_units[m.group(2)]
+    for date_format in DATE_FORMATS:
+        try:
+            return time.mktime(time.strptime(value, date_format))
+        except ValueError:
+            pass
+    die_error(f"fatal: invalid prune expiry date '{value}'")
+
+
+def prune_loose_objects(expire: float):
+    """remove the loose objects last written before expire"""
+    pruned = 0
+    for sha1 in paths.list_loose_objects():
+        try:
+            mtime = os.stat(paths.make_object_path(sha1)).st_mtime
+        except FileNotFoundError:
+            continue
+        if mtime <= expire:
+            remove_loose_object(sha1)
+            pruned += 1
+    return pruned
+
+
+def gc(args):
+    if args.prune is not None:
+        value = args.prune or get_config("gc", "pruneexpire") or default_prune_expire
+        expire = parse_expiry(value, time.time())
+    # reachable objects end up in the new pack and are removed from loose
+    # storage, so whatever stays loose is unreachable
+    repack_objects(remove=True, write_bitmap=True)
+    if args.prune is not None and expire is not None:
+        pruned = prune_loose_objects(expire)
+        logger.debug(f"pruned {pruned} unreachable objects")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    gc(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+import stat
 import time
 from collections import namedtuple
 
@@ -5,6 +6,7 @@ from . import paths
 from . import util
 from .mode import object_type_from_mode
 from .config import get_config
+from .object_id import ObjectId, raw_length
 
 
 class UnknownObjectTypeError(BaseException):
@@ -28,7 +30,7 @@ class GitObjectMixin:
         header = metadata.make_header()
         return header + data
 
-    def hash(self) -> str:
+    def hash(self) -> ObjectId:
         store = self.make_store()
         return util.hash_content(store)
 
@@ -63,7 +65,7 @@ class Blob(GitObjectMixin):
 
 
 class TreeEntry:
-    def __init__(self, mode: int, name: str, sha1: str):
+    def __init__(self, mode: int, name: str, sha1: ObjectId):
         self.mode = mode
         self.name = name
         self.sha1 = sha1
@@ -76,17 +78,58 @@ class TreeEntry:
         return f"{self.mode:06o} {self.object_type} {self.sha1}\t{self.name}"
 
     def serialize(self) -> bytes:
-        mode_b = f"{self.mode:o}".encode()
-        name_b = self.name.encode() + b"\x00"
-        sha1_b = bytes.fromhex(self.sha1)
-        return mode_b + b" " + name_b + sha1_b
+        return b"".join((b"%o " % self.mode, self.name.encode(), b"\x00", self.sha1.raw))
+
+
+def read_tree_entry(data: bytes, view: memoryview, pos: int):
+    """parse the entry at pos, returning it with the position of the next one"""
+    space = data.index(b" ", pos)
+    nul = data.index(b"\x00", space)
+    end = nul + 1 + raw_length
+    mode = int(data[pos:space], base=8)
+    # the entry is not copied as a whole: the name is decoded from the view
+    # and only the 20 bytes of the sha1 are copied out of it
+    name = str(view[space + 1 : nul], "utf-8")
+    sha1 = ObjectId(view[nul + 1 : end])
+    return TreeEntry(mode, name, sha1), end
+
+
+def iter_tree_entries(data: bytes, start=0):
+    """yield entries of serialized tree content stored in data from start on"""
+    view = memoryview(data)
+    pos = start
+    while pos < len(data):
+        entry, pos = read_tree_entry(data, view, pos)
+        yield entry
+
+
+def tree_entry_offsets(data: bytes, start=0):
+    pos = start
+    while pos < len(data):
+        yield pos
+        pos = data.index(b"\x00", pos) + 1 + raw_length
 
 
 class Tree(GitObjectMixin):
     def __init__(self):
         self._tree_entries = []
+        # set instead of the entries for a tree read from serialized content
+        self._data = None
+        self._start = 0
+        self._offsets = None
+
+    @staticmethod
+    def from_content(data: bytes, start=0):
+        """tree whose entries are parsed from data[start:] only when needed"""
+        tree = Tree()
+        tree._tree_entries = None
+        tree._data = data
+        tree._start = start
+        return tree
 
     def __iter__(self):
+        if self._tree_entries is None:
+            return iter_tree_entries(self._data, self._start)
         return iter(self._tree_entries)
 
     @property
@@ -100,16 +143,60 @@ class Tree(GitObjectMixin):
         return "\n".join(lst)
 
     def serialize(self):
-        data = b""
-        for e in self:
-            data += e.serialize()
-        return data
+        if self._tree_entries is None:
+            return bytes(self._data[self._start :])
+        return b"".join(e.serialize() for e in self._tree_entries)
 
     def add_entry(self, tree_entry):
+        if self._tree_entries is None:
+            self._tree_entries = list(self)
+            self._data = None
+            self._offsets = None
         self._tree_entries.append(tree_entry)
 
+    def _sort_key_at(self, pos):
+        # git orders a tree "foo" as if it were named "foo/"
+        data = self._data
+        space = data.index(b" ", pos)
+        nul = data.index(b"\x00", space)
+        key = data[space + 1 : nul]
+        if stat.S_ISDIR(int(data[pos:space], base=8)):
+            key += b"/"
+        return key
+
+    def _find(self, key: bytes, name: str):
+        offsets = self._offsets
+        lo, hi = 0, len(offsets)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._sort_key_at(offsets[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < len(offsets) and self._sort_key_at(offsets[lo]) == key:
+            entry, _ = read_tree_entry(self._data, memoryview(self._data), offsets[lo])
+            if entry.name == name:
+                return entry
+        return None
+
+    def lookup(self, name: str):
+        """entry called name or None, parsing only the entries compared with"""
+        if self._tree_entries is not None:
+            for e in self._tree_entries:
+                if e.name == name:
+                    return e
+            return None
+        if self._offsets is None:
+            self._offsets = list(tree_entry_offsets(self._data, self._start))
+        key = name.encode()
+        # a blob sorts under its name, a tree under its name with a slash
+        return self._find(key, name) or self._find(key + b"/", name)
+
 
 AuthorInfo = namedtuple("AuthorInfo", ["name", "email", "unix_time", "time_zone"])
+CommitHeader = namedtuple(
+    "CommitHeader", ["tree", "parents", "commit_time", "generation"], defaults=[None]
+)
 
 
 class Commit(GitObjectMixin):
@@ -122,6 +209,18 @@ class Commit(GitObjectMixin):
         self._committer = committer_info
         self._commit_message = commit_message
 
+    @property
+    def author(self):
+        return self._author
+
+    @property
+    def committer(self):
+        return self._committer
+
+    @property
+    def message(self):
+        return self._commit_message
+
     def __str__(self):
         s = ""
         s += f"tree {self._tree}\n"
@@ -143,6 +242,14 @@ class Commit(GitObjectMixin):
     def type_id(self):
         return "commit"
 
+    @property
+    def tree(self):
+        return self._tree
+
+    @property
+    def parents(self):
+        return self._parents
+
     def serialize(self):
         content = str(self).encode()
         return content
@@ -213,21 +320,10 @@ class ObjectParser:
         metadata = ObjectMetadata(object_type, content_length)
         return metadata
 
-    def parse_tree_entry(self):
-        # read file mode
-        mode = int(self.read_until(b" "), base=8)
-        # read filename
-        filename = self.read_until(b"\x00").decode()
-        # read sha1
-        sha1_length = 20
-        sha1 = self.read_n_bytes(sha1_length).hex()
-        return TreeEntry(mode, filename, sha1)
-
     def parse_tree(self):
-        tree = Tree()
-        while not self.eof():
-            entry = self.parse_tree_entry()
-            tree.add_entry(entry)
+        # entries are read lazily from the content instead of being copied
+        tree = Tree.from_content(self._data, self._head)
+        self._head = len(self._data)
         return tree
 
     def parse_commit(self):
@@ -255,11 +351,11 @@ class ObjectParser:
 
         # parse tree entry
         assert check_entry_name("tree")
-        tree = self.read_until(b"\n").decode()
+        tree = ObjectId.from_hex(self.read_until(b"\n").decode())
         # parse parents
         parents = []
         while check_entry_name("parent"):
-            parent = self.read_until(b"\n").decode()
+            parent = ObjectId.from_hex(self.read_until(b"\n").decode())
             parents.append(parent)
         # parse author/committer info
         assert check_entry_name("author")
@@ -300,8 +396,71 @@ def parse_object(raw_content: bytes, **kwargs):
     return ObjectParser().parse(raw_content, **kwargs)
 
 
-def load_object(sha1: str):
-    full_sha1 = paths.find_object(sha1)
+def parse_commit_header(raw_content: bytes):
+    """read tree, parents and committer time without decoding the message"""
+    assert raw_content.startswith(b"commit ")
+    head = raw_content.index(b"\x00") + 1
+    tree = None
+    parents = []
+    commit_time = 0
+    while True:
+        end = raw_content.index(b"\n", head)
+        if end == head:  # blank line before commit message
+            break
+        key, _, value = raw_content[head:end].partition(b" ")
+        if key == b"tree":
+            tree = ObjectId.from_hex(value.decode())
+        elif key == b"parent":
+            parents.append(ObjectId.from_hex(value.decode()))
+        elif key == b"committer":
+            commit_time = int(value.rsplit(b" ", 2)[1])
+        head = end + 1
+    return CommitHeader(tree, parents, commit_time)
+
+
+def parse_tag_target(raw_content: bytes):
+    """read the name and type of the object an annotated tag points to"""
+    assert raw_content.startswith(b"tag ")
+    head = raw_content.index(b"\x00") + 1
+    target = None
+    target_type = None
+    while True:
+        end = raw_content.index(b"\n", head)
+        if end == head:  # blank line before the tag message
+            break
+        key, _, value = raw_content[head:end].partition(b" ")
+        if key == b"object":
+            target = ObjectId.from_hex(value.decode())
+        elif key == b"type":
+            target_type = value.decode()
+        head = end + 1
+    return target, target_type
+
+
+def peel_object(sha1: ObjectId):
+    """follow annotated tags from sha1
+
+    returns the tags passed and the name and type of the object at the end
+    """
+    tags = []
+    object_type, _ = util.read_object_header(sha1)
+    while object_type == "tag":
+        tags.append(sha1)
+        sha1, object_type = parse_tag_target(util.load_raw_content(sha1))
+    return tags, sha1, object_type
+
+
+def load_commit_header(sha1: ObjectId):
+    raw = util.load_raw_content(sha1)
+    return parse_commit_header(raw)
+
+
+def load_object(sha1):
+    """load an object by its ObjectId or by a (possibly abbreviated) hex name"""
+    if isinstance(sha1, ObjectId):
+        full_sha1 = sha1
+    else:
+        full_sha1 = paths.find_object(sha1)
     raw = util.load_raw_content(full_sha1)
     obj = parse_object(raw)
     return obj
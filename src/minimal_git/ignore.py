@@ -0,0 +1,234 @@
+# .gitignore and the other exclude files
+# see Documentation/gitignore.txt in git
+#
+# each file is compiled once into regular expressions: one per pattern, to
+# find the last one that matches, and one alternation of all of them, so
+# that the common case of a path matching nothing costs a single search
+
+import os
+import re
+
+from . import paths
+from .config import get_config
+
+PER_DIRECTORY_FILE = ".gitignore"
+
+POSIX_CLASSES = {
+    "alnum": "a-zA-Z0-9",
+    "alpha": "a-zA-Z",
+    "blank": " \\t",
+    "cntrl": "\\x00-\\x1f\\x7f",
+    "digit": "0-9",
+    "lower": "a-z",
+    "punct": re.escape("!\"#$%&'()*+,-./:;<=>?@[\\]^_`{|}~"),
+    "space": "\\s",
+    "upper": "A-Z",
+    "xdigit": "0-9a-fA-F",
+}
+
+
+def bracket_to_regex(glob: str, start: int):
+    """translate the bracket expression at start, return (regex, end)
+
+    returns None if the bracket is not closed, so it is taken literally
+    """
+    i = start + 1
+    negate = i < len(glob) and glob[i] in "!^"
+    if negate:
+        i += 1
+    out = []
+    first = True
+    while i < len(glob):
+        c = glob[i]
+        if c == "]" and not first:
+            return "[" + ("^" if negate else "") + "".join(out) + "]", i + 1
+        first = False
+        if c == "[" and glob.startswith("[:", i):
+            end = glob.find(":]", i + 2)
+            name = glob[i + 2 : end] if end != -1 else None
+            if name in POSIX_CLASSES:
+                out.append(POSIX_CLASSES[name])
+                i = end + 2
+                continue
+        if c == "\\" and i + 1 < len(glob):
+            i += 1
+            c = glob[i]
+        out.append(c if c == "-" else re.escape(c))
+        i += 1
+    return None
+
+
+def glob_to_regex(glob: str):
+    """regular expression for a wildmatch pattern matched against a path
+
+    "*" and "?" do not match "/", "**" between slashes matches any number
+    of directories and a trailing "/**" everything inside
+    """
+    out = []
+    i = 0
+    n = len(glob)
+    while i < n:
+        c = glob[i]
+        if c == "*":
+            j = i
+            while j < n and glob[j] == "*":
+                j += 1
+            leading = i == 0 or glob[i - 1] == "/"
+            if j - i == 2 and leading and j == n:
+                out.append(".*")
+            elif j - i == 2 and leading and glob[j] == "/":
+                out.append("(?:.*/)?")
+                j += 1
+            else:
+                out.append("[^/]*")
+            i = j
+            continue
+        if c == "?":
+            out.append("[^/]")
+        elif c == "[":
+            bracket = bracket_to_regex(glob, i)
+            if bracket is not None:
+                out.append(bracket[0])
+                i = bracket[1]
+                continue
+            out.append(re.escape(c))
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            out.append(re.escape(glob[i]))
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return "".join(out)
+
+
+def strip_trailing_spaces(line: str):
+    """drop trailing spaces unless they are quoted with a backslash"""
+    end = len(line)
+    while end > 0 and line[end - 1] == " ":
+        backslashes = len(line[: end - 1]) - len(line[: end - 1].rstrip("\\"))
+        if backslashes % 2:
+            break
+        end -= 1
+    return line[:end]
+
+
+def parse_pattern(line: str):
+    """(regex, negated, directory_only) of a line, or None for no pattern"""
+    line = strip_trailing_spaces(line)
+    if not line or line.startswith("#"):
+        return None
+    negated = line.startswith("!")
+    if negated:
+        line = line[1:]
+    elif line.startswith(("\\!", "\\#")):
+        line = line[1:]
+    directory_only = line.endswith("/")
+    line = line.rstrip("/")
+    if not line:
+        return None
+    if "/" in line:
+        # relative to the directory of the file
+        regex = glob_to_regex(line.lstrip("/"))
+    else:
+        # matches a name at any depth
+        regex = "(?:.*/)?" + glob_to_regex(line)
+    return regex, negated, directory_only
+
+
+class IgnoreRules:
+    """the patterns of one exclude file"""
+
+    def __init__(self, lines):
+        self.patterns = []
+        for line in lines:
+            pattern = parse_pattern(line.rstrip("\r"))
+            if pattern is not None:
+                regex, negated, directory_only = pattern
+                self.patterns.append((re.compile(regex), negated, directory_only))
+        regexes = [p.pattern for p, _, _ in self.patterns]
+        file_regexes = [p.pattern for p, _, d in self.patterns if not d]
+        self._any_dir = re.compile("|".join(regexes) or "(?!)")
+        self._any_file = re.compile("|".join(file_regexes) or "(?!)")
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    @staticmethod
+    def from_bytes(data: bytes):
+        return IgnoreRules(data.decode(errors="surrogateescape").split("\n"))
+
+    @staticmethod
+    def from_file(path):
+        """the rules of the file at path, None if there is none"""
+        try:
+            with open(path, "rb") as f:
+                return IgnoreRules.from_bytes(f.read())
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def match(self, path: str, is_dir: bool):
+        """True if path is excluded, False if re-included, None if not named
+
+        like git, the last pattern matching the path decides
+        """
+        if not (self._any_dir if is_dir else self._any_file).fullmatch(path):
+            return None
+        for regex, negated, directory_only in reversed(self.patterns):
+            if directory_only and not is_dir:
+                continue
+            if regex.fullmatch(path):
+                return not negated
+        return None
+
+
+class Ignores:
+    """the rules in effect in a directory, as a chain up to the top
+
+    rules of deeper directories come first, then those of the parents, then
+    .git/info/exclude and core.excludesFile
+    """
+
+    def __init__(self, rules, prefix="", parent=None):
+        self.rules = rules
+        self.prefix = prefix
+        self.parent = parent
+
+    def child(self, rules, prefix):
+        """the rules of the directory prefix ("dir/"), given its own rules"""
+        return Ignores(rules, prefix, self) if rules else self
+
+    def is_ignored(self, path: str, is_dir: bool):
+        """check if path, relative to the top of the worktree, is excluded"""
+        node = self
+        while node is not None:
+            if node.rules is not None:
+                excluded = node.rules.match(path[len(node.prefix) :], is_dir)
+                if excluded is not None:
+                    return excluded
+            node = node.parent
+        return False
+
+
+def find_info_exclude():
+    return os.path.join(paths.find_git_root(), "info", "exclude")
+
+
+def find_excludes_file():
+    """core.excludesFile, by default $XDG_CONFIG_HOME/git/ignore"""
+    path = get_config("core", "excludesfile")
+    if path is not None:
+        return os.path.expanduser(path)
+    config_home = os.environ.get("XDG_CONFIG_HOME") or os.path.expanduser(
+        "~/.config"
+    )
+    return os.path.join(config_home, "git", "ignore")
+
+
+def load_global_ignores():
+    """the rules which apply to the whole worktree"""
+    ignores = None
+    for path in (find_excludes_file(), find_info_exclude()):
+        rules = IgnoreRules.from_file(path)
+        if rules:
+            ignores = Ignores(rules, "", ignores)
+    return ignores if ignores is not None else Ignores(None)
@@ -24,6 +24,11 @@ class FileTree:
     def has_no_child(self):
         return len(self.children) == 0
 
+    def sort_key(self):
+        # git orders a tree "foo" as if it were named "foo/"
+        is_tree = self._tree_entry is None or self._tree_entry.object_type == "tree"
+        return self.name + "/" if is_tree else self.name
+
     def to_git_tree(self):
         if self.has_no_child():
             raise ValueError
@@ -104,7 +109,7 @@ def build_file_tree_form_paths(paths, to_tree_entry):
         else:
             for t in children:
                 trees.remove(t)
-            tree = FileTree(p, sorted(children, key=lambda t: t.name))
+            tree = FileTree(p, sorted(children, key=lambda t: t.sort_key()))
             trees.add(tree)
     assert len(trees) == 1  # only the repository root tree shold remain
     return next(iter(trees))  # returns first element
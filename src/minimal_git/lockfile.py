@@ -0,0 +1,118 @@
+# git-compatible lock files, like lockfile.c in git
+#
+# a file is updated by creating <file>.lock exclusively, writing the new
+# content to it and renaming it over the file; the lock keeps other writers
+# out and readers only ever see the old or the new file
+
+import os
+import random
+import time
+
+INITIAL_BACKOFF_MS = 1
+BACKOFF_MAX_MULTIPLIER = 1000
+
+
+class LockError(BaseException):
+    pass
+
+
+def lock_path(path):
+    return os.fspath(path) + ".lock"
+
+
+def backoff_delays(timeout_ms: int):
+    """yield how long to sleep (in seconds) before each new attempt
+
+    the delays grow quadratically with some jitter, so that processes which
+    started together do not keep colliding; a negative timeout waits forever
+    """
+    remaining_ms = timeout_ms
+    multiplier = 1
+    n = 1
+    while timeout_ms < 0 or remaining_ms > 0:
+        backoff_ms = multiplier * INITIAL_BACKOFF_MS
+        wait_ms = (750 + random.randrange(500)) * backoff_ms / 1000
+        if timeout_ms >= 0:
+            wait_ms = min(wait_ms, remaining_ms)
+        yield wait_ms / 1000
+        remaining_ms -= wait_ms
+        multiplier += 2 * n + 1
+        if multiplier > BACKOFF_MAX_MULTIPLIER:
+            multiplier = BACKOFF_MAX_MULTIPLIER
+        else:
+            n += 1
+
+
+class LockFile:
+    """exclusive lock on path, held as path.lock until commit or rollback
+
+    usable as a context manager, which rolls back unless committed; fsync
+    can be turned off for files git does not make durable either
+    """
+
+    def __init__(self, path, timeout_ms=0, *, fsync=True):
+        self.path = path
+        self._fsync = fsync
+        self.lock_path = lock_path(path)
+        self._fd = self._create(timeout_ms)
+        self._held = True
+
+    def _create(self, timeout_ms):
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, "O_BINARY", 0)
+        delays = backoff_delays(timeout_ms)
+        while True:
+            try:
+                return os.open(self.lock_path, flags, 0o666)
+            except FileExistsError:
+                delay = next(delays, None)
+                if delay is None:
+                    raise LockError(
+                        f"Unable to create '{self.lock_path}': File exists.\n\n"
+                        "Another git process seems to be running in this "
+                        "repository.\nIf no other git process is currently "
+                        "running, remove the file manually to continue."
+                    )
+                time.sleep(delay)
+
+    def write(self, data: bytes):
+        view = memoryview(data)
+        while view:
+            written = os.write(self._fd, view)
+            view = view[written:]
+
+    def close(self):
+        """make the written content durable and release the file descriptor
+
+        the lock stays held; callers holding many locks at once close each
+        one after writing so as not to run out of descriptors
+        """
+        if self._fd is None:
+            return
+        if self._fsync:
+            os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
+
+    def commit(self):
+        """make the written content durable and put it in place of the file"""
+        self.close()
+        os.replace(self.lock_path, self.path)
+        self._held = False
+
+    def rollback(self):
+        if not self._held:
+            return
+        self._held = False
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        try:
+            os.unlink(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.rollback()
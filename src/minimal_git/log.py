@@ -0,0 +1,54 @@
+import argparse
+import datetime
+import sys
+
+from . import rev_list
+from .git_objects import load_object
+
+
+def setup_parser(parser):
+    rev_list.add_revision_arguments(parser)
+
+
+def format_date(unix_time: int, time_zone: str):
+    sign = -1 if time_zone.startswith("-") else 1
+    offset = datetime.timedelta(hours=int(time_zone[1:3]), minutes=int(time_zone[3:5]))
+    tz = datetime.timezone(sign * offset)
+    date = datetime.datetime.fromtimestamp(unix_time, tz=tz)
+    return date.strftime(f"%a %b {date.day} %H:%M:%S %Y {time_zone}")
+
+
+def format_commit(sha1, commit):
+    author = commit.author
+    lines = [f"commit {sha1}"]
+    if len(commit.parents) > 1:
+        lines.append("Merge: " + " ".join(p.hex()[:7] for p in commit.parents))
+    lines += [
+        f"Author: {author.name} <{author.email}>",
+        f"Date:   {format_date(author.unix_time, author.time_zone)}",
+        "",
+    ]
+    for line in commit.message.rstrip("\n").split("\n"):
+        lines.append(f"    {line}" if line else "")
+    return "\n".join(lines) + "\n"
+
+
+def log(args):
+    out = sys.stdout
+    separator = ""
+    for sha1, _ in rev_list.walk_commits(args.revisions, args.max_count):
+        # only now is the whole commit (with its message) parsed
+        commit = load_object(sha1)
+        out.write(separator + format_commit(sha1, commit))
+        separator = "\n"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    log(args)
+
+
+if __name__ == "__main__":
+    main()
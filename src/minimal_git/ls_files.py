@@ -1,15 +1,149 @@
+# show the files in the index
+# see Documentation/git-ls-files.txt in git
+
 import argparse
+import pathlib
+import posixpath
+import sys
 
-from .staging import parse_index
+from .util import quote_path
+from .paths import get_cwd_relative
+from .staging import IndexEntry, parse_index
+from .ls_tree import (
+    iter_tree_listing,
+    leads_to_pathspec,
+    matches_pathspec,
+    normalize_pathspec,
+)
 
 
 def setup_parser(parser):
+    parser.add_argument(
+        "-c", "--cached", help="show cached files (the default)", action="store_true"
+    )
+    parser.add_argument(
+        "-s",
+        "--stage",
+        help="show mode, object name and stage of each file",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-u",
+        "--unmerged",
+        help="show only unmerged files (implies --stage)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-z",
+        help="terminate entries with NUL and do not quote paths",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--sparse",
+        help="show sparse directories instead of the files in them",
+        action="store_true",
+    )
     parser.add_argument("--debug", help="show debugging data", action="store_true")
+    parser.add_argument(
+        "pathspecs",
+        nargs="*",
+        metavar="<file>",
+        help="only show these files (dir/ lists what is in dir)",
+    )
+
+
+def pathspec_ranges(index, pathspecs):
+    """sorted, disjoint position ranges of the index which can match
+
+    each pathspec is looked up by bisection, as is a sparse directory the
+    pathspec points into, so entries elsewhere are never looked at
+    """
+    if not pathspecs or "" in pathspecs:
+        return [(0, len(index))]
+    ranges = []
+    for pathspec in pathspecs:
+        ranges.append(index.prefix_range(pathspec.rstrip("/")))
+        sparse_directory = index.find_sparse_directory(pathspec)
+        if sparse_directory is not None:
+            pos = index.find(sparse_directory.file_name)
+            ranges.append((pos, pos + 1))
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(end, merged[-1][1]))
+        elif start < end:
+            merged.append((start, end))
+    return merged
+
+
+def iter_sparse_directory(entry, pathspecs):
+    """yield entries for the files of a sparse directory entry"""
+    for tree_entry, path in iter_tree_listing(
+        entry.sha1, pathspecs, recursive=True, prefix=entry.file_name
+    ):
+        prefix = pathlib.PurePosixPath(path).parent
+        yield IndexEntry.from_tree_entry(tree_entry, prefix)
+
+
+def iter_matching_entries(index, pathspecs, *, expand_sparse=True):
+    """yield the entries matching pathspecs in index order"""
+    for start, end in pathspec_ranges(index, pathspecs):
+        for pos in range(start, end):
+            e = index[pos]
+            if not e.is_sparse_directory():
+                if matches_pathspec(e.file_name, False, pathspecs):
+                    yield e
+                continue
+            directory = e.file_name.rstrip("/")
+            if not expand_sparse:
+                if matches_pathspec(directory, True, pathspecs):
+                    yield e
+            elif matches_pathspec(directory, True, pathspecs) or leads_to_pathspec(
+                directory, pathspecs
+            ):
+                yield from iter_sparse_directory(e, pathspecs)
+
+
+def format_debug(e: IndexEntry):
+    return (
+        f"  ctime: {e.ctime}:{e.ctime_ns}\n"
+        f"  mtime: {e.mtime}:{e.mtime_ns}\n"
+        f"  dev: {e.dev}\tino: {e.ino}\n"
+        f"  uid: {e.uid}\tgid: {e.gid}\n"
+        f"  size: {e.file_size}\tflags: {e.flags:x}\n"
+    ).encode()
 
 
 def ls_files(args):
+    out = sys.stdout.buffer
+    cwd = get_cwd_relative().as_posix()
+    prefix = "" if cwd == "." else cwd + "/"
+    pathspecs = [normalize_pathspec(prefix, p) for p in args.pathspecs]
+    if not pathspecs and prefix:
+        pathspecs = [prefix]  # like git, only what is below the current directory
+    show_stage = args.stage or args.unmerged
+    terminator = b"\0" if args.z else b"\n"
     index = parse_index()
-    index.print(debug=args.debug)
+    entries = iter_matching_entries(index, pathspecs, expand_sparse=not args.sparse)
+    for e in entries:
+        stage = e.stage >> 12
+        if args.unmerged and stage == 0:
+            continue
+        if prefix and e.file_name.startswith(prefix):
+            path = e.file_name[len(prefix) :]
+        elif prefix:
+            path = posixpath.relpath(e.file_name, cwd)
+        else:
+            path = e.file_name
+        name = path.encode() if args.z else quote_path(path)
+        if show_stage:
+            line = b"%06o %s %d\t" % (e.mode, e.sha1.hex().encode(), stage)
+            out.write(line + name + terminator)
+        else:
+            out.write(name + terminator)
+        if args.debug:
+            out.write(format_debug(e))
+    out.flush()
 
 
 def main():
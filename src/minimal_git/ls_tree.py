@@ -0,0 +1,140 @@
+# list the contents of a tree object
+# see Documentation/git-ls-tree.txt in git
+
+import argparse
+import posixpath
+import sys
+
+from .util import die_error, quote_path
+from .paths import find_repository_root, get_cwd_relative
+from .diff_tree import resolve_tree, sort_key
+from .git_objects import load_object
+
+
+def setup_parser(parser):
+    parser.add_argument("-r", help="recurse into sub-trees", action="store_true")
+    parser.add_argument(
+        "-z",
+        help="terminate entries with NUL and do not quote paths",
+        action="store_true",
+    )
+    parser.add_argument("tree", metavar="<tree-ish>")
+    parser.add_argument(
+        "pathspecs",
+        nargs="*",
+        metavar="<path>",
+        help="only show these paths (dir/ lists what is in dir)",
+    )
+
+
+def normalize_pathspec(prefix: str, pathspec: str):
+    """a pathspec relative to the current directory made relative to the top"""
+    path = posixpath.normpath(prefix + pathspec)
+    if path == ".":
+        return ""
+    if path == ".." or path.startswith("../"):
+        root = find_repository_root()
+        die_error(f"fatal: {pathspec}: '{pathspec}' is outside repository at '{root}'")
+    # "dir/" and "dir/." both name what is in dir
+    is_directory = pathspec.endswith("/") or posixpath.basename(pathspec) == "."
+    return path + "/" if is_directory else path
+
+
+def relative_path(path: str, prefix: str):
+    """path from the top as shown in the directory prefix, like git does
+
+    directories above the current one end in a slash, as in "../"
+    """
+    if path.startswith(prefix):
+        return path[len(prefix) :]
+    relative = posixpath.relpath(path, prefix)
+    return relative + "/" if prefix.startswith(path + "/") else relative
+
+
+def matches_pathspec(path: str, is_tree: bool, pathspecs):
+    """check if path is named by a pathspec or lies in a directory named by one"""
+    if not pathspecs:
+        return True
+    for pathspec in pathspecs:
+        name = pathspec.rstrip("/")
+        if not name or path.startswith(name + "/"):
+            return True
+        # "dir/" names only a directory
+        if path == name and (is_tree or not pathspec.endswith("/")):
+            return True
+    return False
+
+
+def leads_to_pathspec(path: str, pathspecs):
+    """check if a tree at path has to be opened to reach a pathspec"""
+    prefix = path + "/"
+    return any(p.startswith(prefix) for p in pathspecs)
+
+
+def select_entries(tree, prefix: str, pathspecs):
+    """entries of a tree at prefix which may match the pathspecs
+
+    unless a pathspec names the tree itself or a directory above it, only
+    the next path components of the pathspecs are looked up, which costs a
+    binary search each instead of going over the whole tree
+    """
+    if matches_pathspec(prefix.rstrip("/"), True, pathspecs):
+        return iter(tree)
+    names = set()
+    for pathspec in pathspecs:
+        if pathspec.startswith(prefix):
+            names.add(pathspec[len(prefix) :].split("/")[0])
+    entries = []
+    for name in names:
+        entry = tree.lookup(name)
+        if entry is not None:
+            entries.append(entry)
+    return iter(sorted(entries, key=sort_key))
+
+
+def iter_tree_listing(tree_sha1, pathspecs=(), *, recursive=False, prefix=""):
+    """yield (entry, path) of a tree in git order
+
+    trees are only read when they can contain a match, and entries come out
+    while the walk goes on
+    """
+    tree = load_object(tree_sha1)
+    for entry in select_entries(tree, prefix, pathspecs):
+        path = prefix + entry.name
+        is_tree = entry.object_type == "tree"
+        matches = matches_pathspec(path, is_tree, pathspecs)
+        if is_tree and (leads_to_pathspec(path, pathspecs) or recursive and matches):
+            yield from iter_tree_listing(
+                entry.sha1, pathspecs, recursive=recursive, prefix=path + "/"
+            )
+        elif matches:
+            yield entry, path
+
+
+def ls_tree(args):
+    out = sys.stdout.buffer
+    tree_sha1 = resolve_tree(args.tree)
+    cwd = get_cwd_relative().as_posix()
+    prefix = "" if cwd == "." else cwd + "/"
+    pathspecs = [normalize_pathspec(prefix, p) for p in args.pathspecs]
+    if not pathspecs and prefix:
+        pathspecs = [prefix]  # like git, only what is below the current directory
+    terminator = b"\0" if args.z else b"\n"
+    for entry, path in iter_tree_listing(tree_sha1, pathspecs, recursive=args.r):
+        path = relative_path(path, prefix)
+        name = path.encode() if args.z else quote_path(path)
+        object_type = entry.object_type.encode()
+        line = b"%06o %s %s\t" % (entry.mode, object_type, entry.sha1.hex().encode())
+        out.write(line + name + terminator)
+    out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    ls_tree(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import argparse
+import heapq
+import itertools
+import sys
+
+from .rev_list import resolve_commit
+from .commit_graph import load_commit_header, generation_of
+
+# paint flags
+PARENT1 = 1 << 0
+PARENT2 = 1 << 1
+STALE = 1 << 2
+RESULT = 1 << 3
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "--all", help="output all merge bases", action="store_true", dest="all"
+    )
+    parser.add_argument(
+        "--is-ancestor",
+        help="check if the first commit is an ancestor of the second",
+        action="store_true",
+    )
+    parser.add_argument("commit1", metavar="<commit>")
+    parser.add_argument("commit2", metavar="<commit>")
+
+
+def is_ancestor(ancestor, descendant):
+    # generation numbers strictly decrease towards the roots, so commits with
+    # a lower generation than the ancestor cannot lead to it
+    min_generation = generation_of(load_commit_header(ancestor))
+    stack = [descendant]
+    seen = {descendant}
+    while stack:
+        sha1 = stack.pop()
+        if sha1 == ancestor:
+            return True
+        header = load_commit_header(sha1)
+        if generation_of(header) < min_generation:
+            continue
+        for parent in header.parents:
+            if parent not in seen:
+                seen.add(parent)
+                stack.append(parent)
+    return False
+
+
+def paint_down_to_common(commit1, commit2):
+    flags = {}
+    queue = []
+    counter = itertools.count()
+
+    def push(sha1, flag):
+        header = load_commit_header(sha1)
+        key = (-generation_of(header), -header.commit_time, next(counter))
+        heapq.heappush(queue, key + (sha1, header))
+        flags[sha1] = flags.get(sha1, 0) | flag
+
+    def has_nonstale():
+        return any(not flags[entry[3]] & STALE for entry in queue)
+
+    push(commit1, PARENT1)
+    push(commit2, PARENT2)
+    results = []
+    while has_nonstale():
+        *_, sha1, header = heapq.heappop(queue)
+        flag = flags[sha1] & (PARENT1 | PARENT2 | STALE)
+        if flag & (PARENT1 | PARENT2) == PARENT1 | PARENT2:
+            if not flags[sha1] & RESULT:
+                flags[sha1] |= RESULT
+                results.append(sha1)
+            flag |= STALE
+        for parent in header.parents:
+            if flags.get(parent, 0) & flag == flag:
+                continue
+            push(parent, flag)
+    return results
+
+
+def merge_bases(commit1, commit2):
+    if commit1 == commit2:
+        return [commit1]
+    candidates = paint_down_to_common(commit1, commit2)
+    # drop candidates reachable from another candidate
+    return [
+        c
+        for c in candidates
+        if not any(c != other and is_ancestor(c, other) for other in candidates)
+    ]
+
+
+def merge_base(args):
+    commit1 = resolve_commit(args.commit1)
+    commit2 = resolve_commit(args.commit2)
+    if args.is_ancestor:
+        sys.exit(0 if is_ancestor(commit1, commit2) else 1)
+    bases = merge_bases(commit1, commit2)
+    if not bases:
+        sys.exit(1)
+    if not args.all:
+        bases = bases[:1]
+    for sha1 in bases:
+        print(sha1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    merge_base(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,36 @@
 #!/usr/bin/env python3
+import sys
+
 from .util import get_logger
 from . import hash_object
 from . import cat_file
 from . import ls_files
+from . import ls_tree
 from . import read_tree
 from . import write_tree
 from . import update_index
 from . import commit_tree
+from . import diff_tree
+from . import rev_list
+from . import log
+from . import commit_graph
+from . import merge_base
+from . import repack
+from . import gc
+from . import fsck
+from . import fast_import
+from . import fast_export
+from . import multi_pack_index
+from . import sparse_checkout
+from . import upload_pack
+from . import fetch
+from . import clone
+from . import update_ref
+from . import rev_parse
+from . import pack_refs
+from . import add
+from . import daemon
+from . import refs
 
 logger = get_logger()
 
@@ -57,6 +81,12 @@ def main():
         setup=ls_files.setup_parser,
         func=ls_files.ls_files,
     )
+    add_subcommand(
+        "ls-tree",
+        help="List the contents of a tree object",
+        setup=ls_tree.setup_parser,
+        func=ls_tree.ls_tree,
+    )
     add_subcommand(
         "read-tree",
         help="Reads tree information into the index",
@@ -81,10 +111,137 @@ def main():
         setup=commit_tree.setup_parser,
         func=commit_tree.commit_tree,
     )
+    add_subcommand(
+        "diff-tree",
+        help="Compares the content and mode of blobs found via two tree objects",
+        setup=diff_tree.setup_parser,
+        func=diff_tree.diff_tree,
+    )
+    add_subcommand(
+        "rev-list",
+        help="Lists commit objects in reverse chronological order",
+        setup=rev_list.setup_parser,
+        func=rev_list.rev_list,
+    )
+    add_subcommand(
+        "log",
+        help="Show commit logs",
+        setup=log.setup_parser,
+        func=log.log,
+    )
+    add_subcommand(
+        "commit-graph",
+        help="Write Git commit-graph files",
+        setup=commit_graph.setup_parser,
+        func=commit_graph.commit_graph,
+    )
+    add_subcommand(
+        "merge-base",
+        help="Find as good common ancestors as possible for a merge",
+        setup=merge_base.setup_parser,
+        func=merge_base.merge_base,
+    )
+    add_subcommand(
+        "repack",
+        help="Pack reachable objects into a new pack",
+        setup=repack.setup_parser,
+        func=repack.repack,
+    )
+    add_subcommand(
+        "gc",
+        help="Cleanup unnecessary files and optimize the local repository",
+        setup=gc.setup_parser,
+        func=gc.gc,
+    )
+    add_subcommand(
+        "fsck",
+        help="Verifies the connectivity and validity of the objects in the database",
+        setup=fsck.setup_parser,
+        func=fsck.fsck,
+    )
+    add_subcommand(
+        "fast-import",
+        help="Backend for fast Git data importers",
+        setup=fast_import.setup_parser,
+        func=fast_import.fast_import,
+    )
+    add_subcommand(
+        "fast-export",
+        help="Git data exporter",
+        setup=fast_export.setup_parser,
+        func=fast_export.fast_export,
+    )
+    add_subcommand(
+        "multi-pack-index",
+        help="Write and verify multi-pack-indexes",
+        setup=multi_pack_index.setup_parser,
+        func=multi_pack_index.multi_pack_index,
+    )
+    add_subcommand(
+        "sparse-checkout",
+        help="Reduce your working tree to a subset of tracked files",
+        setup=sparse_checkout.setup_parser,
+        func=sparse_checkout.sparse_checkout,
+    )
 
+    add_subcommand(
+        "upload-pack",
+        help="Send objects packed back to git-fetch-pack",
+        setup=upload_pack.setup_parser,
+        func=upload_pack.upload_pack,
+    )
+    add_subcommand(
+        "fetch",
+        help="Download objects and refs from another repository",
+        setup=fetch.setup_parser,
+        func=fetch.fetch,
+    )
+    add_subcommand(
+        "clone",
+        help="Clone a repository into a new directory",
+        setup=clone.setup_parser,
+        func=clone.clone,
+    )
+    add_subcommand(
+        "update-ref",
+        help="Update the object name stored in a ref safely",
+        setup=update_ref.setup_parser,
+        func=update_ref.update_ref,
+    )
+    add_subcommand(
+        "rev-parse",
+        help="Pick out and massage parameters",
+        setup=rev_parse.setup_parser,
+        func=rev_parse.rev_parse,
+    )
+    add_subcommand(
+        "pack-refs",
+        help="Pack heads and tags for efficient repository access",
+        setup=pack_refs.setup_parser,
+        func=pack_refs.pack_refs,
+    )
+    add_subcommand(
+        "add",
+        help="Add file contents to the index",
+        setup=add.setup_parser,
+        func=add.add,
+    )
+    add_subcommand(
+        "daemon",
+        help="Keep the state of the repository in memory for other commands",
+        setup=daemon.setup_parser,
+        func=daemon.daemon,
+    )
     args = parser.parse_args()
+    # abbreviated object names are looked up by a running daemon if possible
+    refs.set_object_name_lookup(daemon.find_object)
     if args.verbose:
         set_verbose_logging(logger)
+    elif daemon.serves(args.subcommand):
+        # without -v the arguments are those of the command alone
+        code = daemon.run_command(sys.argv[1:])
+        if code is not None:
+            sys.exit(code)
 
     args.subcommand(args)
 
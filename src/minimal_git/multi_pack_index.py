@@ -0,0 +1,282 @@
+# read and write .git/objects/pack/multi-pack-index
+# see Documentation/gitformat-pack.txt in git for the file format
+#
+# one sorted table maps every packed object to its pack and offset, so that
+# a lookup is a single binary search however many packs there are
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+from . import pack
+from .chunk_format import (
+    CHUNK_LOOKUP_ENTRY_SIZE,
+    serialize_chunk_file,
+    write_file_atomic,
+)
+from .object_id import ObjectId
+
+
+class MultiPackIndexFormatError(BaseException):
+    pass
+
+
+SIGNATURE = b"MIDX"
+VERSION = 1
+HASH_VERSION = 1  # SHA-1
+HASH_LENGTH = 20
+
+CHUNK_PACK_NAMES = b"PNAM"
+CHUNK_OID_FANOUT = b"OIDF"
+CHUNK_OID_LOOKUP = b"OIDL"
+CHUNK_OBJECT_OFFSETS = b"OOFF"
+CHUNK_LARGE_OFFSETS = b"LOFF"
+
+HEADER_SIZE = 12
+FANOUT_SIZE = 256 * 4
+LARGE_OFFSET = 0x80000000
+
+
+def find_multi_pack_index_file(pack_dir=None):
+    if pack_dir is None:
+        pack_dir = pack.find_pack_dir()
+    return pack_dir / "multi-pack-index"
+
+
+class MultiPackIndex:
+    def __init__(self, data):
+        self._data = data
+        signature, version, hash_version, num_chunks, _, num_packs = (
+            struct.unpack_from(">4sBBBBI", data, 0)
+        )
+        if signature != SIGNATURE:
+            raise MultiPackIndexFormatError("bad multi-pack-index signature")
+        if version != VERSION or hash_version != HASH_VERSION:
+            raise MultiPackIndexFormatError("unsupported multi-pack-index version")
+        self._chunks = {}
+        for i in range(num_chunks):
+            pos = HEADER_SIZE + i * CHUNK_LOOKUP_ENTRY_SIZE
+            chunk_id, offset = struct.unpack_from(">4sQ", data, pos)
+            self._chunks[chunk_id] = offset
+        for chunk_id in (
+            CHUNK_PACK_NAMES,
+            CHUNK_OID_FANOUT,
+            CHUNK_OID_LOOKUP,
+            CHUNK_OBJECT_OFFSETS,
+        ):
+            if chunk_id not in self._chunks:
+                raise MultiPackIndexFormatError(f"missing {chunk_id.decode()} chunk")
+        self._fanout = self._chunks[CHUNK_OID_FANOUT]
+        self._lookup = self._chunks[CHUNK_OID_LOOKUP]
+        self._offsets = self._chunks[CHUNK_OBJECT_OFFSETS]
+        self._large_offsets = self._chunks.get(CHUNK_LARGE_OFFSETS)
+        start = self._chunks[CHUNK_PACK_NAMES]
+        names = bytes(data[start : self._next_chunk_offset(start)])
+        self.pack_names = [n.decode() for n in names.split(b"\x00")[:num_packs]]
+        self.num_objects = self._fanout_at(255)
+
+    def __len__(self):
+        return self.num_objects
+
+    def _next_chunk_offset(self, offset):
+        later = [o for o in self._chunks.values() if o > offset]
+        return min(later, default=len(self._data) - HASH_LENGTH)
+
+    def _fanout_at(self, byte):
+        return struct.unpack_from(">I", self._data, self._fanout + 4 * byte)[0]
+
+    def _oid_bytes(self, pos):
+        start = self._lookup + pos * HASH_LENGTH
+        return self._data[start : start + HASH_LENGTH]
+
+    def oid(self, pos) -> ObjectId:
+        return ObjectId(self._oid_bytes(pos))
+
+    def _bisect(self, key: bytes):
+        """position of the first name not less than key"""
+        lo = self._fanout_at(key[0] - 1) if key[0] > 0 else 0
+        hi = self._fanout_at(key[0])
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._oid_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, sha1: ObjectId):
+        """binary search the position of an object, or None if absent"""
+        key = sha1.raw
+        pos = self._bisect(key)
+        if pos < self.num_objects and self._oid_bytes(pos) == key:
+            return pos
+        return None
+
+    def find_prefix(self, sha1_prefix: str):
+        """yield names of objects whose hex form starts with sha1_prefix"""
+        even_prefix = bytes.fromhex(sha1_prefix[: len(sha1_prefix) // 2 * 2])
+        pos = self._bisect(even_prefix.ljust(1, b"\x00"))
+        while pos < self.num_objects:
+            name = self.oid(pos)
+            if not name.raw.startswith(even_prefix):
+                break
+            if name.hex().startswith(sha1_prefix):
+                yield name
+            pos += 1
+
+    def entry(self, pos):
+        """return (pack position in pack_names, offset) of an object"""
+        pos = self._offsets + 8 * pos
+        pack_id, offset = struct.unpack_from(">II", self._data, pos)
+        if offset & LARGE_OFFSET:
+            if self._large_offsets is None:
+                raise MultiPackIndexFormatError("missing LOFF chunk")
+            index = self._large_offsets + 8 * (offset & ~LARGE_OFFSET)
+            offset = struct.unpack_from(">Q", self._data, index)[0]
+        return pack_id, offset
+
+    def checksum(self) -> bytes:
+        return self._data[len(self._data) - HASH_LENGTH :]
+
+    def __iter__(self):
+        for pos in range(self.num_objects):
+            yield self.oid(pos)
+
+    def verify(self, packs_by_name):
+        """yield a message for every problem found"""
+        end = len(self._data) - HASH_LENGTH
+        if hashlib.sha1(self._data[:end]).digest() != self.checksum():
+            yield "incorrect checksum"
+            return
+        packs = []
+        for name in self.pack_names:
+            if name not in packs_by_name:
+                yield f"failed to load pack {name}"
+            packs.append(packs_by_name.get(name))
+        counts = [0] * 256
+        previous = None
+        for pos in range(len(self)):
+            oid = self.oid(pos)
+            counts[oid.raw[0]] += 1
+            if previous is not None and previous >= oid:
+                yield f"oid lookup out of order: {previous} before {oid}"
+            previous = oid
+            pack_id, offset = self.entry(pos)
+            if pack_id >= len(packs):
+                yield f"bad pack-int-id {pack_id} for {oid}"
+                continue
+            p = packs[pack_id]
+            if p is None:
+                continue
+            index_pos = p.index.find(oid)
+            if index_pos is None or p.index.offset(index_pos) != offset:
+                yield f"incorrect object offset for oid {oid} in {p.idx_path.name}"
+        total = 0
+        for byte in range(256):
+            total += counts[byte]
+            if self._fanout_at(byte) != total:
+                yield f"oid fanout out of order: fanout[{byte}]"
+                break
+        for p in packs:
+            if p is None:
+                continue
+            for oid in p.index:
+                if self.find(oid) is None:
+                    yield f"{oid} of {p.idx_path.name} is missing"
+
+    @staticmethod
+    def open(path):
+        try:
+            with open(path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (FileNotFoundError, ValueError):  # missing or empty file
+            return None
+        return MultiPackIndex(data)
+
+
+def serialize_multi_pack_index(packs):
+    """index every object of packs; duplicates point into the newest pack"""
+    packs = sorted(packs, key=lambda p: p.idx_path.name)
+    mtimes = [os.stat(p.pack_path).st_mtime_ns for p in packs]
+    entries = {}
+    for pack_id in sorted(range(len(packs)), key=lambda i: -mtimes[i]):
+        index = packs[pack_id].index
+        for pos in range(len(index)):
+            entries.setdefault(index.name(pos).raw, (pack_id, index.offset(pos)))
+    oids = sorted(entries)
+
+    names = b"".join(p.idx_path.name.encode() + b"\x00" for p in packs)
+    names += b"\x00" * (-len(names) % 4)
+    fanout = bytearray(FANOUT_SIZE)
+    counts = [0] * 256
+    for oid in oids:
+        counts[oid[0]] += 1
+    total = 0
+    for byte in range(256):
+        total += counts[byte]
+        struct.pack_into(">I", fanout, 4 * byte, total)
+    offsets = bytearray(8 * len(oids))
+    large_offsets = bytearray()
+    for i, oid in enumerate(oids):
+        pack_id, offset = entries[oid]
+        if offset >= LARGE_OFFSET:
+            large_offsets += struct.pack(">Q", offset)
+            offset = LARGE_OFFSET | (len(large_offsets) // 8 - 1)
+        struct.pack_into(">II", offsets, 8 * i, pack_id, offset)
+
+    chunks = [
+        (CHUNK_PACK_NAMES, names),
+        (CHUNK_OID_FANOUT, bytes(fanout)),
+        (CHUNK_OID_LOOKUP, b"".join(oids)),
+        (CHUNK_OBJECT_OFFSETS, bytes(offsets)),
+    ]
+    if large_offsets:
+        chunks.append((CHUNK_LARGE_OFFSETS, bytes(large_offsets)))
+    return serialize_chunk_file(
+        SIGNATURE, [VERSION, HASH_VERSION], chunks, struct.pack(">I", len(packs))
+    )
+
+
+def write_multi_pack_index():
+    packs = pack.get_packs()
+    path = find_multi_pack_index_file()
+    write_file_atomic(path, serialize_multi_pack_index(packs))
+    pack.reload_packs()
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "action",
+        choices=["write", "verify"],
+        help="write a multi-pack-index for all packs, or check the existing one",
+    )
+
+
+def multi_pack_index(args):
+    if args.action == "write":
+        write_multi_pack_index()
+        return
+    midx = MultiPackIndex.open(find_multi_pack_index_file())
+    if midx is None:
+        return
+    packs_by_name = {p.idx_path.name: p for p in pack.get_packs()}
+    ok = True
+    for error in midx.verify(packs_by_name):
+        sys.stdout.write(f"error: {error}\n")
+        ok = False
+    if not ok:
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    multi_pack_index(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+import functools
+
+raw_length = 20
+hex_length = 2 * raw_length
+
+
+@functools.total_ordering
+class ObjectId:
+    """object name kept as its raw 20 bytes, with the hex form computed once
+
+    bytes are kept as they are; any other buffer, such as a memoryview into
+    a tree, an idx or a commit-graph file, is copied into 20 bytes of its
+    own, as a view can not be hashed and would keep its buffer alive
+    """
+
+    __slots__ = ("_raw", "_hex")
+
+    def __init__(self, raw: bytes):
+        if len(raw) != raw_length:
+            raise ValueError(f"object id must be {raw_length} bytes")
+        self._raw = raw if type(raw) is bytes else bytes(raw)
+        self._hex = None
+
+    @property
+    def raw(self) -> bytes:
+        return self._raw
+
+    def hex(self) -> str:
+        if self._hex is None:
+            self._hex = self._raw.hex()
+        return self._hex
+
+    def __str__(self):
+        return self.hex()
+
+    def __format__(self, format_spec):
+        return format(self.hex(), format_spec)
+
+    def __repr__(self):
+        return f"ObjectId({self.hex()})"
+
+    def __eq__(self, other):
+        if not isinstance(other, ObjectId):
+            return NotImplemented
+        return self._raw == other._raw
+
+    def __lt__(self, other):
+        if not isinstance(other, ObjectId):
+            return NotImplemented
+        return self._raw < other._raw
+
+    def __hash__(self):
+        return hash(self._raw)
+
+    def __reduce__(self):
+        return ObjectId, (self._raw,)
+
+    @staticmethod
+    def from_hex(sha1: str):
+        oid = ObjectId(bytes.fromhex(sha1))
+        oid._hex = sha1.lower()
+        return oid
+
+
+null_oid = ObjectId(bytes(raw_length))
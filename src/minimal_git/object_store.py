@@ -0,0 +1,519 @@
+# object databases: where objects are kept, independent of how they are used
+#
+# every store maps an ObjectId to the raw object ("<type> <size>\0<content>")
+# the default is the loose-file store under .git/objects; setting
+# core.objectstore = sqlite in .git/config keeps objects in one SQLite file
+# instead, and set_object_store() installs any store, e.g. an in-memory one;
+# object directories listed in objects/info/alternates are searched after it
+
+import contextlib
+import functools
+import hashlib
+import os
+import pathlib
+import sqlite3
+import threading
+import zlib
+
+from . import pack
+from . import paths
+from .config import get_config
+from .object_id import ObjectId, raw_length
+
+# inflating a loose object stops after these many bytes to read its header
+max_header_length = 32
+stream_chunk_size = 1 << 16
+
+
+class CorruptObjectError(BaseException):
+    pass
+
+
+def split_header(raw: bytes):
+    """return (type, size, content) of a raw object"""
+    header, _, content = raw.partition(b"\x00")
+    object_type, _, size = header.partition(b" ")
+    return object_type.decode(), int(size), content
+
+
+def make_header(object_type: str, size: int) -> bytes:
+    return f"{object_type} {size}\0".encode()
+
+
+def hash_raw(raw: bytes) -> ObjectId:
+    return ObjectId(hashlib.sha1(raw).digest())
+
+
+def prefix_range(sha1_prefix: str):
+    """raw bounds [low, high) of names starting with a hex prefix
+
+    high is None when there is no upper bound
+    """
+    low = bytes.fromhex(sha1_prefix[: len(sha1_prefix) // 2 * 2])
+    if len(sha1_prefix) % 2:
+        nibble = int(sha1_prefix[-1], 16) << 4
+        return low + bytes([nibble]), increment(low + bytes([nibble | 0x0F]))
+    return low, increment(low)
+
+
+def increment(prefix: bytes):
+    stripped = prefix.rstrip(b"\xff")
+    if not stripped:
+        return None
+    return stripped[:-1] + bytes([stripped[-1] + 1])
+
+
+class ObjectStore:
+    """interface of an object database
+
+    read() returns the raw object and raises paths.SHA1NotFoundError for
+    missing objects; read_header() and read_chunks() may be overridden by
+    stores which can answer them without reading the whole object
+    """
+
+    def has(self, sha1: ObjectId) -> bool:
+        raise NotImplementedError
+
+    def read(self, sha1: ObjectId) -> bytes:
+        raise NotImplementedError
+
+    def read_header(self, sha1: ObjectId):
+        """return (type, size) of an object"""
+        object_type, size, _ = split_header(self.read(sha1))
+        return object_type, size
+
+    def read_chunks(self, sha1: ObjectId):
+        """yield the content (without header) of an object in chunks"""
+        yield split_header(self.read(sha1))[2]
+
+    def write(self, raw: bytes) -> ObjectId:
+        raise NotImplementedError
+
+    def iter(self):
+        """yield the names of all objects in no particular order"""
+        raise NotImplementedError
+
+    def resolve_prefix(self, sha1_prefix: str):
+        """yield the names of objects whose hex form starts with sha1_prefix"""
+        raise NotImplementedError
+
+    def batch(self):
+        """context manager around many writes, for stores that can group them"""
+        return contextlib.nullcontext()
+
+    @property
+    def local(self):
+        """the store written to, without any alternates"""
+        return self
+
+    def in_alternate(self, sha1: ObjectId) -> bool:
+        return False
+
+
+class LooseObjectStore(ObjectStore):
+    """zlib-compressed files objects/xx/yyyy..., plus the packs in objects/pack
+
+    pack_set defaults to the packs of the current repository
+    """
+
+    def __init__(self, object_dir, pack_set=None):
+        self.object_dir = os.fspath(object_dir)
+        self._pack_set = pack_set
+
+    def pack_set(self):
+        return pack.get_pack_set() if self._pack_set is None else self._pack_set
+
+    def _find_packed(self, sha1: ObjectId):
+        found = self.pack_set().find(sha1)
+        if found is None:
+            raise paths.SHA1NotFoundError(sha1)
+        return found
+
+    def _path(self, sha1: ObjectId):
+        sha1_hex = sha1.hex()
+        return os.path.join(self.object_dir, sha1_hex[:2], sha1_hex[2:])
+
+    def has(self, sha1):
+        if os.path.isfile(self._path(sha1)):
+            return True
+        return self.pack_set().find(sha1) is not None
+
+    def read(self, sha1):
+        try:
+            with open(self._path(sha1), "rb") as f:
+                return zlib.decompress(f.read())
+        except FileNotFoundError:
+            p, offset = self._find_packed(sha1)
+            object_type, content = p.read_at(offset)
+            return make_header(object_type, len(content)) + content
+
+    @staticmethod
+    def _inflate_chunks(f, decompressor, chunk_size):
+        while not decompressor.eof:
+            compressed = decompressor.unconsumed_tail or f.read(chunk_size)
+            if not compressed:
+                raise CorruptObjectError("truncated loose object")
+            chunk = decompressor.decompress(compressed, chunk_size)
+            if chunk:
+                yield chunk
+
+    def _read_header(self, f, decompressor):
+        """return type, size and whatever content was inflated along with them"""
+        inflated = b""
+        for chunk in self._inflate_chunks(f, decompressor, max_header_length):
+            inflated += chunk
+            if b"\x00" in inflated:
+                break
+            if len(inflated) > max_header_length:
+                raise CorruptObjectError("loose object header too long")
+        return split_header(inflated)
+
+    def read_header(self, sha1):
+        # only the first few bytes of a loose object are inflated
+        try:
+            f = open(self._path(sha1), "rb")
+        except FileNotFoundError:
+            p, offset = self._find_packed(sha1)
+            return p.read_header_at(offset)
+        with f:
+            object_type, size, _ = self._read_header(f, zlib.decompressobj())
+        return object_type, size
+
+    def read_chunks(self, sha1):
+        try:
+            f = open(self._path(sha1), "rb")
+        except FileNotFoundError:
+            p, offset = self._find_packed(sha1)
+            yield from p.iter_content_at(offset)
+            return
+        with f:
+            decompressor = zlib.decompressobj()
+            _, _, rest = self._read_header(f, decompressor)
+            if rest:
+                yield rest
+            yield from self._inflate_chunks(f, decompressor, stream_chunk_size)
+
+    def write(self, raw):
+        sha1 = hash_raw(raw)
+        if self.has(sha1):
+            return sha1
+        path = self._path(sha1)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(zlib.compress(raw))
+        return sha1
+
+    def _iter_loose(self, dir_name):
+        try:
+            names = os.listdir(os.path.join(self.object_dir, dir_name))
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for name in names:
+            if len(name) == 2 * raw_length - 2:
+                try:
+                    yield ObjectId.from_hex(dir_name + name)
+                except ValueError:  # not an object file
+                    pass
+
+    def iter_loose(self):
+        for dir_name in os.listdir(self.object_dir):
+            if len(dir_name) == 2:
+                yield from self._iter_loose(dir_name)
+
+    def iter(self):
+        seen = set()
+        for sha1 in self.iter_loose():
+            seen.add(sha1)
+            yield sha1
+        for sha1 in self.pack_set():
+            if sha1 not in seen:
+                seen.add(sha1)
+                yield sha1
+
+    def resolve_prefix(self, sha1_prefix):
+        # loose objects are only looked for in the directory of the prefix
+        found = set()
+        if len(sha1_prefix) >= 2:
+            dir_names = [sha1_prefix[:2]]
+        else:
+            dir_names = [d for d in os.listdir(self.object_dir) if len(d) == 2]
+        for dir_name in dir_names:
+            for sha1 in self._iter_loose(dir_name):
+                if sha1.hex().startswith(sha1_prefix):
+                    found.add(sha1)
+        found.update(self.pack_set().find_prefix(sha1_prefix))
+        return iter(sorted(found))
+
+
+class MemoryObjectStore(ObjectStore):
+    """objects kept in a dict, gone with the process; meant for scratch repos"""
+
+    def __init__(self):
+        self._objects = {}
+
+    def has(self, sha1):
+        return sha1 in self._objects
+
+    def read(self, sha1):
+        try:
+            return self._objects[sha1]
+        except KeyError:
+            raise paths.SHA1NotFoundError(sha1)
+
+    def write(self, raw):
+        sha1 = hash_raw(raw)
+        self._objects.setdefault(sha1, raw)
+        return sha1
+
+    def iter(self):
+        return iter(list(self._objects))
+
+    def resolve_prefix(self, sha1_prefix):
+        return (s for s in self.iter() if s.hex().startswith(sha1_prefix))
+
+
+class SQLiteObjectStore(ObjectStore):
+    """all objects in one table of a SQLite database in WAL mode
+
+    type and size have their own columns so that headers are read without
+    inflating anything; the primary key index serves prefix lookups
+
+    outside batch() every write is a transaction of its own; the connection
+    is shared by the threads of add, which take turns through a lock
+    """
+
+    def __init__(self, path):
+        self._db = sqlite3.connect(
+            os.fspath(path), isolation_level=None, check_same_thread=False
+        )
+        self._lock = threading.Lock()
+        self._in_batch = False
+        self._execute("PRAGMA journal_mode=WAL")
+        self._execute("PRAGMA synchronous=NORMAL")
+        self._execute(
+            "CREATE TABLE IF NOT EXISTS objects ("
+            " oid BLOB PRIMARY KEY,"
+            " type TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " data BLOB NOT NULL"
+            ") WITHOUT ROWID"
+        )
+
+    def _execute(self, query, params=()):
+        with self._lock:
+            return self._db.execute(query, params).fetchall()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """write the objects of the block in one transaction
+
+        objects written before an error are still committed: they are
+        valid, only unreferenced, like loose objects left by a failed command
+        """
+        with self._lock:
+            outer = not self._in_batch
+            if outer:
+                self._db.execute("BEGIN")
+                self._in_batch = True
+        try:
+            yield
+        finally:
+            if outer:
+                with self._lock:
+                    self._in_batch = False
+                    self._db.execute("COMMIT")
+
+    def has(self, sha1):
+        query = "SELECT 1 FROM objects WHERE oid = ?"
+        return bool(self._execute(query, (sha1.raw,)))
+
+    def read(self, sha1):
+        query = "SELECT type, size, data FROM objects WHERE oid = ?"
+        rows = self._execute(query, (sha1.raw,))
+        if not rows:
+            raise paths.SHA1NotFoundError(sha1)
+        object_type, size, data = rows[0]
+        return make_header(object_type, size) + zlib.decompress(data)
+
+    def read_header(self, sha1):
+        query = "SELECT type, size FROM objects WHERE oid = ?"
+        rows = self._execute(query, (sha1.raw,))
+        if not rows:
+            raise paths.SHA1NotFoundError(sha1)
+        return rows[0]
+
+    def write(self, raw):
+        sha1 = hash_raw(raw)
+        object_type, size, content = split_header(raw)
+        # compressed before taking the lock so that threads deflate in parallel
+        data = zlib.compress(content)
+        self._execute(
+            "INSERT OR IGNORE INTO objects VALUES (?, ?, ?, ?)",
+            (sha1.raw, object_type, size, data),
+        )
+        return sha1
+
+    def iter(self):
+        rows = self._execute("SELECT oid FROM objects")
+        return (ObjectId(oid) for oid, in rows)
+
+    def resolve_prefix(self, sha1_prefix):
+        low, high = prefix_range(sha1_prefix)
+        if high is None:
+            query, params = "SELECT oid FROM objects WHERE oid >= ?", (low,)
+        else:
+            query = "SELECT oid FROM objects WHERE oid >= ? AND oid < ?"
+            params = (low, high)
+        rows = self._execute(query + " ORDER BY oid", params)
+        return (ObjectId(oid) for oid, in rows)
+
+
+class AlternatesObjectStore(ObjectStore):
+    """a store falling back to the object directories it borrows from
+
+    the local store is always asked first; objects missing from every
+    alternate are remembered so repeated misses cost no file system access
+    """
+
+    def __init__(self, local, alternates):
+        self._local = local
+        self.alternates = alternates
+        self._missing = set()
+
+    @property
+    def local(self):
+        return self._local
+
+    def _find_alternate(self, sha1):
+        if sha1 not in self._missing:
+            for store in self.alternates:
+                if store.has(sha1):
+                    return store
+            self._missing.add(sha1)
+        return None
+
+    def in_alternate(self, sha1):
+        return self._find_alternate(sha1) is not None
+
+    def _find_store(self, sha1):
+        if self._local.has(sha1):
+            return self._local
+        store = self._find_alternate(sha1)
+        if store is None:
+            raise paths.SHA1NotFoundError(sha1)
+        return store
+
+    def has(self, sha1):
+        return self._local.has(sha1) or self.in_alternate(sha1)
+
+    def read(self, sha1):
+        try:
+            return self._local.read(sha1)
+        except paths.SHA1NotFoundError:
+            store = self._find_alternate(sha1)
+            if store is None:
+                raise
+            return store.read(sha1)
+
+    def read_header(self, sha1):
+        return self._find_store(sha1).read_header(sha1)
+
+    def read_chunks(self, sha1):
+        return self._find_store(sha1).read_chunks(sha1)
+
+    def batch(self):
+        return self._local.batch()
+
+    def write(self, raw):
+        # objects borrowed from an alternate are not copied
+        sha1 = hash_raw(raw)
+        if self.in_alternate(sha1):
+            return sha1
+        return self._local.write(raw)
+
+    def iter(self):
+        seen = set()
+        for store in [self._local] + self.alternates:
+            for sha1 in store.iter():
+                if sha1 not in seen:
+                    seen.add(sha1)
+                    yield sha1
+
+    def resolve_prefix(self, sha1_prefix):
+        found = set()
+        for store in [self._local] + self.alternates:
+            found.update(store.resolve_prefix(sha1_prefix))
+        return iter(sorted(found))
+
+
+# alternates may list alternates of their own, up to this depth
+max_alternate_depth = 5
+
+
+def read_alternates(object_dir, depth=0):
+    """object directories listed in objects/info/alternates, recursively
+
+    relative paths are relative to object_dir, as in git
+    """
+    try:
+        with open(os.path.join(object_dir, "info", "alternates")) as f:
+            lines = f.read().splitlines()
+    except FileNotFoundError:
+        return []
+    alternate_dirs = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        alternate_dir = os.path.normpath(os.path.join(object_dir, line))
+        alternate_dirs.append(alternate_dir)
+        if depth < max_alternate_depth:
+            alternate_dirs += read_alternates(alternate_dir, depth + 1)
+    return alternate_dirs
+
+
+def open_alternate(object_dir):
+    pack_set = pack.PackSet.load(pathlib.Path(object_dir) / "pack")
+    return LooseObjectStore(object_dir, pack_set)
+
+
+sqlite_file_name = "objects.sqlite"
+_installed_store = None
+
+
+def set_object_store(store):
+    """use store for all objects of this process (None restores the default)"""
+    global _installed_store
+    _installed_store = store
+
+
+@functools.lru_cache(maxsize=None)
+def open_object_store(object_dir):
+    kind = get_config("core", "objectstore") or "loose"
+    if kind == "loose":
+        store = LooseObjectStore(object_dir)
+    elif kind == "sqlite":
+        store = SQLiteObjectStore(object_dir / sqlite_file_name)
+    else:
+        raise ValueError(f"unknown core.objectstore: {kind}")
+    alternate_dirs = []
+    for alternate_dir in read_alternates(object_dir):
+        if alternate_dir not in alternate_dirs + [os.path.normpath(object_dir)]:
+            alternate_dirs.append(alternate_dir)
+    if not alternate_dirs:
+        return store
+    return AlternatesObjectStore(store, [open_alternate(d) for d in alternate_dirs])
+
+
+_last_opened = (None, None)  # (repository root, its store)
+
+
+def get_object_store() -> ObjectStore:
+    global _last_opened
+    if _installed_store is not None:
+        return _installed_store
+    # called for every object read, so the common case skips building paths
+    root = paths.find_repository_root()
+    if _last_opened[0] is not root:
+        _last_opened = (root, open_object_store(paths.find_object_dir()))
+    return _last_opened[1]
@@ -0,0 +1,634 @@
+# read and write packfiles (version 2) and their .idx files (version 2)
+# see Documentation/gitformat-pack.txt in git for the file formats
+
+import functools
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+
+from . import multi_pack_index
+from . import paths
+from .object_id import ObjectId
+
+
+class PackFormatError(BaseException):
+    pass
+
+
+PACK_SIGNATURE = b"PACK"
+PACK_VERSION = 2
+IDX_SIGNATURE = b"\377tOc"
+IDX_VERSION = 2
+HASH_LENGTH = 20
+FANOUT_SIZE = 256 * 4
+LARGE_OFFSET = 0x80000000
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+type_names = {OBJ_COMMIT: "commit", OBJ_TREE: "tree", OBJ_BLOB: "blob", OBJ_TAG: "tag"}
+type_numbers = {name: number for number, name in type_names.items()}
+
+
+def find_pack_dir():
+    return paths.find_object_dir() / "pack"
+
+
+# reading
+
+
+def read_delta_size(delta, pos):
+    size = 0
+    shift = 0
+    while True:
+        c = delta[pos]
+        pos += 1
+        size |= (c & 0x7F) << shift
+        shift += 7
+        if not c & 0x80:
+            return size, pos
+
+
+def decode_entry_header(data, offset):
+    """return (type number, size, position after the header) of a pack entry"""
+    c = data[offset]
+    pos = offset + 1
+    obj_type = (c >> 4) & 0x7
+    size = c & 0x0F
+    shift = 4
+    while c & 0x80:
+        c = data[pos]
+        pos += 1
+        size |= (c & 0x7F) << shift
+        shift += 7
+    return obj_type, size, pos
+
+
+def read_entry_header(data, offset):
+    """return (type number, size, data offset, delta base) of an entry
+
+    the delta base is the offset of the base for an OFS_DELTA and its name
+    for a REF_DELTA
+    """
+    obj_type, size, pos = decode_entry_header(data, offset)
+    base = None
+    if obj_type == OBJ_OFS_DELTA:
+        c = data[pos]
+        pos += 1
+        distance = c & 0x7F
+        while c & 0x80:
+            c = data[pos]
+            pos += 1
+            distance = ((distance + 1) << 7) | (c & 0x7F)
+        base = offset - distance
+    elif obj_type == OBJ_REF_DELTA:
+        base = ObjectId(data[pos : pos + HASH_LENGTH])
+        pos += HASH_LENGTH
+    return obj_type, size, pos, base
+
+
+def inflate_entry(data, pos, chunk_size=1 << 16):
+    """return the inflated data at pos and the position after it"""
+    decompressor = zlib.decompressobj()
+    chunks = []
+    while not decompressor.eof:
+        if pos >= len(data):
+            raise PackFormatError("truncated pack entry")
+        compressed = data[pos : pos + chunk_size]
+        chunks.append(decompressor.decompress(compressed))
+        pos += len(compressed)
+    return b"".join(chunks), pos - len(decompressor.unused_data)
+
+
+def apply_delta(base: bytes, delta: bytes):
+    pos = 0
+    base_size, pos = read_delta_size(delta, pos)
+    if base_size != len(base):
+        raise PackFormatError("delta base size mismatch")
+    result_size, pos = read_delta_size(delta, pos)
+    result = bytearray()
+    while pos < len(delta):
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:  # copy from base
+            offset = 0
+            size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            size = size or 0x10000
+            result += base[offset : offset + size]
+        elif op:  # insert literal data
+            result += delta[pos : pos + op]
+            pos += op
+        else:
+            raise PackFormatError("invalid delta opcode")
+    if len(result) != result_size:
+        raise PackFormatError("delta result size mismatch")
+    return bytes(result)
+
+
+class PackIndex:
+    def __init__(self, data):
+        self._data = data
+        if data[:4] != IDX_SIGNATURE:
+            raise PackFormatError("unsupported pack index version")
+        version = struct.unpack_from(">I", data, 4)[0]
+        if version != IDX_VERSION:
+            raise PackFormatError("unsupported pack index version")
+        self._fanout = 8
+        self.num_objects = self._fanout_at(255)
+        n = self.num_objects
+        self._names = self._fanout + FANOUT_SIZE
+        self._crcs = self._names + n * HASH_LENGTH
+        self._offsets = self._crcs + n * 4
+        self._large_offsets = self._offsets + n * 4
+
+    def __len__(self):
+        return self.num_objects
+
+    def _fanout_at(self, byte):
+        return struct.unpack_from(">I", self._data, self._fanout + 4 * byte)[0]
+
+    def _name_bytes(self, pos):
+        start = self._names + pos * HASH_LENGTH
+        return self._data[start : start + HASH_LENGTH]
+
+    def name(self, pos) -> ObjectId:
+        return ObjectId(self._name_bytes(pos))
+
+    def offset(self, pos) -> int:
+        offset = struct.unpack_from(">I", self._data, self._offsets + 4 * pos)[0]
+        if offset & LARGE_OFFSET:
+            index = offset & ~LARGE_OFFSET
+            offset = struct.unpack_from(">Q", self._data, self._large_offsets + 8 * index)[0]
+        return offset
+
+    def crc32(self, pos) -> int:
+        return struct.unpack_from(">I", self._data, self._crcs + 4 * pos)[0]
+
+    def pack_checksum(self) -> bytes:
+        end = len(self._data) - HASH_LENGTH
+        return self._data[end - HASH_LENGTH : end]
+
+    def _bisect(self, key: bytes):
+        """position of the first name not less than key"""
+        lo = self._fanout_at(key[0] - 1) if key[0] > 0 else 0
+        hi = self._fanout_at(key[0])
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name_bytes(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def find(self, sha1: ObjectId):
+        """binary search the position of an object, or None if absent"""
+        key = sha1.raw
+        pos = self._bisect(key)
+        if pos < self.num_objects and self._name_bytes(pos) == key:
+            return pos
+        return None
+
+    def find_prefix(self, sha1_prefix: str):
+        """yield names of objects whose hex form starts with sha1_prefix"""
+        even_prefix = bytes.fromhex(sha1_prefix[: len(sha1_prefix) // 2 * 2])
+        pos = self._bisect(even_prefix.ljust(1, b"\x00"))
+        while pos < self.num_objects:
+            name = self.name(pos)
+            if not name.raw.startswith(even_prefix):
+                break
+            if name.hex().startswith(sha1_prefix):
+                yield name
+            pos += 1
+
+    def __iter__(self):
+        for pos in range(self.num_objects):
+            yield self.name(pos)
+
+    @staticmethod
+    def open(path):
+        with open(path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return PackIndex(data)
+
+
+class Pack:
+    def __init__(self, pack_path):
+        self.pack_path = pack_path
+        self.idx_path = pack_path.with_suffix(".idx")
+        self.index = PackIndex.open(self.idx_path)
+        self._data = None
+
+    def _pack_data(self):
+        # the pack itself is only mapped once an object is read
+        if self._data is None:
+            with open(self.pack_path, "rb") as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._data[:4] != PACK_SIGNATURE:
+                raise PackFormatError(f"{self.pack_path} is not a packfile")
+        return self._data
+
+    @property
+    def checksum(self) -> str:
+        return self.index.pack_checksum().hex()
+
+    def contains(self, sha1: ObjectId):
+        return self.index.find(sha1) is not None
+
+    def read_entry_header(self, offset):
+        """return (type number, size, data offset, delta base) of an entry"""
+        return read_entry_header(self._pack_data(), offset)
+
+    def _inflate(self, pos):
+        data = self._pack_data()
+        decompressor = zlib.decompressobj()
+        chunks = []
+        chunk_size = 1 << 16
+        while not decompressor.eof:
+            if pos >= len(data):
+                raise PackFormatError("truncated pack entry")
+            chunks.append(decompressor.decompress(data[pos : pos + chunk_size]))
+            pos += chunk_size
+        return b"".join(chunks)
+
+    def _iter_inflate(self, pos, chunk_size=1 << 16):
+        """yield the inflated data at pos in chunks of at most chunk_size"""
+        data = self._pack_data()
+        decompressor = zlib.decompressobj()
+        while not decompressor.eof:
+            if decompressor.unconsumed_tail:
+                compressed = decompressor.unconsumed_tail
+            elif pos < len(data):
+                compressed = data[pos : pos + chunk_size]
+                pos += chunk_size
+            else:
+                raise PackFormatError("truncated pack entry")
+            chunk = decompressor.decompress(compressed, chunk_size)
+            if chunk:
+                yield chunk
+
+    def _inflate_prefix(self, pos, n):
+        """inflate at least the first n bytes (if there are as many) at pos"""
+        prefix = b""
+        for chunk in self._iter_inflate(pos, n):
+            prefix += chunk
+            if len(prefix) >= n:
+                break
+        return prefix
+
+    def read_header_at(self, offset):
+        """return (type name, size) of the object at offset without inflating it"""
+        obj_type, size, pos, base = self.read_entry_header(offset)
+        if obj_type in type_names:
+            return type_names[obj_type], size
+        # the delta starts with the base size and the result size
+        max_varint_length = 10
+        delta = self._inflate_prefix(pos, 2 * max_varint_length)
+        _, delta_pos = read_delta_size(delta, 0)
+        size, _ = read_delta_size(delta, delta_pos)
+        if obj_type == OBJ_OFS_DELTA:
+            base_type, _ = self.read_header_at(base)
+        elif obj_type == OBJ_REF_DELTA:
+            base_type, _ = read_packed_header(base)
+        else:
+            raise PackFormatError(f"unknown pack object type {obj_type}")
+        return base_type, size
+
+    def iter_content_at(self, offset):
+        """yield the content of the object at offset in chunks"""
+        obj_type, _, pos, _ = self.read_entry_header(offset)
+        if obj_type in type_names:
+            yield from self._iter_inflate(pos)
+        else:
+            # a delta can only be applied to its whole base
+            yield self.read_at(offset)[1]
+
+    def read_at(self, offset):
+        """return (type name, content) of the object at offset"""
+        obj_type, _, pos, base = self.read_entry_header(offset)
+        if obj_type in type_names:
+            return type_names[obj_type], self._inflate(pos)
+        delta = self._inflate(pos)
+        if obj_type == OBJ_OFS_DELTA:
+            base_type, base_content = self.read_at(base)
+        elif obj_type == OBJ_REF_DELTA:
+            base_type, base_content = read_packed_object_content(base)
+        else:
+            raise PackFormatError(f"unknown pack object type {obj_type}")
+        return base_type, apply_delta(base_content, delta)
+
+    def read(self, sha1: ObjectId):
+        pos = self.index.find(sha1)
+        if pos is None:
+            return None
+        return self.read_at(self.index.offset(pos))
+
+
+def load_packs(pack_dir):
+    return [Pack(p) for p in sorted(pack_dir.glob("pack-*.pack"))]
+
+
+class PackSet:
+    """the packs of one object directory, looked up through its multi-pack-index
+
+    packs added after the multi-pack-index was written are searched one by one
+    """
+
+    def __init__(self, packs, midx=None):
+        self.packs = packs
+        self.midx = None
+        self._midx_packs = []
+        self._other_packs = packs
+        if midx is not None:
+            by_name = {p.idx_path.name: p for p in packs}
+            # a multi-pack-index naming removed packs is out of date
+            if all(name in by_name for name in midx.pack_names):
+                self.midx = midx
+                self._midx_packs = [by_name[name] for name in midx.pack_names]
+                covered = set(midx.pack_names)
+                self._other_packs = [
+                    p for p in packs if p.idx_path.name not in covered
+                ]
+
+    @staticmethod
+    def load(pack_dir):
+        midx_path = multi_pack_index.find_multi_pack_index_file(pack_dir)
+        midx = multi_pack_index.MultiPackIndex.open(midx_path)
+        return PackSet(load_packs(pack_dir), midx)
+
+    def find(self, sha1: ObjectId):
+        """return (pack, offset) of an object, or None if it is not packed"""
+        if self.midx is not None:
+            pos = self.midx.find(sha1)
+            if pos is not None:
+                pack_id, offset = self.midx.entry(pos)
+                return self._midx_packs[pack_id], offset
+        for p in self._other_packs:
+            pos = p.index.find(sha1)
+            if pos is not None:
+                return p, p.index.offset(pos)
+        return None
+
+    def find_prefix(self, sha1_prefix: str):
+        """yield names of packed objects starting with sha1_prefix (maybe twice)"""
+        if self.midx is not None:
+            yield from self.midx.find_prefix(sha1_prefix)
+        for p in self._other_packs:
+            yield from p.index.find_prefix(sha1_prefix)
+
+    def __iter__(self):
+        """yield the names of all packed objects (maybe twice)"""
+        if self.midx is not None:
+            yield from self.midx
+        for p in self._other_packs:
+            yield from p.index
+
+
+@functools.lru_cache(maxsize=None)
+def get_packs():
+    try:
+        pack_dir = find_pack_dir()
+    except paths.NotGitRepositoryError:
+        return []
+    return load_packs(pack_dir)
+
+
+@functools.lru_cache(maxsize=None)
+def get_pack_set():
+    try:
+        midx_path = multi_pack_index.find_multi_pack_index_file()
+    except paths.NotGitRepositoryError:
+        return PackSet([])
+    return PackSet(get_packs(), multi_pack_index.MultiPackIndex.open(midx_path))
+
+
+def reload_packs():
+    """forget the packs found so far, after packs were added or removed"""
+    get_packs.cache_clear()
+    get_pack_set.cache_clear()
+
+
+def read_packed_object_content(sha1: ObjectId):
+    found = get_pack_set().find(sha1)
+    if found is None:
+        raise paths.SHA1NotFoundError(sha1)
+    p, offset = found
+    return p.read_at(offset)
+
+
+def read_packed_object(sha1: ObjectId):
+    """return the raw content (header included) of a packed object or None"""
+    found = get_pack_set().find(sha1)
+    if found is None:
+        return None
+    p, offset = found
+    object_type, content = p.read_at(offset)
+    header = f"{object_type} {len(content)}\0".encode()
+    return header + content
+
+
+def read_packed_header(sha1: ObjectId):
+    """return (type name, size) of a packed object or None"""
+    found = get_pack_set().find(sha1)
+    if found is None:
+        return None
+    p, offset = found
+    return p.read_header_at(offset)
+
+
+# writing
+
+
+def encode_entry_header(obj_type: int, size: int):
+    c = (obj_type << 4) | (size & 0x0F)
+    size >>= 4
+    header = bytearray()
+    while size:
+        header.append(c | 0x80)
+        c = size & 0x7F
+        size >>= 7
+    header.append(c)
+    return bytes(header)
+
+
+class PackWriter:
+    """write undeltified objects to a pack and collect its index entries
+
+    num_objects may be None when the count is not known in advance; the
+    header is then fixed up by finish(), which needs f to be readable
+    """
+
+    def __init__(self, f, num_objects):
+        self._f = f
+        self._hash = hashlib.sha1()
+        self._offset = 0
+        self._num_objects = num_objects
+        self.entries = []  # (sha1, crc32, offset) in pack order
+        self._write(pack_header(num_objects or 0))
+
+    def _write(self, data):
+        self._f.write(data)
+        self._hash.update(data)
+        self._offset += len(data)
+
+    def add_object(self, sha1: ObjectId, object_type: str, content: bytes):
+        header = encode_entry_header(type_numbers[object_type], len(content))
+        entry = header + zlib.compress(content)
+        self.entries.append((sha1, zlib.crc32(entry), self._offset))
+        self._write(entry)
+
+    @property
+    def size(self):
+        return self._offset
+
+    def _rewrite_header(self):
+        f = self._f
+        f.seek(0)
+        f.write(pack_header(len(self.entries)))
+        f.seek(0)
+        h = hashlib.sha1()
+        remaining = self._offset
+        while remaining > 0:
+            chunk = f.read(min(remaining, 1 << 20))
+            h.update(chunk)
+            remaining -= len(chunk)
+        self._hash = h
+
+    def finish(self) -> bytes:
+        if self._num_objects is None:
+            self._rewrite_header()
+        checksum = self._hash.digest()
+        self._f.write(checksum)
+        return checksum
+
+
+def pack_header(num_objects):
+    return struct.pack(">4sII", PACK_SIGNATURE, PACK_VERSION, num_objects)
+
+
+def serialize_pack_index(entries, pack_checksum: bytes):
+    entries = sorted(entries, key=lambda e: e[0].raw)
+    fanout = bytearray(FANOUT_SIZE)
+    counts = [0] * 256
+    for sha1, _, _ in entries:
+        counts[sha1.raw[0]] += 1
+    total = 0
+    for byte in range(256):
+        total += counts[byte]
+        struct.pack_into(">I", fanout, 4 * byte, total)
+    names = b"".join(sha1.raw for sha1, _, _ in entries)
+    crcs = b"".join(struct.pack(">I", crc) for _, crc, _ in entries)
+    offsets = bytearray()
+    large_offsets = bytearray()
+    for _, _, offset in entries:
+        if offset < LARGE_OFFSET:
+            offsets += struct.pack(">I", offset)
+        else:
+            offsets += struct.pack(">I", LARGE_OFFSET | (len(large_offsets) // 8))
+            large_offsets += struct.pack(">Q", offset)
+    header = IDX_SIGNATURE + struct.pack(">I", IDX_VERSION)
+    data = b"".join(
+        [header, bytes(fanout), names, crcs, bytes(offsets), bytes(large_offsets)]
+    )
+    data += pack_checksum
+    return data + hashlib.sha1(data).digest()
+
+
+def object_name(object_type: str, content: bytes) -> ObjectId:
+    header = b"%s %d\x00" % (object_type.encode(), len(content))
+    return ObjectId(hashlib.sha1(header + content).digest())
+
+
+def index_pack(data):
+    """return the index entries (sha1, crc32, offset) and checksum of a pack
+
+    like git index-pack, for a pack received from elsewhere: every object is
+    inflated once to name it, and deltas are resolved against bases in the
+    same pack (a thin pack, with bases outside of it, is not accepted)
+    """
+    if len(data) < 12 + HASH_LENGTH:
+        raise PackFormatError("pack too short")
+    signature, version, num_objects = struct.unpack_from(">4sII", data, 0)
+    if signature != PACK_SIGNATURE or version not in (2, 3):
+        raise PackFormatError("not a version 2 packfile")
+    end = len(data) - HASH_LENGTH
+    checksum = bytes(data[end:])
+    if hashlib.sha1(data[:end]).digest() != checksum:
+        raise PackFormatError("pack checksum mismatch")
+    entries = []
+    names = {}  # offset -> sha1
+    types = {}  # offset -> type name
+    deltas = []  # offsets of delta entries
+    pos = 12
+    for _ in range(num_objects):
+        offset = pos
+        obj_type, _, pos, _ = read_entry_header(data, offset)
+        content, pos = inflate_entry(data, pos)
+        entries.append((offset, zlib.crc32(data[offset:pos])))
+        if obj_type in type_names:
+            types[offset] = type_names[obj_type]
+            names[offset] = object_name(types[offset], content)
+        elif obj_type in (OBJ_OFS_DELTA, OBJ_REF_DELTA):
+            deltas.append(offset)
+        else:
+            raise PackFormatError(f"unknown pack object type {obj_type}")
+    if pos != end:
+        raise PackFormatError("pack has junk at the end")
+
+    offsets_by_name = {sha1: offset for offset, sha1 in names.items()}
+
+    @functools.lru_cache(maxsize=256)
+    def content_at(offset):
+        # bases are shared by many deltas, so the recent ones are kept
+        obj_type, _, pos, base = read_entry_header(data, offset)
+        content, _ = inflate_entry(data, pos)
+        if obj_type in type_names:
+            return content
+        if obj_type == OBJ_REF_DELTA:
+            base = offsets_by_name[base]
+        return apply_delta(content_at(base), content)
+
+    # a REF_DELTA base may itself be a delta named in an earlier round
+    while deltas:
+        pending = []
+        for offset in deltas:
+            _, _, _, base = read_entry_header(data, offset)
+            if isinstance(base, ObjectId):
+                base = offsets_by_name.get(base)
+            if base is None or base not in names:
+                pending.append(offset)
+                continue
+            types[offset] = types[base]
+            names[offset] = object_name(types[offset], content_at(offset))
+            offsets_by_name[names[offset]] = offset
+        if len(pending) == len(deltas):
+            raise PackFormatError("delta base missing from the pack")
+        deltas = pending
+    return [(names[offset], crc, offset) for offset, crc in entries], checksum
+
+
+def install_pack(tmp_pack_path, entries, checksum: bytes):
+    """write the index of a finished pack and move both into the pack directory"""
+    pack_dir = find_pack_dir()
+    name = f"pack-{checksum.hex()}"
+    idx_data = serialize_pack_index(entries, checksum)
+    tmp_idx_path = tmp_pack_path.with_name(tmp_pack_path.name + ".idx")
+    with open(tmp_idx_path, "wb") as f:
+        f.write(idx_data)
+    pack_path = pack_dir / f"{name}.pack"
+    os.replace(tmp_pack_path, pack_path)
+    os.replace(tmp_idx_path, pack_dir / f"{name}.idx")
+    return Pack(pack_path)
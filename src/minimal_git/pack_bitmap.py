@@ -0,0 +1,272 @@
+# reachability bitmaps stored next to a pack as pack-<checksum>.bitmap
+# see Documentation/technical/bitmap-format.txt in git for the file format
+
+import array
+import functools
+import hashlib
+import struct
+
+from . import ewah
+from . import pack
+from .git_objects import load_object
+from .commit_graph import load_commit_header
+from .object_id import ObjectId
+
+
+class BitmapFormatError(BaseException):
+    pass
+
+
+SIGNATURE = b"BITM"
+VERSION = 1
+OPT_FULL_DAG = 0x1
+HEADER_FORMAT = ">4sHHI20s"
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+ENTRY_HEADER_FORMAT = ">IBB"
+ENTRY_HEADER_SIZE = struct.calcsize(ENTRY_HEADER_FORMAT)
+TYPE_ORDER = ["commit", "tree", "blob", "tag"]
+
+
+class PackBitmap:
+    def __init__(self, p: pack.Pack, data):
+        self.pack = p
+        index = p.index
+        signature, version, flags, n_entries, checksum = struct.unpack_from(
+            HEADER_FORMAT, data, 0
+        )
+        if signature != SIGNATURE or version != VERSION:
+            raise BitmapFormatError("unsupported bitmap index")
+        if not flags & OPT_FULL_DAG:
+            raise BitmapFormatError("bitmap index does not cover the full DAG")
+        if checksum != index.pack_checksum():
+            raise BitmapFormatError("bitmap index does not match its pack")
+        self.num_objects = len(index)
+        pos = HEADER_SIZE
+        self.type_bitmaps = {}
+        for object_type in TYPE_ORDER:
+            self.type_bitmaps[object_type], _ = ewah.decode(data, pos)
+            pos += ewah.serialized_size(data, pos)
+        self._data = data
+        self._entries = {}  # sha1 -> entry number
+        self._entry_offsets = []  # (xor offset, offset of the EWAH bitmap)
+        for i in range(n_entries):
+            index_pos, xor_offset, _ = struct.unpack_from(ENTRY_HEADER_FORMAT, data, pos)
+            pos += ENTRY_HEADER_SIZE
+            self._entries[index.name(index_pos)] = i
+            self._entry_offsets.append((xor_offset, pos))
+            pos += ewah.serialized_size(data, pos)
+        self._decoded = {}
+        self._pack_order = None
+        self._bit_of = None
+
+    def _build_pack_order(self):
+        # bit positions follow the order of objects in the pack
+        index = self.pack.index
+        order = sorted(range(self.num_objects), key=index.offset)
+        self._pack_order = array.array("L", order)
+        self._bit_of = array.array("L", bytes(self._pack_order.itemsize * len(order)))
+        for bit, index_pos in enumerate(order):
+            self._bit_of[index_pos] = bit
+
+    def position(self, sha1: ObjectId):
+        """bit position of an object, or None if it is not in the pack"""
+        index_pos = self.pack.index.find(sha1)
+        if index_pos is None:
+            return None
+        if self._bit_of is None:
+            self._build_pack_order()
+        return self._bit_of[index_pos]
+
+    def object_at(self, bit: int) -> ObjectId:
+        if self._pack_order is None:
+            self._build_pack_order()
+        return self.pack.index.name(self._pack_order[bit])
+
+    def has_commit_bitmap(self, sha1: ObjectId):
+        return sha1 in self._entries
+
+    def _entry_bitmap(self, i):
+        if i not in self._decoded:
+            xor_offset, offset = self._entry_offsets[i]
+            bits, _ = ewah.decode(self._data, offset)
+            if xor_offset:
+                bits ^= self._entry_bitmap(i - xor_offset)
+            self._decoded[i] = bits
+        return self._decoded[i]
+
+    def commit_bitmap(self, sha1: ObjectId):
+        i = self._entries.get(sha1)
+        if i is None:
+            return None
+        return self._entry_bitmap(i)
+
+    @staticmethod
+    def open(p: pack.Pack):
+        path = p.pack_path.with_suffix(".bitmap")
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        return PackBitmap(p, data)
+
+
+@functools.lru_cache(maxsize=None)
+def get_bitmap():
+    for p in pack.get_packs():
+        bitmap = PackBitmap.open(p)
+        if bitmap is not None:
+            return bitmap
+    return None
+
+
+class ReachableObjects:
+    """objects in the bitmapped pack (as bits) plus objects outside of it"""
+
+    def __init__(self, bitmap: PackBitmap, bits: int, extra: set):
+        self._bitmap = bitmap
+        self.bits = bits
+        self.extra = extra
+
+    def __len__(self):
+        return ewah.popcount(self.bits) + len(self.extra)
+
+    def __iter__(self):
+        for bit in ewah.iter_bits(self.bits):
+            yield self._bitmap.object_at(bit)
+        yield from self.extra
+
+    def count_type(self, object_type):
+        """count objects of a type, not including objects outside of the pack"""
+        return ewah.popcount(self.bits & self._bitmap.type_bitmaps[object_type])
+
+
+def walk_into_bitmap(bitmap, commits, bits):
+    """add objects reachable from commits without their own bitmap"""
+    seen = ewah.BitSet(bitmap.num_objects, bits)
+    extra = set()
+
+    def mark(sha1):
+        """mark an object as reachable, False if it already was"""
+        pos = bitmap.position(sha1)
+        if pos is None:
+            if sha1 in extra:
+                return False
+            extra.add(sha1)
+            return True
+        if pos in seen:
+            return False
+        seen.add(pos)
+        return True
+
+    stack = list(commits)
+    while stack:
+        sha1 = stack.pop()
+        commit_bits = bitmap.commit_bitmap(sha1)
+        if commit_bits is not None:
+            seen = ewah.BitSet(bitmap.num_objects, seen.to_int() | commit_bits)
+            continue
+        if not mark(sha1):
+            continue
+        header = load_commit_header(sha1)
+        trees = [header.tree]
+        while trees:
+            tree = trees.pop()
+            if not mark(tree):
+                continue
+            for entry in load_object(tree):
+                if entry.object_type == "tree":
+                    trees.append(entry.sha1)
+                elif entry.object_type == "blob":
+                    mark(entry.sha1)
+        stack.extend(header.parents)
+    return seen.to_int(), extra
+
+
+def reachable_bits(bitmap, commits):
+    bits = 0
+    to_walk = []
+    for sha1 in commits:
+        commit_bits = bitmap.commit_bitmap(sha1)
+        if commit_bits is None:
+            to_walk.append(sha1)
+        else:
+            bits |= commit_bits
+    if not to_walk:
+        return bits, set()
+    return walk_into_bitmap(bitmap, to_walk, bits)
+
+
+def find_reachable(include, exclude=()):
+    """objects reachable from include but not from exclude, None without bitmaps"""
+    bitmap = get_bitmap()
+    if bitmap is None:
+        return None
+    bits, extra = reachable_bits(bitmap, include)
+    if exclude:
+        exclude_bits, exclude_extra = reachable_bits(bitmap, exclude)
+        bits &= ~exclude_bits
+        extra -= exclude_extra
+    return ReachableObjects(bitmap, bits, extra)
+
+
+# writing
+
+
+def build_commit_bitmaps(selected, bit_of, n_objects):
+    """compute bitmaps for selected commits, given from oldest to newest"""
+    bitmaps = {}
+    for commit in selected:
+        seen = ewah.BitSet(n_objects)
+        stack = [commit]
+        while stack:
+            sha1 = stack.pop()
+            if bit_of[sha1] in seen:
+                continue
+            if sha1 in bitmaps:
+                # an older selected commit already covers this history
+                seen = ewah.BitSet(n_objects, seen.to_int() | bitmaps[sha1])
+                continue
+            seen.add(bit_of[sha1])
+            header = load_commit_header(sha1)
+            trees = [header.tree]
+            while trees:
+                tree = trees.pop()
+                if bit_of[tree] in seen:
+                    continue
+                seen.add(bit_of[tree])
+                for entry in load_object(tree):
+                    if entry.object_type == "tree":
+                        trees.append(entry.sha1)
+                    elif entry.object_type == "blob":
+                        seen.add(bit_of[entry.sha1])
+            stack.extend(header.parents)
+        bitmaps[commit] = seen.to_int()
+    return bitmaps
+
+
+def serialize_bitmap(p: pack.Pack, pack_order, object_types, selected):
+    """pack_order lists object names by pack offset, object_types their types"""
+    n_objects = len(pack_order)
+    bit_of = {sha1: bit for bit, sha1 in enumerate(pack_order)}
+    type_bits = {object_type: ewah.BitSet(n_objects) for object_type in TYPE_ORDER}
+    for bit, object_type in enumerate(object_types):
+        type_bits[object_type].add(bit)
+    commit_bitmaps = build_commit_bitmaps(selected, bit_of, n_objects)
+
+    header = struct.pack(
+        HEADER_FORMAT,
+        SIGNATURE,
+        VERSION,
+        OPT_FULL_DAG,
+        len(commit_bitmaps),
+        p.index.pack_checksum(),
+    )
+    parts = [header]
+    for object_type in TYPE_ORDER:
+        parts.append(ewah.encode(type_bits[object_type].to_int(), n_objects))
+    for sha1 in selected:
+        parts.append(struct.pack(ENTRY_HEADER_FORMAT, p.index.find(sha1), 0, 0))
+        parts.append(ewah.encode(commit_bitmaps[sha1], n_objects))
+    data = b"".join(parts)
+    return data + hashlib.sha1(data).digest()
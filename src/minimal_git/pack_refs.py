@@ -0,0 +1,44 @@
+# pack heads and tags for efficient repository access
+# see Documentation/git-pack-refs.txt in git
+
+import argparse
+
+from . import paths
+from . import refs
+from .util import die_error, get_logger
+
+logger = get_logger(__name__)
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "--all",
+        help="pack all refs, not only tags and refs already packed",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--no-prune",
+        dest="prune",
+        help="keep the loose refs after packing them",
+        action="store_false",
+    )
+
+
+def pack_refs(args):
+    try:
+        paths.find_repository_root()
+        n_packed = refs.pack_refs(all_refs=args.all, prune=args.prune)
+    except (paths.NotGitRepositoryError, refs.RefUpdateError) as e:
+        die_error(f"fatal: {e}")
+    logger.debug(f"packed {n_packed} loose refs")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    pack_refs(args)
+
+
+if __name__ == "__main__":
+    main()
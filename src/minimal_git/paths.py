@@ -1,5 +1,11 @@
+import functools
+import itertools
+import os
 import pathlib
 
+from . import object_store
+from .object_id import ObjectId, hex_length
+
 
 def basename(path: str):
     p = pathlib.Path(path)
@@ -17,7 +23,8 @@ git_root = ".git"
 
 
 def find_repository_root(cur=None):
-    cur = cur or pathlib.Path(".").resolve()
+    if cur is None:
+        return find_repository_root_of_cwd(os.getcwd())
     path = cur / git_root
     if path.is_dir():
         return cur
@@ -28,6 +35,12 @@ def find_repository_root(cur=None):
         return find_repository_root(parent)
 
 
+@functools.lru_cache(maxsize=None)
+def find_repository_root_of_cwd(cwd: str):
+    # object paths are made for every object read, so the search runs once
+    return find_repository_root(pathlib.Path(cwd).resolve())
+
+
 def find_git_root():
     return find_repository_root() / git_root
 
@@ -68,39 +81,67 @@ def extract_sha1(object_path: pathlib.Path):
     path_elements = posix_path.split("/")
     sha1_elements = path_elements[-2:]
     sha1 = "".join(sha1_elements)
-    return sha1
+    return ObjectId.from_hex(sha1)
 
 
-def list_objects():
+def is_loose_object_path(object_path: pathlib.Path):
+    # skip non-object files such as objects/info/commit-graph
+    dir_name = object_path.parent.name
+    return (
+        len(dir_name) == 2
+        and len(object_path.name) == hex_length - 2
+        and all(c in "0123456789abcdef" for c in dir_name + object_path.name)
+    )
+
+
+def list_loose_objects():
     objects_root = find_object_dir()
-    it = pathlib.Path(objects_root).rglob("*")
-    objects = (f for f in it if f.is_file())
+    it = pathlib.Path(objects_root).glob("*/*")
+    objects = (f for f in it if is_loose_object_path(f) and f.is_file())
     sha1_list = list(map(extract_sha1, objects))
     return sha1_list
 
 
-def find_object(sha1_prefix: str):
+def list_objects():
+    return sorted(object_store.get_object_store().iter())
+
+
+def has_object(sha1: ObjectId):
+    return object_store.get_object_store().has(sha1)
+
+
+def find_info_dir():
+    info_dir = pathlib.Path("info")
+    return find_object_dir() / info_dir
+
+
+def find_object(sha1_prefix: str) -> ObjectId:
     minimum_prefix_length = 4
     if len(sha1_prefix) < minimum_prefix_length:
         raise SHA1PrefixTooShortError
-    sha1_list = list_objects()
-    candidates = []
-    for sha1 in sha1_list:
-        if sha1.startswith(sha1_prefix):
-            candidates.append(sha1)
+    sha1_prefix = sha1_prefix.lower()
+    if sha1_prefix.strip("0123456789abcdef"):
+        raise SHA1NotFoundError
+    store = object_store.get_object_store()
+    # full object name needs no scan of the whole object directory
+    if len(sha1_prefix) == hex_length:
+        sha1 = ObjectId.from_hex(sha1_prefix)
+        if store.has(sha1):
+            return sha1
+    candidates = set(itertools.islice(store.resolve_prefix(sha1_prefix), 2))
     if len(candidates) == 0:
         raise SHA1NotFoundError
     if len(candidates) >= 2:
         raise UmbiguousSHA1PrefixError
-    sha1 = candidates[0]
+    sha1 = candidates.pop()
     return sha1
 
 
-def make_object_path(sha1: str, *, make_dirs=False) -> str:
+def make_object_path(sha1: ObjectId, *, make_dirs=False) -> pathlib.Path:
     dir_name_length = 2
-    dir_name = find_object_dir() / pathlib.Path(sha1[:dir_name_length])
+    sha1_hex = sha1.hex()
+    # joined as strings, which is much cheaper than joining pathlib paths
+    dir_name = os.path.join(find_object_dir(), sha1_hex[:dir_name_length])
     if make_dirs:
-        dir_name.mkdir(parents=True, exist_ok=True)
-    file = pathlib.Path(sha1[dir_name_length:])
-    path = dir_name / file
-    return path
+        os.makedirs(dir_name, exist_ok=True)
+    return pathlib.Path(dir_name, sha1_hex[dir_name_length:])
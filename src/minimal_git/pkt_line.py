@@ -0,0 +1,49 @@
+# pkt-line framing of the git transfer protocols
+# see Documentation/gitprotocol-common.txt in git
+#
+# each packet is its length (including the 4 length bytes) in 4 hex digits
+# followed by the payload; "0000" is the flush packet ending a section
+
+FLUSH_PKT = b"0000"
+MAX_PKT_PAYLOAD = 65516
+
+
+class ProtocolError(BaseException):
+    pass
+
+
+def pkt_line(payload: bytes) -> bytes:
+    if len(payload) > MAX_PKT_PAYLOAD:
+        raise ProtocolError("packet too long")
+    return b"%04x" % (len(payload) + 4) + payload
+
+
+class PktLineReader:
+    def __init__(self, f):
+        self._f = f
+
+    def _read_exactly(self, n):
+        data = self._f.read(n)
+        if len(data) != n:
+            raise ProtocolError("the remote end hung up unexpectedly")
+        return data
+
+    def read(self):
+        """the payload of the next packet, or None for a flush packet"""
+        length = self._read_exactly(4)
+        try:
+            size = int(length, 16)
+        except ValueError:
+            raise ProtocolError(f"bad packet length {length!r}")
+        if size == 0:
+            return None
+        if size < 4:
+            raise ProtocolError(f"bad packet length {length!r}")
+        return self._read_exactly(size - 4)
+
+    def read_line(self):
+        """the payload of the next packet without its newline, None for flush"""
+        payload = self.read()
+        if payload is not None and payload.endswith(b"\n"):
+            payload = payload[:-1]
+        return payload
@@ -2,7 +2,9 @@ import argparse
 
 from .util import die_error
 from .git_objects import load_object
+from .lockfile import LockError
 from .staging import Index
+from .sparse_checkout import get_cone, sparse_index_enabled
 
 
 def setup_parser(parser):
@@ -13,8 +15,12 @@ def read_tree(args):
     tree = load_object(args.tree)
     if tree.type_id != "tree":
         die_error(f"error: {args.tree} is not a tree object")
-    index = Index.from_tree(tree)
-    index.write()
+    # directories outside a sparse-checkout cone are not even read
+    index = Index.from_tree(tree, cone=get_cone(), sparse=sparse_index_enabled())
+    try:
+        index.write()
+    except LockError as e:
+        die_error(f"fatal: {e}")
 
 
 def main():
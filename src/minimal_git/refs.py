@@ -0,0 +1,627 @@
+# references: loose refs stored as files under .git/refs and the sorted
+# .git/packed-refs file holding many refs in one place
+# see refs/files-backend.c and refs/packed-backend.c in git
+#
+# a loose ref takes precedence over a packed one of the same name; updates
+# go to loose refs under lock files, and pack-refs moves them into
+# packed-refs so that a repository with very many refs stays cheap to read
+
+import functools
+import heapq
+import mmap
+import os
+import re
+
+from . import paths
+from .config import get_config
+from .lockfile import LockError, LockFile
+from .object_id import ObjectId, hex_length, null_oid
+
+PACKED_REFS_HEADER = b"# pack-refs with: sorted \n"
+SYMREF_PREFIX = "ref: "
+MAX_SYMREF_DEPTH = 5
+
+# what git check-ref-format rejects: a component starting with "." or ending
+# in ".lock", an empty component, "..", "@{", a trailing "." or "/", and
+# control characters, spaces and any of ~^:?*[\
+INVALID_REF_NAME = re.compile(
+    r"(?:^|/)\.|\.lock(?:/|$)|//|/$|\.\.|@\{|\.$|[\x00-\x20\x7f~^:?*[\\]"
+)
+
+# where rev-parse looks for a short name, in order
+REV_PARSE_RULES = [
+    "{}",
+    "refs/{}",
+    "refs/tags/{}",
+    "refs/heads/{}",
+    "refs/remotes/{}",
+    "refs/remotes/{}/HEAD",
+]
+
+
+# what resolve_revision raises for a name that does not name an object
+NAME_ERRORS = (
+    paths.SHA1NotFoundError,
+    paths.SHA1PrefixTooShortError,
+    paths.UmbiguousSHA1PrefixError,
+)
+
+
+class InvalidRefNameError(BaseException):
+    pass
+
+
+class RefUpdateError(BaseException):
+    pass
+
+
+def check_ref_name(name: str):
+    if name == "HEAD":
+        return
+    if not name.startswith("refs/") or INVALID_REF_NAME.search(name):
+        raise InvalidRefNameError(f"invalid ref name: {name}")
+
+
+def find_ref_path(name: str, git_dir=None):
+    check_ref_name(name)
+    return os.path.join(git_dir or find_git_dir(), name)
+
+
+def find_git_dir():
+    # joined as strings, which is much cheaper than joining pathlib paths
+    return os.path.join(paths.find_repository_root(), paths.git_root)
+
+
+def find_packed_refs_file(git_dir=None):
+    return os.path.join(git_dir or find_git_dir(), "packed-refs")
+
+
+# packed refs
+
+
+class PackedRefs:
+    """the packed-refs file, mmapped and searched by bisection
+
+    each record is "<sha1> <name>\\n", possibly followed by a "^<sha1>\\n"
+    line with the object an annotated tag peels to; records are sorted by
+    name, so a lookup reads a few lines and not the whole file
+    """
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                data = b""
+            else:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        start = 0
+        traits = []
+        if data[:1] == b"#":
+            start = data.find(b"\n") + 1
+            traits = data[:start].split()
+        self._data = data
+        self._start = start
+        self._header = data[:start]
+        if b"sorted" not in traits:
+            # an old file, whose order git does not rely on either
+            records = []
+            while start < len(data):
+                end = self._next_record(start)
+                records.append(data[start:end].rstrip(b"\n") + b"\n")
+                start = end
+            records.sort(key=lambda r: r[hex_length + 1 : r.find(b"\n")])
+            self._data = b"".join(records)
+            self._start = 0
+            self._header = PACKED_REFS_HEADER
+
+    def _name_at(self, pos):
+        end = self._data.find(b"\n", pos)
+        return self._data[pos + hex_length + 1 : end if end >= 0 else len(self._data)]
+
+    def _next_record(self, pos):
+        data = self._data
+        end = data.find(b"\n", pos) + 1 or len(data)
+        while data[end : end + 1] == b"^":
+            end = data.find(b"\n", end) + 1 or len(data)
+        return end
+
+    def _record_start(self, pos, lo):
+        """start of the record containing pos, which is not before lo"""
+        data = self._data
+        start = max(data.rfind(b"\n", lo, pos) + 1, lo)
+        if data[start : start + 1] == b"^":  # a peeled line belongs to the record
+            start = max(data.rfind(b"\n", lo, start - 1) + 1, lo)
+        return start
+
+    def _lower_bound(self, key: bytes):
+        """position of the first record whose name is not less than key"""
+        lo, hi = self._start, len(self._data)
+        while lo < hi:
+            pos = self._record_start((lo + hi) // 2, lo)
+            if self._name_at(pos) < key:
+                lo = self._next_record(pos)
+            else:
+                hi = pos
+        return lo
+
+    def get(self, name: str):
+        key = name.encode()
+        pos = self._lower_bound(key)
+        if pos < len(self._data) and self._name_at(pos) == key:
+            return ObjectId.from_hex(self._data[pos : pos + hex_length].decode())
+        return None
+
+    def iter_refs(self, prefix=""):
+        """yield (name, sha1) of the refs starting with prefix, sorted by name"""
+        key = prefix.encode()
+        data = self._data
+        pos = self._lower_bound(key)
+        while pos < len(data):
+            name = self._name_at(pos)
+            if not name.startswith(key):
+                break
+            sha1 = ObjectId.from_hex(data[pos : pos + hex_length].decode())
+            yield name.decode(), sha1
+            pos = self._next_record(pos)
+
+    def without(self, names):
+        """content of the file with the records of names left out
+
+        the other records are copied as they are, peeled lines included
+        """
+        spans = []
+        for name in sorted(names):
+            key = name.encode()
+            pos = self._lower_bound(key)
+            if pos < len(self._data) and self._name_at(pos) == key:
+                spans.append((pos, self._next_record(pos)))
+        parts = [self._header or PACKED_REFS_HEADER]
+        last = self._start
+        for start, end in spans:
+            parts.append(self._data[last:start])
+            last = end
+        parts.append(self._data[last:])
+        return b"".join(parts)
+
+
+@functools.lru_cache(maxsize=1)
+def _load_packed_refs(path, mtime_ns, size, ino):
+    return PackedRefs(path)
+
+
+def get_packed_refs(git_dir=None):
+    """the current packed refs, or None if there is no packed-refs file
+
+    the mapping is kept while the file is unchanged, like git's stat_validity
+    """
+    path = find_packed_refs_file(git_dir)
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return _load_packed_refs(path, st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def serialize_packed_refs(refs):
+    """content of a packed-refs file with refs, (name, sha1) sorted by name"""
+    lines = [b"%s %s\n" % (sha1.hex().encode(), name.encode()) for name, sha1 in refs]
+    return PACKED_REFS_HEADER + b"".join(lines)
+
+
+# loose refs
+
+
+def read_loose_ref(name: str, git_dir=None):
+    """content of the loose ref file, or None if there is none"""
+    try:
+        with open(find_ref_path(name, git_dir)) as f:
+            return f.read().strip()
+    except (FileNotFoundError, NotADirectoryError, IsADirectoryError):
+        return None
+
+
+def iter_loose_ref_names(prefix: str):
+    """yield the names of the loose refs starting with prefix, unsorted"""
+    git_dir = find_git_dir()
+    top = prefix[: prefix.rfind("/") + 1] if "/" in prefix else ""
+    stack = [top.rstrip("/") or "refs"]
+    while stack:
+        directory = stack.pop()
+        try:
+            it = os.scandir(os.path.join(git_dir, directory))
+        except (FileNotFoundError, NotADirectoryError):
+            continue
+        with it:
+            for entry in it:
+                name = f"{directory}/{entry.name}"
+                if entry.is_dir(follow_symlinks=False):
+                    if name.startswith(prefix) or prefix.startswith(name + "/"):
+                        stack.append(name)
+                elif name.startswith(prefix) and not name.endswith(".lock"):
+                    yield name
+
+
+def iter_loose_refs(prefix: str):
+    for name in sorted(iter_loose_ref_names(prefix)):
+        sha1 = read_ref(name)
+        if sha1 is not None:
+            yield name, sha1
+
+
+# reading refs
+
+
+def resolve_symbolic_ref(name: str):
+    """the ref a chain of symbolic refs starting at name ends at"""
+    for _ in range(MAX_SYMREF_DEPTH):
+        value = read_loose_ref(name)
+        if value is None or not value.startswith(SYMREF_PREFIX):
+            return name
+        name = value[len(SYMREF_PREFIX) :]
+    raise RefUpdateError(f"symbolic ref loop at {name}")
+
+
+def read_ref(name: str, git_dir=None):
+    """object a ref points to, or None if there is no such ref
+
+    symbolic refs such as HEAD are followed to the ref they point to; git_dir
+    defaults to that of the current repository
+    """
+    for _ in range(MAX_SYMREF_DEPTH):
+        value = read_loose_ref(name, git_dir)
+        if value is None:
+            packed_refs = get_packed_refs(git_dir)
+            return packed_refs.get(name) if packed_refs is not None else None
+        if not value.startswith(SYMREF_PREFIX):
+            return ObjectId.from_hex(value)
+        name = value[len(SYMREF_PREFIX) :]
+    return None
+
+
+def list_refs(prefix="refs/"):
+    """yield (name, sha1) of the refs starting with prefix, sorted by name
+
+    loose and packed refs are merged, a loose ref hiding the packed one
+    """
+    packed_refs = get_packed_refs()
+    packed = packed_refs.iter_refs(prefix) if packed_refs is not None else ()
+    # on equal names, the loose ref (source 0) comes first
+    merged = heapq.merge(
+        ((name, 0, sha1) for name, sha1 in iter_loose_refs(prefix)),
+        ((name, 1, sha1) for name, sha1 in packed),
+        key=lambda ref: ref[:2],
+    )
+    last = None
+    for name, _, sha1 in merged:
+        if name != last:
+            yield name, sha1
+        last = name
+
+
+def iter_reflog_objects():
+    """yield the objects recorded in the reflogs git keeps under .git/logs
+
+    min-git writes no reflogs itself, but repositories made by git have
+    them, and what they name is still in use
+    """
+    logs_dir = os.path.join(find_git_dir(), "logs")
+    for dir_path, _, file_names in os.walk(logs_dir):
+        for file_name in file_names:
+            try:
+                with open(os.path.join(dir_path, file_name), "rb") as f:
+                    lines = f.read().splitlines()
+            except OSError:
+                continue
+            for line in lines:
+                # "<old> <new> <committer> <time> <zone>\t<message>"
+                for value in line.split(b" ", 2)[:2]:
+                    try:
+                        sha1 = ObjectId.from_hex(value.decode())
+                    except ValueError:
+                        continue
+                    if sha1 != null_oid:
+                        yield sha1
+
+
+def read_symbolic_ref(name="HEAD"):
+    """ref a symbolic ref such as HEAD points to, or None if it is detached"""
+    try:
+        with open(paths.find_git_root() / name) as f:
+            value = f.read().strip()
+    except FileNotFoundError:
+        return None
+    if not value.startswith(SYMREF_PREFIX):
+        return None
+    return value[len(SYMREF_PREFIX) :]
+
+
+def dwim_ref(name: str):
+    """full name of the ref a short name like "main" stands for, or None"""
+    for rule in REV_PARSE_RULES:
+        full_name = rule.format(name)
+        try:
+            check_ref_name(full_name)
+        except InvalidRefNameError:
+            continue
+        if read_ref(full_name) is not None:
+            return full_name
+    return None
+
+
+# asked first for abbreviated object names; the command line installs the
+# daemon's lookup, which this module cannot import
+_object_name_lookup = None
+
+
+def set_object_name_lookup(lookup):
+    """have resolve_revision try lookup(prefix) on abbreviated object names
+
+    lookup returns None if it cannot tell, else it answers or raises like
+    paths.find_object; None removes it
+    """
+    global _object_name_lookup
+    _object_name_lookup = lookup
+
+
+def resolve_revision(name: str) -> ObjectId:
+    """object named by a ref, a short ref name or a (prefix of an) object name"""
+    if len(name) == hex_length:
+        try:
+            return ObjectId.from_hex(name)
+        except ValueError:
+            pass
+    full_name = dwim_ref(name)
+    if full_name is not None:
+        return read_ref(full_name)
+    if _object_name_lookup is not None:
+        sha1 = _object_name_lookup(name)
+        if sha1 is not None:
+            return sha1
+    return paths.find_object(name)
+
+
+# updating refs
+
+
+def get_ref_settings():
+    """(loose ref lock timeout, packed-refs lock timeout, fsync) like git
+
+    the timeouts are in ms; git only fsyncs refs when core.fsync asks for it
+    """
+    loose = int(get_config("core", "filesreflocktimeout") or 100)
+    packed = int(get_config("core", "packedrefstimeout") or 1000)
+    components = (get_config("core", "fsync") or "").replace(" ", "").split(",")
+    fsync = any(c in ("reference", "committed", "all") for c in components)
+    return loose, packed, fsync
+
+
+def find_name_conflict(name: str, updates, free_prefixes=None):
+    """a ref which prevents name from being created, such as refs/a for refs/a/b
+
+    free_prefixes collects the names known not to be refs, so that refs
+    created together in one directory look at its ancestors only once
+    """
+    if free_prefixes is None:
+        free_prefixes = set()
+    packed_refs = get_packed_refs()
+    parts = name.split("/")
+    for i in range(2, len(parts)):
+        prefix = "/".join(parts[:i])
+        if prefix in free_prefixes:
+            continue
+        if read_ref(prefix) is not None and updates.get(prefix, (None,))[0] != null_oid:
+            return prefix
+        free_prefixes.add(prefix)
+    if packed_refs is not None:
+        for other, _ in packed_refs.iter_refs(name + "/"):
+            if updates.get(other, (None,))[0] != null_oid:
+                return other
+    for other in iter_loose_ref_names(name + "/"):
+        if updates.get(other, (None,))[0] != null_oid:
+            return other
+    return None
+
+
+def remove_empty_parents(names):
+    """remove the directories of deleted loose refs which became empty"""
+    git_dir = find_git_dir()
+    directories = set()
+    for name in names:
+        parts = name.split("/")[:-1]
+        # like git, refs/heads and the like are kept
+        while len(parts) > 2:
+            directories.add("/".join(parts))
+            parts.pop()
+    # the deepest first, so that a parent is empty when its turn comes
+    for directory in sorted(directories, key=lambda d: d.count("/"), reverse=True):
+        try:
+            os.rmdir(os.path.join(git_dir, directory))
+        except OSError:
+            pass
+
+
+class RefTransaction:
+    """updates of several refs, applied all together or not at all
+
+    every ref to change is locked and checked against its expected old
+    value before any of them changes; deleted refs are also removed from
+    packed-refs, under its own lock
+    """
+
+    def __init__(self):
+        self._updates = {}
+        self._free_prefixes = set()
+
+    def update(self, name: str, new: ObjectId, old=None):
+        """set name to new (null_oid to delete it)
+
+        old is the value the ref must have: None skips the check and
+        null_oid requires that the ref does not exist yet
+        """
+        check_ref_name(name)
+        if name in self._updates:
+            raise RefUpdateError(f"multiple updates for ref '{name}' not allowed")
+        self._updates[name] = (new, old)
+
+    def delete(self, name: str, old=None):
+        self.update(name, null_oid, old)
+
+    def verify(self, name: str, old: ObjectId):
+        self.update(name, None, old)
+
+    def _check(self, name, new, old):
+        current = read_ref(name)
+        if old is not None and old != null_oid and current is None:
+            raise RefUpdateError(
+                f"cannot lock ref '{name}': unable to resolve reference '{name}'"
+            )
+        if old == null_oid and current is not None:
+            raise RefUpdateError(f"cannot lock ref '{name}': reference already exists")
+        if old is not None and old != null_oid and current != old:
+            raise RefUpdateError(
+                f"cannot lock ref '{name}': is at {current} but expected {old}"
+            )
+        if new is not None and new != null_oid and current is None:
+            conflict = find_name_conflict(name, self._updates, self._free_prefixes)
+            if conflict is not None:
+                raise RefUpdateError(
+                    f"cannot lock ref '{name}': "
+                    f"'{conflict}' exists; cannot create '{name}'"
+                )
+
+    def _lock(self, name, timeout_ms, fsync):
+        path = find_ref_path(name)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            return LockFile(path, timeout_ms, fsync=fsync)
+        except LockError as e:
+            raise RefUpdateError(f"cannot lock ref '{name}': {e}")
+        except (FileExistsError, NotADirectoryError):
+            # a file where a directory of the ref should be
+            conflict = find_name_conflict(name, {})
+            raise RefUpdateError(
+                f"cannot lock ref '{name}': "
+                f"'{conflict}' exists; cannot create '{name}'"
+            )
+
+    def commit(self):
+        loose_timeout, packed_timeout, fsync = get_ref_settings()
+        locks = {}
+        packed_lock = None
+        try:
+            # in sorted order, so that transactions do not deadlock
+            for name in sorted(self._updates):
+                new, old = self._updates[name]
+                locks[name] = lock = self._lock(name, loose_timeout, fsync)
+                self._check(name, new, old)
+                if new is not None and new != null_oid:
+                    lock.write(f"{new}\n".encode())
+                lock.close()
+            deleted = {n for n, (new, _) in self._updates.items() if new == null_oid}
+            packed_refs = get_packed_refs()
+            if packed_refs is not None and any(
+                packed_refs.get(name) is not None for name in deleted
+            ):
+                try:
+                    packed_lock = LockFile(
+                        find_packed_refs_file(), packed_timeout, fsync=fsync
+                    )
+                except LockError as e:
+                    raise RefUpdateError(f"cannot lock packed-refs: {e}")
+                # reread, as it may have changed before we got the lock
+                packed_refs = get_packed_refs()
+                if packed_refs is not None:
+                    packed_lock.write(packed_refs.without(deleted))
+                    packed_lock.commit()
+            for name, lock in locks.items():
+                new, _ = self._updates[name]
+                if new is None:
+                    lock.rollback()
+                elif new == null_oid:
+                    try:
+                        os.unlink(lock.path)
+                    except FileNotFoundError:
+                        pass
+                    lock.rollback()
+                else:
+                    lock.commit()
+            remove_empty_parents(deleted)
+        finally:
+            for lock in locks.values():
+                lock.rollback()
+            if packed_lock is not None:
+                packed_lock.rollback()
+
+
+def update_ref(name: str, new: ObjectId, old=None):
+    transaction = RefTransaction()
+    transaction.update(name, new, old)
+    transaction.commit()
+
+
+def write_ref(name: str, sha1: ObjectId):
+    update_ref(name, sha1)
+
+
+def write_symbolic_ref(name: str, target: str):
+    check_ref_name(target)
+    path = paths.find_git_root() / name
+    loose_timeout, _, fsync = get_ref_settings()
+    try:
+        with LockFile(path, loose_timeout, fsync=fsync) as lock:
+            lock.write(f"{SYMREF_PREFIX}{target}\n".encode())
+            lock.commit()
+    except LockError as e:
+        raise RefUpdateError(f"cannot lock ref '{name}': {e}")
+
+
+def pack_refs(*, all_refs=False, prune=True):
+    """move loose refs into packed-refs
+
+    like git, only tags and refs which are already packed are moved unless
+    all_refs is set; symbolic refs stay loose
+    """
+    loose_timeout, packed_timeout, fsync = get_ref_settings()
+    try:
+        packed_lock = LockFile(find_packed_refs_file(), packed_timeout, fsync=fsync)
+    except LockError as e:
+        raise RefUpdateError(f"cannot lock packed-refs: {e}")
+    with packed_lock:
+        packed_refs = get_packed_refs()
+        to_pack = []
+        for name in sorted(iter_loose_ref_names("refs/")):
+            value = read_loose_ref(name)
+            if value is None or value.startswith(SYMREF_PREFIX):
+                continue
+            is_packed = packed_refs is not None and packed_refs.get(name) is not None
+            if all_refs or name.startswith("refs/tags/") or is_packed:
+                to_pack.append((name, ObjectId.from_hex(value)))
+        packed = packed_refs.iter_refs() if packed_refs is not None else ()
+        merged = heapq.merge(
+            ((name, 0, sha1) for name, sha1 in to_pack),
+            ((name, 1, sha1) for name, sha1 in packed),
+            key=lambda ref: ref[:2],
+        )
+        refs = []
+        for name, _, sha1 in merged:
+            if not refs or refs[-1][0] != name:
+                refs.append((name, sha1))
+        packed_lock.write(serialize_packed_refs(refs))
+        packed_lock.commit()
+    if prune:
+        prune_loose_refs(to_pack, loose_timeout)
+    return len(to_pack)
+
+
+def prune_loose_refs(packed, timeout_ms):
+    """delete the loose refs just packed, unless they changed meanwhile"""
+    pruned = []
+    for name, sha1 in packed:
+        try:
+            lock = LockFile(find_ref_path(name), timeout_ms)
+        except LockError:
+            continue  # being updated, so the loose ref is still needed
+        with lock:
+            if read_loose_ref(name) == sha1.hex():
+                os.unlink(lock.path)
+                pruned.append(name)
+    remove_empty_parents(pruned)
@@ -0,0 +1,209 @@
+import argparse
+import os
+import sys
+
+from . import multi_pack_index
+from . import object_store
+from . import pack
+from . import pack_bitmap
+from . import paths
+from . import refs
+from .util import get_logger, load_raw_content
+from .commit_graph import compute_generations, load_commit_header
+from .git_objects import peel_object
+from .rev_list import iter_tree_objects, walk_objects
+from .staging import parse_index
+
+logger = get_logger(__name__)
+
+# every n-th commit (newest first) gets a bitmap besides the tips
+bitmap_commit_interval = 100
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "-d",
+        help="remove redundant packs and loose objects after packing",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-b",
+        "--write-bitmap-index",
+        help="write a reachability bitmap index for the new pack",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-l",
+        "--local",
+        help="leave out objects borrowed from an alternate object store",
+        action="store_true",
+    )
+
+
+def list_root_objects():
+    """(tags, commits, other objects) named by the refs, HEAD and reflogs
+
+    annotated tags are peeled: the tags themselves are kept and what they
+    point to is sorted into commits to walk from and trees or blobs
+    """
+    names = [sha1 for _, sha1 in refs.list_refs()]
+    head = refs.read_ref("HEAD")
+    if head is not None:
+        names.append(head)
+    # reflog entries whose objects are gone already are no roots
+    names += [sha1 for sha1 in refs.iter_reflog_objects() if paths.has_object(sha1)]
+    tags = []
+    commits = []
+    others = []
+    seen = set()
+    for sha1 in names:
+        if sha1 in seen:
+            continue
+        passed, target, target_type = peel_object(sha1)
+        tags += [tag for tag in passed if tag not in seen]
+        seen.update(passed)
+        if target in seen:
+            continue
+        seen.add(target)
+        if target_type == "commit":
+            commits.append(target)
+        else:
+            others.append((target, target_type))
+    return tags, sorted(commits), others
+
+
+def list_reachable_objects(tips):
+    # an existing bitmap saves walking every tree again
+    reachable = pack_bitmap.find_reachable(tips)
+    if reachable is not None:
+        logger.debug("enumerating objects with the bitmap index")
+        return list(reachable)
+    return [sha1 for sha1, _, _ in walk_objects(tips)]
+
+
+def list_index_objects():
+    return [e.sha1 for e in parse_index() if paths.has_object(e.sha1)]
+
+
+def select_bitmap_commits(headers, tips):
+    newest_first = sorted(headers, key=lambda c: headers[c].commit_time, reverse=True)
+    selected = set(tips)
+    selected.update(newest_first[::bitmap_commit_interval])
+    # parents have to be built before their descendants to be reused
+    generations = compute_generations(headers)
+    return sorted(selected, key=lambda c: generations[c])
+
+
+def write_pack(object_ids):
+    """write objects into a new pack, returning it with the object types"""
+    pack_dir = pack.find_pack_dir()
+    pack_dir.mkdir(parents=True, exist_ok=True)
+    tmp_pack_path = pack_dir / f"tmp_pack_{os.getpid()}"
+    object_types = []
+    with open(tmp_pack_path, "wb") as f:
+        writer = pack.PackWriter(f, len(object_ids))
+        for sha1 in object_ids:
+            raw = load_raw_content(sha1)
+            header, _, content = raw.partition(b"\x00")
+            object_type = header.split(b" ")[0].decode()
+            writer.add_object(sha1, object_type, content)
+            object_types.append(object_type)
+        checksum = writer.finish()
+    return pack.install_pack(tmp_pack_path, writer.entries, checksum), object_types
+
+
+def remove_file(path):
+    try:
+        path.unlink()
+    except FileNotFoundError:
+        pass
+
+
+def remove_loose_object(sha1):
+    path = paths.make_object_path(sha1)
+    remove_file(path)
+    try:
+        path.parent.rmdir()
+    except OSError:  # other objects are left in the directory
+        pass
+
+
+def remove_redundant(new_pack, borrowed=frozenset()):
+    for p in pack.get_packs():
+        if p.pack_path == new_pack.pack_path:
+            continue
+        for suffix in (".bitmap", ".idx", ".pack"):
+            remove_file(p.pack_path.with_suffix(suffix))
+    # the multi-pack-index would name the packs just removed
+    remove_file(multi_pack_index.find_multi_pack_index_file())
+    for sha1 in paths.list_loose_objects():
+        if new_pack.contains(sha1) or sha1 in borrowed:
+            remove_loose_object(sha1)
+
+
+def repack_objects(*, remove=False, write_bitmap=False, local=False):
+    tags, tips, others = list_root_objects()
+    object_ids = list_reachable_objects(tips)
+    known = set(object_ids)
+    object_ids += [sha1 for sha1 in tags if sha1 not in known]
+    known.update(tags)
+    # trees and blobs refs or tags point to directly
+    for sha1, object_type in others:
+        if object_type == "tree":
+            object_ids += [oid for oid, _, _ in iter_tree_objects(sha1, known)]
+        elif sha1 not in known:
+            known.add(sha1)
+            object_ids.append(sha1)
+    # staged blobs are kept as well
+    for sha1 in list_index_objects():
+        if sha1 not in known:
+            known.add(sha1)
+            object_ids.append(sha1)
+    borrowed = set()
+    if local:
+        # with -d this drops the local copies of objects an alternate has
+        store = object_store.get_object_store()
+        borrowed = {sha1 for sha1 in object_ids if store.in_alternate(sha1)}
+        object_ids = [sha1 for sha1 in object_ids if sha1 not in borrowed]
+        logger.debug(f"{len(borrowed)} objects are borrowed from alternates")
+    new_pack, object_types = write_pack(object_ids)
+    logger.debug(f"wrote {len(object_ids)} objects to {new_pack.pack_path}")
+    if write_bitmap and borrowed:
+        # a bitmap has to cover every object reachable from its commits
+        sys.stderr.write("warning: no bitmap without the borrowed objects\n")
+    elif write_bitmap:
+        headers = {
+            sha1: load_commit_header(sha1)
+            for sha1, object_type in zip(object_ids, object_types)
+            if object_type == "commit"
+        }
+        selected = select_bitmap_commits(headers, tips)
+        data = pack_bitmap.serialize_bitmap(new_pack, object_ids, object_types, selected)
+        bitmap_path = new_pack.pack_path.with_suffix(".bitmap")
+        tmp_bitmap_path = bitmap_path.with_name(f"tmp_bitmap_{os.getpid()}")
+        with open(tmp_bitmap_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_bitmap_path, bitmap_path)
+        logger.debug(f"wrote bitmaps for {len(selected)} commits")
+    if remove:
+        remove_redundant(new_pack, borrowed)
+    pack.reload_packs()
+    pack_bitmap.get_bitmap.cache_clear()
+    return new_pack
+
+
+def repack(args):
+    repack_objects(
+        remove=args.d, write_bitmap=args.write_bitmap_index, local=args.local
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    repack(args)
+
+
+if __name__ == "__main__":
+    main()
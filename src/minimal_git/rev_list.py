@@ -0,0 +1,314 @@
+import argparse
+import heapq
+import itertools
+import sys
+
+from .util import die_error, load_raw_content
+from .refs import resolve_revision
+from .git_objects import parse_object, load_object
+from .commit_graph import load_commit_header, load_bloom_filter
+from .diff_tree import path_changed
+from .bloom import make_path_keys
+from .pack_bitmap import find_reachable
+
+
+# commit walk flags
+UNINTERESTING = 1 << 0
+POPPED = 1 << 1
+# commits walked on after only excluded ones are queued, as git's SLOP
+SLOP = 5
+
+
+def add_revision_arguments(parser):
+    parser.add_argument(
+        "-n",
+        "--max-count",
+        dest="max_count",
+        metavar="<number>",
+        type=int,
+        help="limit the number of commits to output",
+    )
+    parser.add_argument(
+        "revisions",
+        nargs=argparse.REMAINDER,
+        metavar="<commit>... [-- <path>...]",
+        help="commits to start from (^<commit> or <commit>..<commit> to exclude)"
+        " and paths to limit the history to",
+    )
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "--objects",
+        help="also list trees and blobs reachable from the listed commits",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--count", help="print only the number of listed items", action="store_true"
+    )
+    parser.add_argument(
+        "--use-bitmap-index",
+        help="use the reachability bitmap index for --objects",
+        action="store_true",
+    )
+    add_revision_arguments(parser)
+
+
+def resolve_commit(name):
+    sha1 = resolve_revision(name)
+    metadata = parse_object(load_raw_content(sha1), metadata_only=True)
+    if metadata.type != "commit":
+        die_error(f"error: {name} is not a commit object")
+    return sha1
+
+
+def split_pathspec(args):
+    if "--" not in args:
+        return args, []
+    pos = args.index("--")
+    return args[:pos], args[pos + 1 :]
+
+
+def parse_revisions(revisions):
+    include = []
+    exclude = []
+    for rev in revisions:
+        if ".." in rev:
+            a, b = rev.split("..", 1)
+            exclude.append(resolve_commit(a))
+            include.append(resolve_commit(b))
+        elif rev.startswith("^"):
+            exclude.append(resolve_commit(rev[1:]))
+        else:
+            include.append(resolve_commit(rev))
+    return include, exclude
+
+
+class CommitWalker:
+    """walk commits newest first, skipping those reachable from excluded ones"""
+
+    def __init__(self, include, exclude=(), paths=None):
+        self._paths = paths
+        if paths:
+            self._path_keys = [make_path_keys(p) for p in paths]
+        self._flags = {}
+        self._queue = []
+        self._counter = itertools.count()  # tie breaker for equal dates
+        self._n_interesting = 0  # interesting commits waiting in the queue
+        self._limited = bool(exclude)
+        for sha1 in exclude:
+            self._push(sha1, UNINTERESTING)
+        for sha1 in include:
+            self._push(sha1, 0)
+
+    def _push(self, sha1, flags):
+        old_flags = self._flags.get(sha1)
+        if old_flags is None:
+            header = load_commit_header(sha1)
+            self._flags[sha1] = flags
+            entry = (-header.commit_time, next(self._counter), sha1, header)
+            heapq.heappush(self._queue, entry)
+            if not flags & UNINTERESTING:
+                self._n_interesting += 1
+        elif flags & UNINTERESTING and not old_flags & UNINTERESTING:
+            self._mark_uninteresting(sha1)
+
+    def _mark_uninteresting(self, sha1):
+        # a commit we have already seen turned out to be excluded
+        stack = [sha1]
+        while stack:
+            sha1 = stack.pop()
+            flags = self._flags[sha1]
+            if flags & UNINTERESTING:
+                continue
+            self._flags[sha1] = flags | UNINTERESTING
+            if not flags & POPPED:
+                self._n_interesting -= 1
+                continue
+            # parents of a popped commit are already queued or popped
+            stack.extend(load_commit_header(sha1).parents)
+
+    def _pop(self):
+        """take the newest commit from the queue and queue its parents
+
+        returns (sha1, header, whether to show it), or None for an excluded one
+        """
+        _, _, sha1, header = heapq.heappop(self._queue)
+        flags = self._flags[sha1] | POPPED
+        self._flags[sha1] = flags
+        if flags & UNINTERESTING:
+            for parent in header.parents:
+                self._push(parent, UNINTERESTING)
+            return None
+        self._n_interesting -= 1
+        parents, show = header.parents, True
+        if self._paths:
+            parents, show = self._simplify(sha1, header)
+        for parent in parents:
+            self._push(parent, 0)
+        return sha1, header, show
+
+    def __iter__(self):
+        if not self._limited:
+            # nothing is excluded: commits are shown as they are popped
+            while self._n_interesting > 0:
+                popped = self._pop()
+                if popped is not None and popped[2]:
+                    yield popped[:2]
+            return
+        popped = self._limit()
+        for sha1, header, show in popped:
+            if show and not self._flags[sha1] & UNINTERESTING:
+                yield sha1, header
+
+    def _limit(self):
+        """walk until the excluded commits can not reach the included ones
+
+        like git's limit_list, a popped commit may still turn out to be
+        excluded, for instance when it has the same date as an excluded
+        commit reaching it: the walk goes on while excluded commits as new
+        as the oldest included one are queued, and a few commits more
+        against clock skew; returns what was popped of the included side
+        """
+        popped = []
+        oldest = None  # date of the oldest included commit popped
+        slop = SLOP
+        while self._queue:
+            if self._n_interesting == 0:
+                if oldest is None:
+                    break
+                if -self._queue[0][0] < oldest:
+                    slop -= 1
+                    if slop == 0:
+                        break
+                else:
+                    slop = SLOP
+            result = self._pop()
+            if result is not None:
+                popped.append(result)
+                commit_time = result[1].commit_time
+                if oldest is None or commit_time < oldest:
+                    oldest = commit_time
+        return popped
+
+    def _simplify(self, sha1, header):
+        """return the parents to follow and whether to show the commit"""
+        if not header.parents:
+            return [], self._changes_paths(None, header.tree)
+        for i, parent in enumerate(header.parents):
+            # the Bloom filter only covers changes from the first parent
+            if i == 0 and self._ruled_out_by_bloom_filter(sha1):
+                treesame = True
+            else:
+                parent_tree = load_commit_header(parent).tree
+                treesame = not self._changes_paths(parent_tree, header.tree)
+            if treesame:
+                # follow only the parent the commit's paths came from
+                return [parent], False
+        return header.parents, True
+
+    def _ruled_out_by_bloom_filter(self, sha1):
+        bloom_filter = load_bloom_filter(sha1)
+        if bloom_filter is None:
+            return False
+        return not any(bloom_filter.may_contain_path(k) for k in self._path_keys)
+
+    def _changes_paths(self, parent_tree, tree):
+        return any(path_changed(parent_tree, tree, p) for p in self._paths)
+
+
+def iter_tree_objects(tree_sha1, seen, path=""):
+    """yield (sha1, type, path) of a tree and all objects below it not in seen"""
+    if tree_sha1 in seen:
+        return
+    seen.add(tree_sha1)
+    stack = [(tree_sha1, path)]
+    while stack:
+        sha1, path = stack.pop()
+        yield sha1, "tree", path
+        for entry in load_object(sha1):
+            # submodule commits are not part of this repository
+            if entry.object_type == "commit" or entry.sha1 in seen:
+                continue
+            seen.add(entry.sha1)
+            entry_path = f"{path}/{entry.name}" if path else entry.name
+            if entry.object_type == "tree":
+                stack.append((entry.sha1, entry_path))
+            else:
+                yield entry.sha1, "blob", entry_path
+
+
+def walk_objects(include, exclude=()):
+    """yield (sha1, type, path) of objects reachable from include"""
+    seen = set()
+    # like git, only the trees of the excluded commits themselves are skipped
+    for sha1 in exclude:
+        for _ in iter_tree_objects(load_commit_header(sha1).tree, seen):
+            pass
+    for sha1, header in CommitWalker(include, exclude):
+        yield sha1, "commit", ""
+        yield from iter_tree_objects(header.tree, seen)
+
+
+def walk_commits(args, max_count=None):
+    revisions, paths = split_pathspec(args)
+    if not revisions:
+        die_error("error: no commit given")
+    include, exclude = parse_revisions(revisions)
+    walker = CommitWalker(include, exclude, paths)
+    return itertools.islice(walker, max_count)
+
+
+def list_objects(args, *, count=False, use_bitmap_index=False):
+    out = sys.stdout
+    revisions, paths = split_pathspec(args)
+    if not revisions:
+        die_error("error: no commit given")
+    if paths:
+        die_error("error: --objects cannot be limited to paths")
+    include, exclude = parse_revisions(revisions)
+    reachable = None
+    if use_bitmap_index:
+        reachable = find_reachable(include, exclude)
+    if reachable is not None:
+        if count:
+            out.write(f"{len(reachable)}\n")
+            return
+        for sha1 in reachable:
+            out.write(f"{sha1}\n")
+        return
+    objects = walk_objects(include, exclude)
+    if count:
+        out.write(f"{sum(1 for _ in objects)}\n")
+        return
+    for sha1, object_type, path in objects:
+        if object_type == "commit":
+            out.write(f"{sha1}\n")
+        else:
+            out.write(f"{sha1} {path}\n")
+
+
+def rev_list(args):
+    out = sys.stdout
+    if args.objects:
+        list_objects(
+            args.revisions, count=args.count, use_bitmap_index=args.use_bitmap_index
+        )
+        return
+    commits = walk_commits(args.revisions, args.max_count)
+    if args.count:
+        out.write(f"{sum(1 for _ in commits)}\n")
+        return
+    for sha1, _ in commits:
+        out.write(f"{sha1}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    rev_list(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# pick out and massage parameters: here, turn names into object names
+# see Documentation/git-rev-parse.txt in git
+
+import argparse
+import sys
+
+from . import paths
+from . import refs
+from .util import die_error
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "--verify",
+        help="check that exactly one parameter names an object",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        help="with --verify, fail silently on an invalid name",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--symbolic-full-name",
+        help="show the full ref name instead of the object name",
+        action="store_true",
+    )
+    parser.add_argument("revisions", nargs="*", metavar="<args>")
+
+
+def resolve(name, symbolic_full_name):
+    """what to print for name, or None if it names nothing"""
+    if symbolic_full_name:
+        full_name = refs.dwim_ref(name)
+        if full_name is None:
+            return None
+        # like git, HEAD shows the branch it is on
+        return refs.resolve_symbolic_ref(full_name)
+    try:
+        return str(refs.resolve_revision(name))
+    except refs.NAME_ERRORS:
+        return None
+
+
+def rev_parse(args):
+    try:
+        paths.find_repository_root()
+    except paths.NotGitRepositoryError as e:
+        die_error(f"fatal: {e}")
+    if args.verify:
+        result = None
+        if len(args.revisions) == 1:
+            result = resolve(args.revisions[0], args.symbolic_full_name)
+        if result is None:
+            if args.quiet:
+                sys.exit(1)
+            die_error("fatal: Needed a single revision")
+        print(result)
+        return
+    results = []
+    for name in args.revisions:
+        result = resolve(name, args.symbolic_full_name)
+        if result is None:
+            die_error(
+                f"fatal: ambiguous argument '{name}': unknown revision or path"
+                " not in the working tree.\nUse '--' to separate paths from"
+                " revisions, like this:\n"
+                "'git <command> [<revision>...] -- [<file>...]'"
+            )
+        results.append(result)
+    for result in results:
+        print(result)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    rev_parse(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+# cone-mode sparse-checkout and the sparse index
+# see Documentation/git-sparse-checkout.txt in git
+#
+# a cone is a set of directories included with everything below them, plus
+# the files (not the subdirectories) of each of their ancestors; with
+# index.sparse = true, a directory outside the cone is kept in the index as a
+# single sparse directory entry naming its tree
+
+import argparse
+import pathlib
+
+from . import paths
+from .util import die_error, get_logger
+from .config import get_config_bool, set_config
+from .diff_tree import sort_key
+from .git_objects import Tree, TreeEntry, load_object
+from .lockfile import LockError
+from .mode import is_gitlink
+from .staging import (
+    Index,
+    IndexChangedError,
+    IndexEntry,
+    directory_mode,
+    iter_tree_entries,
+    parse_index,
+)
+
+logger = get_logger(__name__)
+
+
+class Cone:
+    def __init__(self, directories):
+        directories = {d.strip("/") for d in directories} - {""}
+        # a directory inside another one adds nothing
+        self._recursive = set()
+        for d in directories:
+            if not self._below(d, directories - {d}):
+                self._recursive.add(d)
+        self._parents = {""}
+        for d in self._recursive:
+            parts = d.split("/")
+            for i in range(1, len(parts)):
+                self._parents.add("/".join(parts[:i]))
+
+    @staticmethod
+    def _below(path, directories):
+        """check if path is one of directories or lies below one of them"""
+        parts = path.split("/")
+        for i in range(1, len(parts) + 1):
+            if "/".join(parts[:i]) in directories:
+                return True
+        return False
+
+    @property
+    def directories(self):
+        return sorted(self._recursive)
+
+    def includes_directory(self, path: str):
+        """check if everything below the directory path is in the cone"""
+        return bool(path) and self._below(path, self._recursive)
+
+    def needs_directory(self, path: str):
+        """check if anything below the directory path is in the cone"""
+        return path in self._parents or self.includes_directory(path)
+
+    def includes_file(self, path: str):
+        parent = path.rpartition("/")[0]
+        return parent in self._parents or self.includes_directory(parent)
+
+    def to_patterns(self):
+        """the cone in the pattern format git writes to info/sparse-checkout"""
+        lines = ["/*", "!/*/"]
+        for d in sorted((self._parents - {""}) | self._recursive):
+            lines.append(f"/{d}/")
+            if d not in self._recursive:
+                lines.append(f"!/{d}/*/")
+        return "".join(line + "\n" for line in lines)
+
+
+def find_sparse_checkout_file():
+    return paths.find_git_root() / "info" / "sparse-checkout"
+
+
+def parse_patterns(text: str):
+    """the cone of cone-mode patterns, or None for other patterns"""
+    included = []
+    parents = set()
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#") or line in ("/*", "!/*/"):
+            continue
+        if line.startswith("!/") and line.endswith("/*/"):
+            parents.add(line[2:-3])
+        elif line.startswith("/") and line.endswith("/") and "*" not in line:
+            included.append(line[1:-1])
+        else:
+            return None
+    return Cone(d for d in included if d not in parents)
+
+
+def get_cone():
+    """the sparse-checkout cone, or None if the whole tree is checked out"""
+    if not get_config_bool("core", "sparsecheckout"):
+        return None
+    if not get_config_bool("core", "sparsecheckoutcone", True):
+        logger.debug("only cone mode sparse-checkout is supported")
+        return None
+    try:
+        text = find_sparse_checkout_file().read_text()
+    except FileNotFoundError:
+        return None
+    return parse_patterns(text)
+
+
+def sparse_index_enabled():
+    return get_config_bool("index", "sparse")
+
+
+def collapse_root(file_name: str, cone):
+    """the outermost directory above file_name outside the cone, or None"""
+    parts = file_name.rstrip("/").split("/")
+    n_dirs = len(parts) if file_name.endswith("/") else len(parts) - 1
+    for i in range(1, n_dirs + 1):
+        directory = "/".join(parts[:i])
+        if not cone.needs_directory(directory):
+            return directory
+    return None
+
+
+def write_directory_tree(entries, prefix: str):
+    """write the trees of the index entries below prefix ("dir/")"""
+    tree_entries = []
+    subdirectories = {}
+    for e in entries:
+        name, _, rest = e.file_name[len(prefix) :].partition("/")
+        if e.is_sparse_directory() and not rest:
+            tree_entries.append(TreeEntry(directory_mode, name, e.sha1))
+        elif rest:
+            subdirectories.setdefault(name, []).append(e)
+        else:
+            tree_entries.append(TreeEntry(e.mode, name, e.sha1))
+    for name, sub_entries in subdirectories.items():
+        sha1 = write_directory_tree(sub_entries, f"{prefix}{name}/")
+        tree_entries.append(TreeEntry(directory_mode, name, sha1))
+    tree = Tree()
+    for tree_entry in sorted(tree_entries, key=sort_key):
+        tree.add_entry(tree_entry)
+    tree.write()
+    return tree.hash()
+
+
+def can_collapse(entries):
+    """check if entries may be replaced by a sparse directory entry
+
+    like git, only when all of them are merged, skipped in the worktree and
+    not submodules, so conflicts and files checked out anyway stay visible
+    """
+    return all(
+        e.is_sparse_directory()
+        or e.stage == 0 and e.skip_worktree and not is_gitlink(e.mode)
+        for e in entries
+    )
+
+
+def collapse_directory(entries, directory: str):
+    """the entries below directory, collapsed as far as they can be
+
+    a directory which cannot be collapsed keeps its files, and each of its
+    subdirectories is tried on its own
+    """
+    if can_collapse(entries):
+        sha1 = write_directory_tree(entries, directory + "/")
+        return [IndexEntry.sparse_directory(directory, sha1)]
+    prefix = directory + "/"
+    kept = []
+    subdirectories = {}
+    for e in entries:
+        name, _, rest = e.file_name[len(prefix) :].partition("/")
+        if rest:
+            subdirectories.setdefault(name, []).append(e)
+        else:
+            kept.append(e)
+    for name, sub_entries in subdirectories.items():
+        kept += collapse_directory(sub_entries, prefix + name)
+    return kept
+
+
+def convert_index(index: Index, cone, sparse: bool):
+    """reshape an index for a new cone (None for no sparse-checkout)
+
+    sparse directory entries now needed are expanded and, for a sparse
+    index, directories which left the cone are collapsed into new trees
+    """
+    sparse = sparse and cone is not None
+    converted = Index()
+    converted.sparse = sparse
+    converted._base = index._base
+    entries = []
+    collapsed = {}  # directory -> its entries
+    for e in index:
+        if e.is_sparse_directory():
+            directory = e.file_name.rstrip("/")
+            if cone is None or not sparse or cone.needs_directory(directory):
+                tree = load_object(e.sha1)
+                prefix = pathlib.Path(directory)
+                entries += iter_tree_entries(tree, prefix, cone, sparse)
+                continue
+        elif e.stage == 0:  # unmerged entries stay in the worktree
+            e.skip_worktree = cone is not None and not cone.includes_file(e.file_name)
+        root = collapse_root(e.file_name, cone) if sparse else None
+        if root is None or e.file_name == root + "/":
+            entries.append(e)
+        else:
+            collapsed.setdefault(root, []).append(e)
+    for directory, sub_entries in collapsed.items():
+        entries += collapse_directory(sub_entries, directory)
+    converted.add_entries(entries)
+    return converted
+
+
+def setup_parser(parser):
+    parser.add_argument(
+        "action",
+        choices=["set", "add", "list", "disable"],
+        help="set or extend the directories to check out, list them, or stop",
+    )
+    parser.add_argument("directories", nargs="*", metavar="<directory>")
+    parser.add_argument(
+        "--no-sparse-index",
+        dest="sparse_index",
+        help="keep every file in the index instead of collapsing directories",
+        action="store_false",
+    )
+
+
+def sparse_checkout(args):
+    if args.action == "list":
+        cone = get_cone()
+        if cone is None:
+            die_error("fatal: this worktree is not sparse")
+        for directory in cone.directories:
+            print(directory)
+        return
+    if args.action == "disable":
+        cone = None
+        set_config("core", "sparseCheckout", "false")
+        set_config("index", "sparse", "false")
+    else:
+        directories = args.directories
+        if args.action == "add":
+            old_cone = get_cone()
+            if old_cone is None:
+                die_error("fatal: no sparse-checkout to add to")
+            directories = old_cone.directories + directories
+        cone = Cone(directories)
+        sparse_checkout_file = find_sparse_checkout_file()
+        sparse_checkout_file.parent.mkdir(exist_ok=True)
+        sparse_checkout_file.write_text(cone.to_patterns())
+        set_config("core", "sparseCheckout", "true")
+        set_config("core", "sparseCheckoutCone", "true")
+        set_config("index", "sparse", "true" if args.sparse_index else "false")
+    index = convert_index(parse_index(), cone, args.sparse_index)
+    try:
+        index.write()
+    except (LockError, IndexChangedError) as e:
+        die_error(f"fatal: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    sparse_checkout(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,18 @@
+import os
 import stat
+import time
+import struct
+import hashlib
 import pathlib
 
 from . import paths
-from .util import get_logger, hash_content
+from .util import get_logger, store_raw_content
+from .config import get_config, get_config_bool
+from .lockfile import LockFile, backoff_delays
 from .mode import normalize_mode
+from .object_id import ObjectId
+from .untracked_cache import UntrackedCache, UntrackedCacheFormatError
 from .git_objects import (
-    Blob,
     TreeEntry,
     Tree,
     load_object,
@@ -22,16 +29,17 @@ class UnsupportedIndexVersionError(BaseException):
     pass
 
 
-def to_binary(x: int):
-    return f"{x:b}"
+class IndexChangedError(BaseException):
+    pass
 
 
-def int16_to_bytes(x):
-    return x.to_bytes(length=2, byteorder="big")
+CHECKSUM_SIZE = 20
+# how long a reader waits for a writer to finish before giving up
+READ_RETRY_TIMEOUT_MS = 1000
 
 
-def int32_to_bytes(x):
-    return x.to_bytes(length=4, byteorder="big")
+def to_binary(x: int):
+    return f"{x:b}"
 
 
 def break_ns_part(time):
@@ -48,6 +56,22 @@ class IndexEntryFlags:
     assume_valid = 0x8000
 
 
+# the second set of flags of index version 3
+class IndexEntryExtendedFlags:
+    intent_to_add = 0x2000
+    skip_worktree = 0x4000
+
+
+directory_mode = stat.S_IFDIR
+
+# ctime, mtime, dev, ino, mode, uid, gid, size, sha1, flags (, extended flags)
+ENTRY_HEADER = struct.Struct(">10I20sH")
+EXTENDED_ENTRY_HEADER = struct.Struct(">10I20sHH")
+INDEX_HEADER = struct.Struct(">4sII")
+# what index.skipHash writes instead of the checksum
+NULL_CHECKSUM = b"\x00" * 20
+
+
 class IndexEntry:
     def __init__(
         self,
@@ -64,6 +88,7 @@ class IndexEntry:
         sha1,
         flags,
         file_name,
+        extended_flags=0,
     ):
         self.ctime = ctime
         self.ctime_ns = ctime_ns
@@ -80,10 +105,26 @@ class IndexEntry:
         self.stage = flags & IndexEntryFlags.stage_mask
         self.flags = flags & ~IndexEntryFlags.name_mask
         self.file_name = file_name
+        self.extended_flags = extended_flags
 
     def __str__(self):
         return f"{self.mode:06o} {self.sha1} {self.stage}\t{self.file_name}"
 
+    @property
+    def skip_worktree(self):
+        return bool(self.extended_flags & IndexEntryExtendedFlags.skip_worktree)
+
+    @skip_worktree.setter
+    def skip_worktree(self, value):
+        if value:
+            self.extended_flags |= IndexEntryExtendedFlags.skip_worktree
+        else:
+            self.extended_flags &= ~IndexEntryExtendedFlags.skip_worktree
+
+    def is_sparse_directory(self):
+        """a whole directory outside the sparse-checkout cone, named dir/"""
+        return stat.S_ISDIR(self.mode) and self.file_name.endswith("/")
+
     def update(self):
         logger.debug(f"update {self.file_name}")
 
@@ -95,21 +136,22 @@ class IndexEntry:
             orig_ctime_ns = self.ctime * 10**9 + self.ctime_ns
             return stat.st_ctime_ns > orig_ctime_ns
 
-        file = self.file_name
-        path = paths.find_repository_root() / file
-        stat = path.lstat()
+        path = os.path.join(paths.find_repository_root(), self.file_name)
+        stat = os.lstat(path)
+        changed = False
         if compare_mtime(stat):
             logger.debug("detected change of mtime")
-            obj = Blob.from_path(path)
-            obj.write()  # create new object
+            self.sha1 = write_worktree_blob(path, stat)
             self.mtime, self.mtime_ns = break_ns_part(stat.st_mtime_ns)
-            self.sha1 = obj.hash()
             self.file_size = stat.st_size
+            changed = True
         if compare_ctime(stat):
             logger.debug("detected change of ctime")
             self.mode = normalize_mode(stat.st_mode)
             self.ctime, self.ctime_ns = break_ns_part(stat.st_ctime_ns)
+            changed = True
         logger.debug(str(self))
+        return changed
 
     def print(self, *, debug=False):
         print(self)
@@ -124,24 +166,52 @@ class IndexEntry:
         basename = paths.basename(self.file_name)
         return TreeEntry(self.mode, basename, self.sha1)
 
+    def size(self):
+        """number of bytes of the entry in the index file"""
+        extended = bool(self.extended_flags)
+        header_size = EXTENDED_ENTRY_HEADER.size if extended else ENTRY_HEADER.size
+        return header_size + self.name_len + IndexEntry.calc_padding(
+            self.name_len, extended
+        )
+
+    def pack_into(self, buffer, offset):
+        """write the entry into a zeroed buffer at offset, return its end"""
+        # like git, stat data is truncated to 32 bits (st_dev, st_ino, ...)
+        fields = (
+            self.ctime & 0xFFFFFFFF,
+            self.ctime_ns,
+            self.mtime & 0xFFFFFFFF,
+            self.mtime_ns,
+            self.dev & 0xFFFFFFFF,
+            self.ino & 0xFFFFFFFF,
+            self.mode,
+            self.uid & 0xFFFFFFFF,
+            self.gid & 0xFFFFFFFF,
+            self.file_size & 0xFFFFFFFF,
+            self.sha1.raw,
+        )
+        flags = self.flags & ~IndexEntryFlags.extended
+        if self.extended_flags:
+            flags |= IndexEntryFlags.extended
+            header = EXTENDED_ENTRY_HEADER
+            header.pack_into(
+                buffer, offset, *fields, flags | self.name_len, self.extended_flags
+            )
+        else:
+            header = ENTRY_HEADER
+            header.pack_into(buffer, offset, *fields, flags | self.name_len)
+        offset += header.size
+        name = self.file_name.encode()
+        buffer[offset : offset + len(name)] = name
+        # the NUL padding is already there
+        return offset + len(name) + IndexEntry.calc_padding(
+            self.name_len, bool(self.extended_flags)
+        )
+
     def to_bytes(self):
-        store = b""
-        store += int32_to_bytes(self.ctime)
-        store += int32_to_bytes(self.ctime_ns)
-        store += int32_to_bytes(self.mtime)
-        store += int32_to_bytes(self.mtime_ns)
-        store += int32_to_bytes(self.dev)
-        store += int32_to_bytes(self.ino)
-        store += int32_to_bytes(self.mode)
-        store += int32_to_bytes(self.uid)
-        store += int32_to_bytes(self.gid)
-        store += int32_to_bytes(self.file_size)
-        store += bytes.fromhex(self.sha1)
-        store += int16_to_bytes(self.flags | self.name_len)
-        store += self.file_name.encode()
-        padding = b"\x00" * IndexEntry.calc_padding(self.name_len)
-        store += padding
-        return store
+        buffer = bytearray(self.size())
+        self.pack_into(buffer, 0)
+        return bytes(buffer)
 
     @staticmethod
     def from_tree_entry(tree_entry, prefix=pathlib.Path()):
@@ -163,51 +233,129 @@ class IndexEntry:
             flags=0,
             file_name=name,
         )
-        index_entry.name_len = len(index_entry.file_name)
+        index_entry.name_len = len(index_entry.file_name.encode())
         return index_entry
 
     @staticmethod
-    def from_path(path):
-        file_name = str(path)
-        full_path = paths.find_repository_root() / path
-        # create blob
-        obj = Blob.from_path(full_path)
-        obj.write()
-        sha1 = obj.hash()
-        # get file metadata
-        stat = full_path.lstat()
-        mode = normalize_mode(stat.st_mode)
-        name_len = len(file_name)
-        flags = name_len
+    def from_object(file_name: str, mode: int, sha1: ObjectId, stage: int = 0):
+        """entry for an object at stage, without stat data of a worktree file"""
+        name_len = min(len(file_name.encode()), IndexEntryFlags.name_mask)
+        flags = (stage << 12) & IndexEntryFlags.stage_mask | name_len
+        return IndexEntry(0, 0, 0, 0, 0, 0, mode, 0, 0, 0, sha1, flags, file_name)
+
+    @staticmethod
+    def sparse_directory(name: str, sha1: ObjectId):
+        """entry standing for the tree sha1 at directory name, not checked out"""
+        index_entry = IndexEntry.from_tree_entry(TreeEntry(directory_mode, name, sha1))
+        index_entry.file_name = name + "/"
+        index_entry.name_len = len(index_entry.file_name.encode())
+        index_entry.skip_worktree = True
+        return index_entry
+
+    @staticmethod
+    def from_stat(file_name: str, stat, sha1: ObjectId):
+        """entry of a file with the given lstat result and object name"""
         mtime, mtime_ns = break_ns_part(stat.st_mtime_ns)
         ctime, ctime_ns = break_ns_part(stat.st_ctime_ns)
-        index_entry = IndexEntry(
+        return IndexEntry(
             ctime=ctime,
             ctime_ns=ctime_ns,
             mtime=mtime,
             mtime_ns=mtime_ns,
             dev=stat.st_dev,
             ino=stat.st_ino,
-            mode=mode,
+            mode=normalize_mode(stat.st_mode),
             uid=stat.st_uid,
             gid=stat.st_gid,
             file_size=stat.st_size,
             sha1=sha1,
-            flags=flags,
+            flags=len(file_name.encode()),
             file_name=file_name,
         )
-        return index_entry
 
     @staticmethod
-    def calc_padding(name_len: int):
-        return 8 - ((name_len + 6) % 8)
+    def from_path(path):
+        file_name = str(path)
+        full_path = paths.find_repository_root() / path
+        stat = full_path.lstat()
+        sha1 = write_worktree_blob(full_path, stat)
+        return IndexEntry.from_stat(file_name, stat, sha1)
+
+    def stat_matches(self, stat):
+        """check if the stat data recorded in the entry is that of stat
+
+        compared like git does by default: times, inode, owner, size and
+        the mode bits kept in the index, all truncated to 32 bits
+        """
+        g = 10**9
+        return (
+            self.mtime_ns == stat.st_mtime_ns % g
+            and self.mtime == (stat.st_mtime_ns // g) & 0xFFFFFFFF
+            and self.file_size == stat.st_size & 0xFFFFFFFF
+            and self.ctime_ns == stat.st_ctime_ns % g
+            and self.ctime == (stat.st_ctime_ns // g) & 0xFFFFFFFF
+            and self.ino == stat.st_ino & 0xFFFFFFFF
+            and self.uid == stat.st_uid & 0xFFFFFFFF
+            and self.gid == stat.st_gid & 0xFFFFFFFF
+            and self.mode == normalize_mode(stat.st_mode)
+        )
+
+    def is_racy(self, index_mtime_ns: int):
+        """check if the file may have changed within the same timestamp
+
+        a file modified no earlier than the index was written can have
+        changed again without its stat data telling, so its content has to
+        be looked at
+        """
+        return self.mtime * 10**9 + self.mtime_ns >= index_mtime_ns
+
+    @staticmethod
+    def calc_padding(name_len: int, extended=False):
+        # entries are 62 bytes (64 with extended flags) plus the name, padded
+        # with 1 to 8 NULs to a multiple of 8
+        header_size = 64 if extended else 62
+        return 8 - ((header_size + name_len) % 8)
+
+
+def write_worktree_blob(path, st):
+    """store the content of a worktree file as a blob and return its name
+
+    a symbolic link is stored as its target, like git does
+    """
+    if stat.S_ISLNK(st.st_mode):
+        content = os.fsencode(os.readlink(path))
+    else:
+        with open(path, "rb") as f:
+            content = f.read()
+    return store_raw_content(b"blob %d\0" % len(content) + content)
+
+
+def entry_key(entry: IndexEntry):
+    # the order of entries in the index; str order is that of utf-8 bytes
+    return entry.file_name, entry.stage
 
 
 class Index:
     SIGNATURE = b"DIRC"
+    # extension marking an index which may hold sparse directory entries
+    SPARSE_DIRECTORIES = b"sdir"
+    UNTRACKED_CACHE = b"UNTR"
 
     def __init__(self):
+        # kept sorted by entry_key, as in the file
         self._index_entries = []
+        # path -> position of its first entry, built when first needed and
+        # dropped whenever entries move
+        self._positions = None
+        self.sparse = False
+        # the UntrackedCache kept with the index, if any
+        self.untracked_cache = None
+        # whether the entries differ from the file; an index read from disk
+        # which did not change is not written back
+        self.dirty = True
+        # the file content this index was read from: None for an index built
+        # from scratch, which replaces whatever is on disk, b"" for no file
+        self._base = None
 
     def __iter__(self):
         return iter(self._index_entries)
@@ -215,64 +363,280 @@ class Index:
     def __len__(self):
         return len(self._index_entries)
 
-    def add_entry(self, entry: IndexEntry):
-        self._index_entries.append(entry)
+    def _bisect(self, key, lo=0):
+        """position of the first entry whose key is not less than key"""
+        entries = self._index_entries
+        hi = len(entries)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if entry_key(entries[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _position_map(self):
+        if self._positions is None:
+            self._positions = {}
+            for i, e in enumerate(self._index_entries):
+                self._positions.setdefault(e.file_name, i)
+        return self._positions
+
+    def find(self, file_name):
+        """the position of the entry of file_name (its lowest stage), or None"""
+        return self._position_map().get(file_name)
 
-    def sort_entries(self):
-        self._index_entries = sorted(self._index_entries, key=lambda e: e.file_name)
+    def get(self, file_name):
+        pos = self.find(file_name)
+        return None if pos is None else self._index_entries[pos]
 
     def check_registerd(self, file_name):
-        for e in self:
-            if e.file_name == file_name:
-                return True
-        return False
+        return self.find(file_name) is not None
+
+    def __getitem__(self, pos):
+        return self._index_entries[pos]
+
+    def prefix_range(self, prefix: str):
+        """positions [start, end) of the entries whose path starts with prefix
+
+        both ends are found by bisection: paths with the prefix sort before
+        the prefix with its last character incremented
+        """
+        if not prefix:
+            return 0, len(self)
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return self._bisect((prefix, 0)), self._bisect((upper, 0))
+
+    def add_entry(self, entry: IndexEntry):
+        """add entry, replacing the entry of the same path and stage"""
+        key = entry_key(entry)
+        pos = self._bisect(key)
+        entries = self._index_entries
+        if pos < len(entries) and entry_key(entries[pos]) == key:
+            entries[pos] = entry
+        else:
+            entries.insert(pos, entry)
+            self._positions = None
+            self._invalidate_untracked([entry.file_name])
+        self.dirty = True
+
+    def _invalidate_untracked(self, file_names):
+        if self.untracked_cache is not None:
+            for file_name in file_names:
+                self.untracked_cache.invalidate_path(file_name)
+
+    def add_entries(self, new_entries):
+        """add many entries at once, replacing those of the same path and stage
+
+        the new entries are sorted and merged into the existing ones in a
+        single pass rather than inserted one by one
+        """
+        new_entries = sorted(new_entries, key=entry_key)
+        if not new_entries:
+            return
+        entries = self._index_entries
+        merged = []
+        pos = 0
+        for e in new_entries:
+            key = entry_key(e)
+            end = self._bisect(key, pos)
+            merged += entries[pos:end]
+            pos = end
+            if pos < len(entries) and entry_key(entries[pos]) == key:
+                pos += 1  # replaced
+            if merged and entry_key(merged[-1]) == key:
+                merged[-1] = e
+            else:
+                merged.append(e)
+        merged += entries[pos:]
+        self._index_entries = merged
+        self._positions = None
+        self._invalidate_untracked(e.file_name for e in new_entries)
+        self.dirty = True
+
+    def remove_entries(self, file_names):
+        """remove the entries (all stages) of file_names"""
+        file_names = set(file_names)
+        if not file_names:
+            return
+        n_entries = len(self._index_entries)
+        self._index_entries = [e for e in self if e.file_name not in file_names]
+        if len(self._index_entries) != n_entries:
+            self._positions = None
+            self._invalidate_untracked(file_names)
+            self.dirty = True
 
     def update(self, files):
-        for e in self:
-            if e.file_name in files:
-                e.update()
-        self.write()
+        for file_name in files:
+            e = self.get(file_name)
+            # like git, entries outside the sparse-checkout are left alone
+            if e is not None and not e.skip_worktree and e.update():
+                self.dirty = True
+
+    def find_sparse_directory(self, file_name):
+        """the sparse directory entry containing file_name, or None"""
+        if not self.sparse:
+            return None
+        parts = file_name.split("/")
+        for i in range(1, len(parts)):
+            e = self.get("/".join(parts[:i]) + "/")
+            if e is not None and e.is_sparse_directory():
+                return e
+        return None
+
+    def expand_sparse_directories(self, file_name):
+        """replace the sparse directory entries above file_name by their contents
+
+        directories are opened one level at a time, so the rest of each tree
+        stays collapsed
+        """
+        entry = self.find_sparse_directory(file_name)
+        while entry is not None:
+            self.remove_entries([entry.file_name])
+            name = entry.file_name.rstrip("/")
+            children = []
+            for tree_entry in load_object(entry.sha1):
+                path = f"{name}/{tree_entry.name}"
+                if tree_entry.object_type == "tree":
+                    child = IndexEntry.sparse_directory(path, tree_entry.sha1)
+                else:
+                    child = IndexEntry.from_tree_entry(tree_entry, pathlib.Path(name))
+                    child.skip_worktree = True
+                children.append(child)
+            self.add_entries(children)
+            entry = self.find_sparse_directory(file_name)
 
     def print(self, *, debug=False):
         for e in self:
             e.print(debug=debug)
 
     def version(self):
-        return 2
-
-    def to_bytes(self):
-        store = b""
-        store += Index.SIGNATURE
-        store += int32_to_bytes(self.version())
-        store += int32_to_bytes(len(self))
+        # extended flags need version 3
+        return 3 if any(e.extended_flags for e in self) else 2
+
+    def to_bytes(self, *, skip_hash=False):
+        """the index file, built in one buffer sized up front
+
+        with skip_hash the checksum is left zero, as git does for
+        index.skipHash, which saves hashing the whole file on every write
+        """
+        extensions = b""
+        if self.untracked_cache is not None:
+            data = self.untracked_cache.to_bytes()
+            extensions += Index.UNTRACKED_CACHE + struct.pack(">I", len(data)) + data
+        if self.sparse:
+            extensions += Index.SPARSE_DIRECTORIES + struct.pack(">I", 0)
+        entries_size = sum(e.size() for e in self)
+        size = INDEX_HEADER.size + entries_size + len(extensions) + CHECKSUM_SIZE
+        buffer = bytearray(size)
+        INDEX_HEADER.pack_into(buffer, 0, Index.SIGNATURE, self.version(), len(self))
+        offset = INDEX_HEADER.size
         for entry in self:
-            store += entry.to_bytes()
-        checksum = bytes.fromhex(hash_content(store))
-        store += checksum
-        return store
+            offset = entry.pack_into(buffer, offset)
+        buffer[offset : offset + len(extensions)] = extensions
+        offset += len(extensions)
+        if not skip_hash:
+            content = memoryview(buffer)[:offset]
+            buffer[offset:] = hashlib.sha1(content).digest()
+        return bytes(buffer)
+
+    def changed_on_disk(self, index_file):
+        """check if the index file is no longer the one this index was read from"""
+        current = read_checksum(index_file)
+        if current != self._base[-CHECKSUM_SIZE:]:
+            return True
+        if current == NULL_CHECKSUM:  # no checksum to go by
+            return read_index_bytes(index_file) != self._base
+        return False
+
+    def write(self, *, rebase=False):
+        """replace .git/index under index.lock, if anything changed
 
-    def write(self):
+        if another process wrote the index since this one was read, its
+        changes would be lost, so this fails unless rebase is set, in which
+        case the entries changed here are applied on top of the newer index
+        """
+        if not self.dirty:
+            logger.debug("index unchanged, not writing it")
+            return
         index_file = paths.find_index_file()
-        with open(index_file, "wb") as f:
-            content = self.to_bytes()
-            f.write(content)
+        timeout_ms = int(get_config("index", "locktimeout") or 0)
+        skip_hash = get_config_bool("index", "skiphash")
+        with LockFile(index_file, timeout_ms) as lock:
+            if self._base is not None and self.changed_on_disk(index_file):
+                if not rebase:
+                    raise IndexChangedError("index file changed since it was read")
+                self.rebase(read_index_file(index_file))
+            content = self.to_bytes(skip_hash=skip_hash)
+            lock.write(content)
+            lock.commit()
+        self._base = content
+        self.dirty = False
+
+    def rebase(self, newer):
+        """apply the entry changes made since this index was read to newer
+
+        entries added, changed or removed here win over what happened to
+        the same paths in newer; other entries are taken from newer
+        """
+        base = IndexParser().parse(self._base) if self._base else Index()
+        base_entries = {(e.file_name, e.stage): e.to_bytes() for e in base}
+        ours = {(e.file_name, e.stage): e for e in self}
+        changed = []
+        for key in base_entries.keys() | ours.keys():
+            e = ours.get(key)
+            if e is None or e.to_bytes() != base_entries.get(key):
+                changed.append(key)
+        if newer.sparse:
+            for file_name, _ in changed:
+                newer.expand_sparse_directories(file_name)
+        entries = {(e.file_name, e.stage): e for e in newer}
+        for key in changed:
+            logger.debug(f"rebase {key[0]} onto the newer index")
+            if key in ours:
+                entries[key] = ours[key]
+            else:
+                entries.pop(key, None)
+        self._index_entries = sorted(entries.values(), key=entry_key)
+        self._positions = None
+        self.dirty = True
+        self.sparse = newer.sparse
+        if newer.untracked_cache is not None:
+            self.untracked_cache = newer.untracked_cache
+        self._invalidate_untracked(file_name for file_name, _ in changed)
+        self._base = newer._base
 
     @staticmethod
-    def from_tree(tree: Tree, prefix=pathlib.Path(".")):
+    def from_tree(tree: Tree, prefix=pathlib.Path("."), cone=None, sparse=False):
+        """index of the files of a tree
+
+        with a sparse-checkout cone, entries outside of it are marked
+        skip-worktree; a sparse index keeps each directory outside the cone
+        as one entry, without reading its tree
+        """
         index = Index()
-        for tree_entry in tree:
-            if tree_entry.object_type == "tree":
-                subtree = load_object(tree_entry.sha1)
-                sub_entries = Index.from_tree(subtree, prefix / tree_entry.name)
-                for e in sub_entries:
-                    index.add_entry(e)
-            else:
-                index_entry = IndexEntry.from_tree_entry(tree_entry, prefix)
-                index.add_entry(index_entry)
-        index.sort_entries()
+        index.sparse = sparse and cone is not None
+        index.add_entries(iter_tree_entries(tree, prefix, cone, index.sparse))
         return index
 
 
+def iter_tree_entries(tree: Tree, prefix, cone, sparse):
+    for tree_entry in tree:
+        path = prefix / tree_entry.name
+        name = path.as_posix()
+        if tree_entry.object_type == "tree":
+            if sparse and not cone.needs_directory(name):
+                yield IndexEntry.sparse_directory(name, tree_entry.sha1)
+                continue
+            subtree = load_object(tree_entry.sha1)
+            yield from iter_tree_entries(subtree, path, cone, sparse)
+        else:
+            index_entry = IndexEntry.from_tree_entry(tree_entry, prefix)
+            if cone is not None and not cone.includes_file(name):
+                index_entry.skip_worktree = True
+            yield index_entry
+
+
 class IndexParser:
     def read_n_bytes(self, n: int):
         sub = self._data[self._head : self._head + n]
@@ -297,26 +661,36 @@ class IndexParser:
 
     def check_version(self):
         version = self.read_32_bit_int()
-        if version != 2:
+        if version not in (2, 3):
             raise UnsupportedIndexVersionError
         return version
 
     def parse_index_entry(self):
-        ctime = self.read_32_bit_int()
-        ctime_ns = self.read_32_bit_int()
-        mtime = self.read_32_bit_int()
-        mtime_ns = self.read_32_bit_int()
-        dev = self.read_32_bit_int()
-        ino = self.read_32_bit_int()
-        mode = self.read_32_bit_int()
-        uid = self.read_32_bit_int()
-        gid = self.read_32_bit_int()
-        file_size = self.read_32_bit_int()
-        sha1 = self.read_n_bytes(20).hex()
-        flags = self.read_16_bit_int()
+        # the fixed-size part is unpacked at once
+        (
+            ctime,
+            ctime_ns,
+            mtime,
+            mtime_ns,
+            dev,
+            ino,
+            mode,
+            uid,
+            gid,
+            file_size,
+            raw_sha1,
+            flags,
+        ) = ENTRY_HEADER.unpack_from(self._data, self._head)
+        self._head += ENTRY_HEADER.size
+        sha1 = ObjectId(raw_sha1)
+        extended_flags = 0
+        extended = bool(flags & IndexEntryFlags.extended)
+        if extended:
+            extended_flags = self.read_16_bit_int()
         name_len = flags & IndexEntryFlags.name_mask
         file_name = self.read_n_bytes(name_len).decode()
-        self.read_n_bytes(IndexEntry.calc_padding(name_len))  # skip null padding
+        # skip null padding
+        self.read_n_bytes(IndexEntry.calc_padding(name_len, extended))
         index_entry = IndexEntry(
             ctime,
             ctime_ns,
@@ -331,30 +705,136 @@ class IndexParser:
             sha1,
             flags,
             file_name,
+            extended_flags,
         )
         return index_entry
 
+    def parse_extensions(self, index):
+        checksum_size = 20
+        while self._head < len(self._data) - checksum_size:
+            signature = self.read_n_bytes(4)
+            size = self.read_32_bit_int()
+            data = self.read_n_bytes(size)
+            if signature == Index.SPARSE_DIRECTORIES:
+                index.sparse = True
+            elif signature == Index.UNTRACKED_CACHE:
+                try:
+                    index.untracked_cache = UntrackedCache.from_bytes(data)
+                except UntrackedCacheFormatError as e:
+                    # only a cache: it is rebuilt rather than failing
+                    logger.debug(f"ignoring untracked cache: {e}")
+            # extensions starting with an upper case letter are optional caches
+            elif not signature[:1].isupper():
+                raise IndexFormatError(f"unknown index extension {signature}")
+
+    def check_checksum(self):
+        checksum = self._data[-CHECKSUM_SIZE:]
+        if checksum == NULL_CHECKSUM:  # written with index.skipHash
+            return
+        content = memoryview(self._data)[:-CHECKSUM_SIZE]
+        if hashlib.sha1(content).digest() != checksum:
+            raise IndexFormatError("bad index file sha1 signature")
+
     def parse(self, raw_content: bytes):
         self._data = raw_content
         self._head = 0
+        self.check_checksum()
         self.check_signature()
         version = self.check_version()
         num_entry = self.read_32_bit_int()
         index = Index()
-        for _ in range(num_entry):
-            entry = self.parse_index_entry()
-            index.add_entry(entry)
+        index.add_entries(self.parse_index_entry() for _ in range(num_entry))
+        self.parse_extensions(index)
+        index._base = raw_content
+        index.dirty = False
         return index
 
 
-def parse_index():
-    index_file = paths.find_index_file()
+def read_checksum(index_file):
+    """the trailing checksum of an index file, b"" if there is none"""
+    try:
+        with open(index_file, "rb") as f:
+            f.seek(-CHECKSUM_SIZE, 2)
+            return f.read()
+    except OSError:  # missing, or too short to have one
+        return b""
+
+
+def read_index_bytes(index_file):
     try:
         with open(index_file, "rb") as f:
-            raw = f.read()
-            parser = IndexParser()
-            index = parser.parse(raw)
-            return index
+            return f.read()
     except FileNotFoundError:
+        return b""
+
+
+def read_index_file(index_file):
+    raw = read_index_bytes(index_file)
+    if not raw:
         # If there are no index file, return empty index
-        return Index()
+        index = Index()
+        index._base = b""
+        index.dirty = False
+        return index
+    parser = IndexParser()
+    return parser.parse(raw)
+
+
+# the index read last and what its file looked like, for processes which keep
+# it between commands (see keep_parsed_index)
+_kept_index = None
+_keep_index = False
+
+
+def keep_parsed_index(keep=True):
+    """let parse_index return the same Index while the index file is unchanged
+
+    only for processes which never modify the returned Index, as the daemon
+    serving read-only commands
+    """
+    global _keep_index, _kept_index
+    _keep_index = keep
+    _kept_index = None
+
+
+def index_file_validity(index_file):
+    """stat data and checksum of the index file, None if there is none
+
+    an index rewritten in the same clock tick with the same size still has
+    another checksum
+    """
+    try:
+        st = os.stat(index_file)
+    except FileNotFoundError:
+        return None
+    checksum = read_checksum(index_file)
+    return st.st_mtime_ns, st.st_ctime_ns, st.st_size, st.st_ino, checksum
+
+
+def parse_index():
+    global _kept_index
+    index_file = paths.find_index_file()
+    if not _keep_index:
+        return read_index_retrying(index_file)
+    # taken before reading, so a change meanwhile makes the next call read again
+    validity = index_file_validity(index_file)
+    if _kept_index is not None and _kept_index[:2] == (index_file, validity):
+        return _kept_index[2]
+    index = read_index_retrying(index_file)
+    _kept_index = (index_file, validity, index)
+    return index
+
+
+def read_index_retrying(index_file):
+    delays = backoff_delays(READ_RETRY_TIMEOUT_MS)
+    while True:
+        try:
+            return read_index_file(index_file)
+        except IndexFormatError:
+            # another writer may be halfway through, unless it was a
+            # git-compatible one renaming index.lock over the index
+            delay = next(delays, None)
+            if delay is None:
+                raise
+            logger.debug("index is being written, retrying")
+            time.sleep(delay)
@@ -0,0 +1,270 @@
+# the untracked cache: the UNTR extension of the index
+# see Documentation/technical/index-format.txt in git
+#
+# for each directory of the worktree the cache keeps the stat data of the
+# directory, the object name of its .gitignore and the names of the
+# untracked files in it; a directory whose stat data and rules did not
+# change since is not read again
+#
+# directories are recorded with the flags git uses for "status -uall": every
+# untracked file is listed in the directory it is in, and untracked
+# directories are recursed into like any other
+
+import os
+import struct
+
+from . import ewah
+from .object_id import ObjectId, null_oid, raw_length
+
+# ctime, ctime ns, mtime, mtime ns, dev, ino, uid, gid, size
+STAT_DATA = struct.Struct(">9I")
+DIR_FLAGS = struct.Struct(">I")
+NO_STAT = (0,) * 9
+# git's DIR_SHOW_OTHER_DIRECTORIES: untracked directories are listed whole
+SHOW_OTHER_DIRECTORIES = 0x2
+
+
+class UntrackedCacheFormatError(BaseException):
+    pass
+
+
+def encode_varint(value: int):
+    """git's varint: 7 bits per byte, most significant first, with offsets"""
+    out = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        value -= 1
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def decode_varint(data, pos: int):
+    """return (value, position after it)"""
+    try:
+        c = data[pos]
+        pos += 1
+        value = c & 0x7F
+        while c & 0x80:
+            c = data[pos]
+            pos += 1
+            value = ((value + 1) << 7) | (c & 0x7F)
+    except IndexError:
+        raise UntrackedCacheFormatError("truncated varint")
+    return value, pos
+
+
+def stat_data(st):
+    """the fields of a stat result git keeps, truncated to 32 bits"""
+    fields = (
+        int(st.st_ctime),
+        st.st_ctime_ns % 10**9,
+        int(st.st_mtime),
+        st.st_mtime_ns % 10**9,
+        st.st_dev,
+        st.st_ino,
+        st.st_uid,
+        st.st_gid,
+        st.st_size,
+    )
+    return tuple(x & 0xFFFFFFFF for x in fields)
+
+
+def worktree_ident(worktree: str):
+    """identifies the worktree and system the cache was made for"""
+    return f"Location {worktree}, system {os.uname().sysname}\0".encode()
+
+
+class UntrackedCacheDir:
+    """what is cached of one directory
+
+    stat is None while the directory is not valid, which is the case for a
+    new node and for one whose contents may have changed
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.untracked = []
+        self.dirs = {}
+        self.stat = None
+        self.exclude_oid = null_oid
+        # set by git for a directory only checked for having untracked files
+        self.check_only = False
+
+    def child(self, name):
+        """the node of subdirectory name, created if needed"""
+        node = self.dirs.get(name)
+        if node is None:
+            node = self.dirs[name] = UntrackedCacheDir(name)
+        return node
+
+    def invalidate(self):
+        self.stat = None
+        self.untracked = []
+        self.check_only = False
+
+    def invalidate_tree(self):
+        self.invalidate()
+        self.exclude_oid = null_oid
+        for node in self.dirs.values():
+            node.invalidate_tree()
+
+    def iter_nodes(self):
+        """yield this node and those below it, parents first"""
+        yield self
+        for node in self.dirs.values():
+            yield from node.iter_nodes()
+
+
+class UntrackedCache:
+    def __init__(self, ident: bytes):
+        self.ident = ident
+        self.dir_flags = 0
+        self.info_exclude = (NO_STAT, null_oid)
+        self.excludes_file = (NO_STAT, null_oid)
+        self.exclude_per_dir = ".gitignore"
+        # None until the worktree was first listed
+        self.root = None
+
+    def invalidate_path(self, path: str):
+        """forget the untracked files of the directory containing path
+
+        a path added to or removed from the index changes what is untracked
+        in its directory only, unless untracked directories are listed as a
+        whole, as in a cache made by git status, where the directories above
+        it may change too
+        """
+        node = self.root
+        if node is None:
+            return
+        above = []
+        for name in path.split("/")[:-1]:
+            above.append(node)
+            node = node.dirs.get(name)
+            if node is None:
+                break
+        else:
+            node.invalidate()
+        if self.dir_flags & SHOW_OTHER_DIRECTORIES:
+            for node in above:
+                node.invalidate()
+
+    def to_bytes(self):
+        out = bytearray()
+        out += encode_varint(len(self.ident)) + self.ident
+        out += STAT_DATA.pack(*self.info_exclude[0])
+        out += STAT_DATA.pack(*self.excludes_file[0])
+        out += DIR_FLAGS.pack(self.dir_flags)
+        out += self.info_exclude[1].raw + self.excludes_file[1].raw
+        out += self.exclude_per_dir.encode() + b"\0"
+        if self.root is None:
+            out += encode_varint(0)
+            return bytes(out)
+        nodes = list(self.root.iter_nodes())
+        out += encode_varint(len(nodes))
+        valid = 0
+        check_only = 0
+        sha1_valid = 0
+        stats = []
+        oids = []
+        for i, node in enumerate(nodes):
+            if node.stat is not None:
+                valid |= 1 << i
+                stats.append(STAT_DATA.pack(*node.stat))
+            if node.check_only:
+                check_only |= 1 << i
+            if node.exclude_oid != null_oid:
+                sha1_valid |= 1 << i
+                oids.append(node.exclude_oid.raw)
+            out += encode_varint(len(node.untracked)) + encode_varint(len(node.dirs))
+            out += node.name.encode() + b"\0"
+            for name in node.untracked:
+                out += name.encode() + b"\0"
+        for bits in (valid, check_only, sha1_valid):
+            out += ewah.encode(bits, bits.bit_length())
+        out += b"".join(stats) + b"".join(oids)
+        out += b"\0"  # git's safeguard for the string lists
+        return bytes(out)
+
+    @staticmethod
+    def from_bytes(data: bytes):
+        if len(data) <= 1 or data[-1] != 0:
+            raise UntrackedCacheFormatError("untracked cache is not terminated")
+        try:
+            return UntrackedCacheParser(data).parse()
+        except (IndexError, struct.error, ewah.EWAHFormatError, UnicodeDecodeError):
+            raise UntrackedCacheFormatError("corrupt untracked cache")
+
+
+class UntrackedCacheParser:
+    def __init__(self, data: bytes):
+        self._data = data
+        self._head = 0
+
+    def read_varint(self):
+        value, self._head = decode_varint(self._data, self._head)
+        return value
+
+    def read_n_bytes(self, n: int):
+        if self._head + n > len(self._data):
+            raise UntrackedCacheFormatError("truncated untracked cache")
+        sub = self._data[self._head : self._head + n]
+        self._head += n
+        return sub
+
+    def read_string(self):
+        end = self._data.index(b"\0", self._head)
+        s = self._data[self._head : end].decode()
+        self._head = end + 1
+        return s
+
+    def read_stat(self):
+        return STAT_DATA.unpack(self.read_n_bytes(STAT_DATA.size))
+
+    def read_oid(self):
+        return ObjectId(self.read_n_bytes(raw_length))
+
+    def read_dir(self, nodes):
+        n_untracked = self.read_varint()
+        n_dirs = self.read_varint()
+        node = UntrackedCacheDir(self.read_string())
+        nodes.append(node)
+        node.untracked = [self.read_string() for _ in range(n_untracked)]
+        for _ in range(n_dirs):
+            child = self.read_dir(nodes)
+            node.dirs[child.name] = child
+        return node
+
+    def read_bitmap(self):
+        bits, _ = ewah.decode(self._data, self._head)
+        self._head += ewah.serialized_size(self._data, self._head)
+        return bits
+
+    def parse(self):
+        ident = self.read_n_bytes(self.read_varint())
+        cache = UntrackedCache(ident)
+        info_exclude_stat = self.read_stat()
+        excludes_file_stat = self.read_stat()
+        cache.dir_flags = DIR_FLAGS.unpack(self.read_n_bytes(DIR_FLAGS.size))[0]
+        cache.info_exclude = (info_exclude_stat, self.read_oid())
+        cache.excludes_file = (excludes_file_stat, self.read_oid())
+        cache.exclude_per_dir = self.read_string()
+        if self._head >= len(self._data) - 1:
+            return cache
+        n_nodes = self.read_varint()
+        if n_nodes == 0:
+            return cache
+        nodes = []
+        cache.root = self.read_dir(nodes)
+        if len(nodes) != n_nodes:
+            raise UntrackedCacheFormatError("wrong number of untracked cache dirs")
+        valid = self.read_bitmap()
+        check_only = self.read_bitmap()
+        sha1_valid = self.read_bitmap()
+        for i in ewah.iter_bits(valid):
+            nodes[i].stat = self.read_stat()
+        for i in ewah.iter_bits(sha1_valid):
+            nodes[i].exclude_oid = self.read_oid()
+        for i in ewah.iter_bits(check_only):
+            nodes[i].check_only = True
+        return cache
@@ -1,32 +1,215 @@
 import argparse
-import pathlib
+import os
+import re
+import stat
+import sys
 
-from .util import die_error
-from .paths import get_cwd_relative
-from .staging import IndexEntry, parse_index
+from .util import decode_path, die_error
+from .object_store import get_object_store
+from .paths import find_repository_root, get_cwd_relative
+from .lockfile import LockError
+from .ls_files import normalize_pathspec
+from .mode import S_IFGITLINK
+from .object_id import ObjectId
+from .staging import IndexChangedError, IndexEntry, parse_index
+
+# the modes --index-info accepts, besides 0 for removing a path
+INDEX_INFO_MODES = {stat.S_IFREG | 0o644, stat.S_IFREG | 0o755, stat.S_IFLNK}
+INDEX_INFO_MODES.add(S_IFGITLINK)
+# an empty, ".", ".." or ".git" path component
+INVALID_PATH = re.compile(r"(?:^|/)(?:\.{0,2}|\.[gG][iI][tT])(?:/|$)")
 
 
 def setup_parser(parser):
     parser.add_argument("--add", help="add files to index", action="store_true")
+    parser.add_argument(
+        "--remove",
+        help="remove files which are in the index but missing",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--force-remove",
+        help="remove files from the index even if they still exist",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--rebase",
+        help="if the index changed meanwhile, apply the updates to the new index",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stdin",
+        help="read the paths to update from stdin, one per line",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--index-info",
+        dest="index_info",
+        help="read '<mode> <sha1> <stage>\\t<path>' lines from stdin and put"
+        " them into the index, without looking at the worktree",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-z",
+        help="records on stdin are NUL-terminated and paths are not quoted",
+        action="store_true",
+    )
     parser.add_argument("file", nargs="*", help="files to update")
 
 
-def update_index(args):
-    files = args.file
-    cwd = get_cwd_relative()
-    paths_relative_to_root = set(map(lambda f: str(cwd / f), files))
-    index = parse_index()
-    for p in paths_relative_to_root:
-        exists = index.check_registerd(p)
-        if not exists:
-            if args.add:
-                index.add_entry(IndexEntry.from_path(p))
-            else:
-                file = pathlib.Path(p).relative_to(get_cwd_relative())
+def read_stdin_records(nul_terminated: bool):
+    data = sys.stdin.buffer.read()
+    records = data.split(b"\0" if nul_terminated else b"\n")
+    if records and records[-1] == b"":
+        records.pop()
+    return records
+
+
+def read_path(raw: bytes, nul_terminated: bool):
+    """a path from stdin, C-style quoted unless NUL-terminated"""
+    if nul_terminated:
+        return raw.decode()
+    try:
+        return decode_path(raw)
+    except ValueError as e:
+        die_error(f"fatal: {e}")
+
+
+def check_path(path: str):
+    """die if path can not be in the index, like git's verify_path"""
+    if INVALID_PATH.search(path):
+        die_error(
+            f"error: Invalid path '{path}'\n"
+            f"fatal: git update-index: unable to update {path}"
+        )
+
+
+def parse_index_info(record: bytes, nul_terminated: bool):
+    """(path, mode, sha1, stage) of an --index-info record
+
+    besides "<mode> <sha1> <stage>\\t<path>" as ls-files --stage prints it,
+    "<mode> <type> <sha1>\\t<path>" of ls-tree and "<mode> <sha1>\\t<path>"
+    are understood, both at stage 0
+    """
+    info, tab, raw_path = record.partition(b"\t")
+    fields = info.decode(errors="replace").split(" ")
+    try:
+        if not tab or len(fields) not in (2, 3):
+            raise ValueError
+        mode = int(fields[0], 8)
+        if len(fields) == 2:
+            sha1, stage = fields[1], 0
+        elif fields[1] in ("blob", "tree", "commit"):
+            sha1, stage = fields[2], 0
+        else:
+            sha1, stage = fields[1], int(fields[2])
+        sha1 = ObjectId.from_hex(sha1)
+        if not 0 <= stage <= 3 or mode and mode not in INDEX_INFO_MODES:
+            raise ValueError
+    except ValueError:
+        die_error(f"fatal: malformed index info {record.decode(errors='replace')}")
+    return read_path(raw_path, nul_terminated), mode, sha1, stage
+
+
+def iter_path_entries(index, path):
+    pos = index.find(path)
+    while pos is not None and pos < len(index) and index[pos].file_name == path:
+        yield index[pos]
+        pos += 1
+
+
+def apply_index_info(index, records, nul_terminated):
+    """return (paths to remove, entries to add) for --index-info records
+
+    records are applied in order: mode 0 removes a path, a merged entry
+    replaces all stages of its path and an unmerged one its stage 0
+    """
+    removed = set()
+    pending = {}  # path -> {stage: entry}
+    for record in records:
+        path, mode, sha1, stage = parse_index_info(record, nul_terminated)
+        if index.sparse:
+            index.expand_sparse_directories(path)
+        if mode == 0:
+            removed.add(path)
+            pending.pop(path, None)
+            continue
+        check_path(path)
+        stages = pending.setdefault(path, {})
+        if stage == 0:
+            stages.clear()
+        else:
+            stages.pop(0, None)
+        stages[stage] = IndexEntry.from_object(path, mode, sha1, stage)
+    added = []
+    for path, stages in pending.items():
+        if 0 not in stages and path not in removed:
+            # the other stages of a conflict stay
+            added += [
+                e
+                for e in iter_path_entries(index, path)
+                if e.stage and e.stage >> 12 not in stages
+            ]
+        removed.add(path)
+        added += stages.values()
+    return removed, added
+
+
+def update_paths(index, paths, args):
+    """return (paths to remove, entries to add, paths to refresh)"""
+    cwd = get_cwd_relative().as_posix()
+    prefix = "" if cwd == "." else cwd + "/"
+    root = find_repository_root()
+    added = []
+    removed = []
+    updated = []
+    for p in sorted({normalize_pathspec(prefix, f).rstrip("/") for f in paths} - {""}):
+        if index.sparse:
+            index.expand_sparse_directories(p)
+        if args.force_remove:
+            removed.append(p)
+        elif not os.path.lexists(os.path.join(root, p)):
+            if not args.remove:
+                file = os.path.relpath(p, cwd)
                 die_error(
-                    f"error: {file} not registered to index. consider using --add option."
+                    f"error: {file}: does not exist and --remove not passed\n"
+                    f"fatal: Unable to process path {file}"
                 )
-    index.update(paths_relative_to_root)
+            removed.append(p)
+        elif index.check_registerd(p):
+            updated.append(p)
+        elif args.add:
+            added.append(IndexEntry.from_path(p))
+        else:
+            file = os.path.relpath(p, cwd)
+            die_error(
+                f"error: {file} not registered to index. consider using --add option."
+            )
+    return removed, added, updated
+
+
+def update_index(args):
+    if args.stdin and args.index_info:
+        die_error("fatal: --stdin and --index-info both read standard input")
+    index = parse_index()
+    removed = set()
+    added = []
+    # everything is collected first: the index is merged and written once
+    if args.index_info:
+        removed, added = apply_index_info(index, read_stdin_records(args.z), args.z)
+    files = list(args.file)
+    if args.stdin:
+        files += [read_path(r, args.z) for r in read_stdin_records(args.z)]
+    with get_object_store().batch():
+        removed_paths, added_paths, updated = update_paths(index, files, args)
+        removed.update(removed_paths)
+        index.remove_entries(removed)
+        index.add_entries(added + added_paths)
+        index.update(updated)
+    try:
+        index.write(rebase=args.rebase)
+    except (LockError, IndexChangedError) as e:
+        die_error(f"fatal: {e}")
 
 
 def main():
@@ -0,0 +1,146 @@
+# update the object name stored in a ref safely
+# see Documentation/git-update-ref.txt in git
+
+import argparse
+import sys
+
+from . import paths
+from . import refs
+from .object_id import hex_length, null_oid
+from .util import die_error
+
+
+def setup_parser(parser):
+    parser.add_argument("-m", dest="reason", help="ignored, as there are no reflogs")
+    parser.add_argument("-d", dest="delete", help="delete the ref", action="store_true")
+    parser.add_argument(
+        "--no-deref",
+        help="update a symbolic ref itself rather than the ref it points to",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--stdin",
+        help="read update, create, delete and verify commands from stdin and"
+        " apply them all or none",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-z", help="commands on stdin are NUL-terminated", action="store_true"
+    )
+    parser.add_argument("args", nargs="*", metavar="<ref> [<new-oid>] [<old-oid>]")
+
+
+def parse_value(value: str):
+    """object named by value; empty or all zeros stands for no ref"""
+    if value == "" or value == "0" * hex_length:
+        return null_oid
+    try:
+        return refs.resolve_revision(value)
+    except refs.NAME_ERRORS:
+        die_error(f"fatal: {value}: not a valid SHA1")
+
+
+def iter_stdin_commands(data: bytes, nul_terminated: bool):
+    """yield (command, ref, values) of each command, a missing value as None
+
+    with -z every value is a field of its own, which may be empty
+    """
+    arity = {"update": 2, "create": 1, "delete": 1, "verify": 1}
+    if not nul_terminated:
+        for line in data.decode().splitlines():
+            if not line:
+                continue
+            command, _, rest = line.partition(" ")
+            if command not in arity:
+                die_error(f"fatal: unknown command: {line}")
+            ref, *values = rest.split(" ")
+            if len(values) > arity[command]:
+                die_error(f"fatal: {command} {ref}: extra input: {values[-1]}")
+            yield command, ref, values + [None] * (arity[command] - len(values))
+        return
+    fields = data.decode().split("\0")
+    if fields and fields[-1] == "":
+        fields.pop()
+    pos = 0
+    while pos < len(fields):
+        command, _, ref = fields[pos].partition(" ")
+        if command not in arity:
+            die_error(f"fatal: unknown command: {fields[pos]}")
+        values = fields[pos + 1 : pos + 1 + arity[command]]
+        if len(values) < arity[command]:
+            die_error(f"fatal: {command} {ref}: unexpected end of input")
+        yield command, ref, values
+        pos += 1 + arity[command]
+
+
+def update_from_stdin(args):
+    transaction = refs.RefTransaction()
+    data = sys.stdin.buffer.read()
+    for command, ref, values in iter_stdin_commands(data, args.z):
+        name = ref if args.no_deref else refs.resolve_symbolic_ref(ref)
+        if command == "update":
+            new, old = values
+            if not new:
+                die_error(f"fatal: update {ref}: missing <new-oid>")
+            old = None if old is None else parse_value(old)
+            transaction.update(name, parse_value(new), old)
+        elif command == "create":
+            new = parse_value(values[0] or "")
+            if new == null_oid:
+                die_error(f"fatal: create {ref}: zero <new-oid>")
+            transaction.update(name, new, null_oid)
+        elif command == "delete":
+            old = None if not values[0] else parse_value(values[0])
+            if old == null_oid:
+                die_error(f"fatal: delete {ref}: zero <old-oid>")
+            transaction.delete(name, old)
+        else:
+            transaction.verify(name, parse_value(values[0] or ""))
+    transaction.commit()
+
+
+def update_ref(args):
+    try:
+        paths.find_repository_root()
+        if args.stdin:
+            if args.args or args.delete:
+                die_error("fatal: --stdin takes no other arguments")
+            update_from_stdin(args)
+            return
+        n_values = len(args.args) - 1
+        if n_values not in ((0, 1) if args.delete else (1, 2)):
+            die_error(
+                "usage: min-git update-ref [-m <reason>] [--no-deref]"
+                " (-d <ref> [<old-oid>] | <ref> <new-oid> [<old-oid>]"
+                " | --stdin [-z])"
+            )
+        ref, *values = args.args
+        refs.check_ref_name(ref)
+        name = ref if args.no_deref else refs.resolve_symbolic_ref(ref)
+        if args.delete:
+            new, old = null_oid, values[0] if values else None
+        else:
+            new, old = values[0], values[1] if len(values) > 1 else None
+            new = parse_value(new)
+        old = None if old is None else parse_value(old)
+        try:
+            refs.update_ref(name, new, old)
+        except refs.RefUpdateError as e:
+            die_error(f"fatal: update_ref failed for ref '{name}': {e}")
+    except (
+        paths.NotGitRepositoryError,
+        refs.InvalidRefNameError,
+        refs.RefUpdateError,
+    ) as e:
+        die_error(f"fatal: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    update_ref(args)
+
+
+if __name__ == "__main__":
+    main()
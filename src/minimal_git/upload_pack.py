@@ -0,0 +1,208 @@
+# send objects to fetch and clone: the server side of the pack protocol
+# see Documentation/gitprotocol-pack.txt in git
+#
+# protocol version 0 without capabilities: the refs are advertised, the
+# client names the tips it wants and the commits it has, and one pack with
+# what it lacks is sent back
+
+import argparse
+import os
+import sys
+
+from . import pack
+from . import paths
+from . import refs
+from .util import die_error, get_logger, load_raw_content, read_object_header
+from .commit_graph import load_commit_header
+from .diff_tree import iter_tree_changes
+from .object_id import ObjectId, null_oid
+from .pkt_line import FLUSH_PKT, PktLineReader, ProtocolError, pkt_line
+from .rev_list import CommitWalker
+
+logger = get_logger(__name__)
+
+AGENT = "agent=min-git"
+
+
+def setup_parser(parser):
+    parser.add_argument("directory", metavar="<directory>")
+
+
+def list_advertised_refs():
+    """(name, sha1) of HEAD, if it points to a branch, and all refs"""
+    advertised = []
+    head = refs.read_symbolic_ref("HEAD")
+    head_sha1 = refs.read_ref(head) if head is not None else None
+    if head_sha1 is not None:
+        advertised.append(("HEAD", head_sha1))
+    advertised += refs.list_refs()
+    return advertised, head if head_sha1 is not None else None
+
+
+def advertise_refs(out, advertised, head):
+    capabilities = AGENT
+    if head is not None:
+        capabilities = f"symref=HEAD:{head} {capabilities}"
+    if not advertised:
+        # an empty repository still has to send its capabilities
+        advertised = [("capabilities^{}", null_oid)]
+    for i, (name, sha1) in enumerate(advertised):
+        line = f"{sha1} {name}"
+        if i == 0:
+            line += f"\0{capabilities}"
+        out.write(pkt_line(f"{line}\n".encode()))
+    out.write(FLUSH_PKT)
+    out.flush()
+
+
+def parse_object_id(line: bytes, command: bytes):
+    """the object name after command in a line like "want <sha1> ..." """
+    words = line.split(b" ")
+    if len(words) < 2 or words[0] != command:
+        raise ProtocolError(f"expected {command.decode()}, got {line!r}")
+    try:
+        return ObjectId.from_hex(words[1].decode())
+    except ValueError:
+        raise ProtocolError(f"invalid object name in {line!r}")
+
+
+def is_commit(sha1):
+    return paths.has_object(sha1) and read_object_header(sha1)[0] == "commit"
+
+
+def negotiate(reader, out):
+    """read the haves of the client and return the commits both sides have
+
+    like upload-pack without multi_ack, the first common commit is
+    acknowledged right away and a batch of haves without one gets a NAK
+    """
+    common = []
+    while True:
+        line = reader.read_line()
+        if line is None:
+            if not common:
+                out.write(pkt_line(b"NAK\n"))
+                out.flush()
+            continue
+        if line == b"done":
+            if not common:
+                out.write(pkt_line(b"NAK\n"))
+            out.flush()
+            return common
+        sha1 = parse_object_id(line, b"have")
+        if is_commit(sha1):
+            if not common:
+                out.write(pkt_line(b"ACK %s\n" % sha1.hex().encode()))
+                out.flush()
+            common.append(sha1)
+
+
+def iter_new_tree_objects(old_tree, new_tree, seen):
+    """yield (sha1, type) of new_tree and what in it differs from old_tree
+
+    unchanged subtrees are skipped without being read, so the cost follows
+    the size of the change rather than the size of the tree
+    """
+    if new_tree in seen or new_tree == old_tree:
+        return
+    seen.add(new_tree)
+    yield new_tree, "tree"
+    for old, new, _, _ in iter_tree_changes(old_tree, new_tree):
+        # submodule commits are not part of this repository
+        if new is None or new.object_type == "commit" or new.sha1 in seen:
+            continue
+        if new.object_type == "tree":
+            is_tree = old is not None and old.object_type == "tree"
+            yield from iter_new_tree_objects(
+                old.sha1 if is_tree else None, new.sha1, seen
+            )
+        else:
+            seen.add(new.sha1)
+            yield new.sha1, new.object_type
+
+
+def peel_tags(wants):
+    """return the annotated tags among wants and the commits they point to"""
+    tags = []
+    commits = []
+    for sha1 in wants:
+        while read_object_header(sha1)[0] == "tag":
+            tags.append(sha1)
+            _, _, content = load_raw_content(sha1).partition(b"\x00")
+            # the first line of a tag is "object <sha1>"
+            sha1 = ObjectId.from_hex(content[len(b"object ") :][:40].decode())
+        commits.append(sha1)
+    return tags, commits
+
+
+def list_objects_to_send(wants, common):
+    """(sha1, type) of the objects reachable from wants the client lacks
+
+    the client has everything reachable from the common commits; each new
+    commit only brings what differs from its first parent, which is new
+    itself or already on the client
+    """
+    tags, commits = peel_tags(wants)
+    objects = [(sha1, "tag") for sha1 in dict.fromkeys(tags)]
+    seen = set()
+    headers = {}
+    for sha1, header in CommitWalker(commits, common):
+        objects.append((sha1, "commit"))
+        headers[sha1] = header
+    for sha1, header in headers.items():
+        parent_tree = None
+        if header.parents:
+            parent = header.parents[0]
+            parent_header = headers.get(parent) or load_commit_header(parent)
+            parent_tree = parent_header.tree
+        objects += iter_new_tree_objects(parent_tree, header.tree, seen)
+    return objects
+
+
+def send_pack(out, objects):
+    writer = pack.PackWriter(out, len(objects))
+    for sha1, _ in objects:
+        raw = load_raw_content(sha1)
+        header, _, content = raw.partition(b"\x00")
+        writer.add_object(sha1, header.split(b" ")[0].decode(), content)
+    writer.finish()
+    out.flush()
+
+
+def upload_pack(args):
+    try:
+        os.chdir(args.directory)
+        paths.find_repository_root()
+    except (OSError, paths.NotGitRepositoryError):
+        die_error(f"fatal: '{args.directory}' does not appear to be a git repository")
+    out = sys.stdout.buffer
+    reader = PktLineReader(sys.stdin.buffer)
+    advertised, head = list_advertised_refs()
+    advertise_refs(out, advertised, head)
+    tips = {sha1 for _, sha1 in advertised}
+    try:
+        wants = []
+        for line in iter(reader.read_line, None):
+            sha1 = parse_object_id(line, b"want")
+            if sha1 not in tips:
+                die_error(f"fatal: git upload-pack: not our ref {sha1}")
+            wants.append(sha1)
+        if not wants:  # the client is up to date
+            return
+        common = negotiate(reader, out)
+    except ProtocolError as e:
+        die_error(f"fatal: {e}")
+    objects = list_objects_to_send(wants, common)
+    logger.debug(f"sending {len(objects)} objects")
+    send_pack(out, objects)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    setup_parser(parser)
+    args = parser.parse_args()
+    upload_pack(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,10 @@
 import sys
 import pathlib
 import hashlib
-import zlib
+import re
 
-from . import paths
+from . import object_store
+from .object_id import ObjectId
 
 
 def get_logger(name=None):
@@ -22,24 +23,88 @@ def die_error(*args, **kwargs):
     sys.exit(1)
 
 
-def hash_content(content: bytes) -> str:
-    sha1 = hashlib.sha1(content).hexdigest()
+def hash_content(content: bytes) -> ObjectId:
+    sha1 = ObjectId(hashlib.sha1(content).digest())
     return sha1
 
 
-def load_raw_content(sha1: str) -> bytes:
-    path = paths.make_object_path(sha1)
-    with open(path, "rb") as f:
-        content = f.read()
-        decompressed_content = zlib.decompress(content)
-    return decompressed_content
+# bytes which make a path need quoting
+_needs_quoting = re.compile(rb'[\x00-\x1f"\\\x7f-\xff]')
+
+
+def quote_path(path: str) -> bytes:
+    """quote a path C-style if it would not survive unquoted"""
+    raw = path.encode()
+    if not _needs_quoting.search(raw):
+        return raw
+    out = bytearray(b'"')
+    escapes = {7: b"a", 8: b"b", 9: b"t", 10: b"n", 11: b"v", 12: b"f", 13: b"r"}
+    for c in raw:
+        if c in escapes:
+            out += b"\\" + escapes[c]
+        elif c in b'"\\':
+            out += b"\\" + bytes([c])
+        elif c < 0x20 or c >= 0x7F:
+            out += b"\\%03o" % c
+        else:
+            out.append(c)
+    return bytes(out + b'"')
+
+
+# C escapes and the bytes they stand for
+c_escapes = {
+    ord("a"): 7,
+    ord("b"): 8,
+    ord("f"): 12,
+    ord("n"): 10,
+    ord("r"): 13,
+    ord("t"): 9,
+    ord("v"): 11,
+    ord('"'): ord('"'),
+    ord("\\"): ord("\\"),
+}
+
+
+def unquote_c_style(quoted: bytes) -> bytes:
+    out = bytearray()
+    i = 1  # skip the opening quote
+    try:
+        while quoted[i] != ord('"'):
+            c = quoted[i]
+            if c != ord("\\"):
+                out.append(c)
+                i += 1
+            elif quoted[i + 1] in c_escapes:
+                out.append(c_escapes[quoted[i + 1]])
+                i += 2
+            else:  # octal escape such as \303
+                out.append(int(quoted[i + 1 : i + 4], base=8))
+                i += 4
+    except (IndexError, ValueError):
+        raise ValueError(f"invalid quoted path: {quoted!r}")
+    return bytes(out)
+
+
+def decode_path(path: bytes) -> str:
+    """a path as written by quote_path, raising ValueError for a bad one"""
+    if path.startswith(b'"'):
+        path = unquote_c_style(path)
+    return path.decode()
+
+
+def load_raw_content(sha1: ObjectId) -> bytes:
+    return object_store.get_object_store().read(sha1)
+
+
+def read_object_header(sha1: ObjectId):
+    """return (type, size) of an object inflating only its header"""
+    return object_store.get_object_store().read_header(sha1)
+
+
+def iter_object_content(sha1: ObjectId):
+    """yield the content (without header) of an object in chunks"""
+    return object_store.get_object_store().read_chunks(sha1)
 
 
 def store_raw_content(content: bytes):
-    sha1 = hash_content(content)
-    path = paths.make_object_path(sha1, make_dirs=True)
-    if path.exists():
-        return
-    obj_compressed = zlib.compress(content)
-    with open(path, "wb") as f:
-        f.write(obj_compressed)
+    return object_store.get_object_store().write(content)
@@ -0,0 +1,252 @@
+# find the untracked files of the worktree
+#
+# directories are read with os.scandir one level at a time, all directories
+# of a level at once on a thread pool: scandir and stat release the GIL, so
+# the reads of sibling directories overlap; .gitignore files are read and
+# compiled as their directory is reached, and ignored directories are not
+# entered at all
+#
+# with an untracked cache, a directory whose stat data and ignore rules are
+# unchanged is not read: the untracked files recorded for it are used
+
+import os
+
+from .config import get_config
+from .ignore import Ignores, IgnoreRules, PER_DIRECTORY_FILE
+from .ignore import find_excludes_file, find_info_exclude
+from .ls_tree import leads_to_pathspec, matches_pathspec
+from .object_id import null_oid
+from .untracked_cache import (
+    NO_STAT,
+    UntrackedCache,
+    UntrackedCacheDir,
+    stat_data,
+    worktree_ident,
+)
+from .util import get_logger, hash_content
+
+logger = get_logger(__name__)
+
+
+def blob_name(data: bytes):
+    return hash_content(b"blob %d\0" % len(data) + data)
+
+
+def read_exclude_file(path, entry=None, index_mtime_ns=0):
+    """(content, stat data, object name) of an exclude file
+
+    the object name is the one git records: that of the index entry of the
+    file if it is up to date, else of the content with a newline appended,
+    as git reads it; a missing file has no content, zero stat data and the
+    null object name
+    """
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            data = f.read()
+    except (FileNotFoundError, NotADirectoryError):
+        return None, NO_STAT, null_oid
+    if not data:
+        oid = blob_name(b"")
+    elif (
+        entry is not None
+        and not entry.stage
+        and entry.stat_matches(st)
+        and not entry.is_racy(index_mtime_ns)
+    ):
+        oid = entry.sha1
+    else:
+        oid = blob_name(data + b"\n")
+    return data, stat_data(st), oid
+
+
+def load_untracked_cache(index, worktree: str):
+    """the untracked cache of the index to use and update, or None
+
+    core.untrackedCache set to true creates a cache if there is none, false
+    drops it, and otherwise ("keep") an existing one is used
+    """
+    setting = (get_config("core", "untrackedcache") or "keep").strip().lower()
+    if setting in ("false", "no", "off", "0"):
+        if index.untracked_cache is not None:
+            index.untracked_cache = None
+            index.dirty = True
+        return None
+    create = setting in ("true", "yes", "on", "1", "")
+    ident = worktree_ident(worktree)
+    cache = index.untracked_cache
+    if cache is not None and (
+        cache.ident != ident
+        or cache.dir_flags != 0
+        or cache.exclude_per_dir != PER_DIRECTORY_FILE
+    ):
+        # made elsewhere or for other listings, e.g. git status without -uall
+        if not create:
+            return None
+        cache = None
+    if cache is None:
+        if not create:
+            return None
+        cache = index.untracked_cache = UntrackedCache(ident)
+        index.dirty = True
+    _, info_stat, info_oid = read_exclude_file(find_info_exclude())
+    _, excludes_stat, excludes_oid = read_exclude_file(find_excludes_file())
+    if (info_oid, excludes_oid) != (cache.info_exclude[1], cache.excludes_file[1]):
+        logger.debug("global exclude files changed, dropping the untracked cache")
+        cache.root = None
+        index.dirty = True
+    cache.info_exclude = (info_stat, info_oid)
+    cache.excludes_file = (excludes_stat, excludes_oid)
+    if cache.root is None:
+        cache.root = UntrackedCacheDir("")
+    return cache
+
+
+class WorktreeWalker:
+    """lists the untracked files of the worktree at root
+
+    index is only read; its paths are looked up from the worker threads;
+    without ignores (for add -f) nothing is excluded
+    """
+
+    def __init__(self, root, index, ignores=None, cache=None, index_mtime_ns=0):
+        self.root = os.fspath(root)
+        self.index = index
+        self.use_gitignore = ignores is not None
+        self.ignores = ignores if ignores is not None else Ignores(None)
+        self.cache = cache
+        # directories changed since the index was written can not be trusted
+        self.index_mtime_ns = index_mtime_ns
+        self.cache_changed = False
+        self.n_read = 0
+        self.n_reused = 0
+        # built before the threads start, which then only read it
+        index.find("")
+
+    def is_tracked(self, path):
+        return self.index.find(path) is not None
+
+    def read_directory(self, full: str, prefix: str, ignores):
+        """(untracked names, subdirectory names) read from directory full
+
+        a directory holding a repository of its own is listed among the
+        untracked as "name/" and not entered
+        """
+        untracked = []
+        dirs = []
+        try:
+            it = os.scandir(full)
+        except (FileNotFoundError, NotADirectoryError, PermissionError):
+            return untracked, dirs
+        with it:
+            for entry in it:
+                name = entry.name
+                if name == ".git":
+                    continue
+                path = prefix + name
+                if entry.is_dir(follow_symlinks=False):
+                    # submodules and sparse directories are in the index
+                    if self.is_tracked(path) or self.is_tracked(path + "/"):
+                        continue
+                    if ignores.is_ignored(path, True):
+                        continue
+                    if os.path.lexists(os.path.join(entry.path, ".git")):
+                        untracked.append(name + "/")
+                    else:
+                        dirs.append(name)
+                elif entry.is_file(follow_symlinks=False) or entry.is_symlink():
+                    if not self.is_tracked(path) and not ignores.is_ignored(
+                        path, False
+                    ):
+                        untracked.append(name)
+        return untracked, dirs
+
+    def scan(self, item):
+        """read one directory, or take it from the cache if it did not change
+
+        returns the rules in effect below it, the untracked names in it, its
+        subdirectories and whether its rules differ from the cached ones
+        """
+        path, parent_ignores, node, rules_changed = item
+        full = os.path.join(self.root, path) if path else self.root
+        prefix = path + "/" if path else ""
+        fresh = False
+        if node is not None:
+            try:
+                st = stat_data(os.lstat(full))
+            except OSError:
+                st = None
+            fresh = (
+                not rules_changed
+                and st is not None
+                and node.stat == st
+                and not node.check_only
+                and st[2] * 10**9 + st[3] < self.index_mtime_ns
+            )
+        if not self.use_gitignore or (fresh and node.exclude_oid == null_oid):
+            # no .gitignore was there, and no file was added since
+            data, oid = None, null_oid
+        else:
+            data, _, oid = read_exclude_file(
+                os.path.join(full, PER_DIRECTORY_FILE),
+                self.index.get(prefix + PER_DIRECTORY_FILE),
+                self.index_mtime_ns,
+            )
+        ignores = parent_ignores.child(
+            IgnoreRules.from_bytes(data) if data else None, prefix
+        )
+        if node is None:
+            return (ignores, *self.read_directory(full, prefix, ignores), False)
+        rules_changed = rules_changed or oid != node.exclude_oid
+        if fresh and not rules_changed:
+            self.n_reused += 1
+            untracked = [
+                name
+                for name in node.untracked
+                if not self.is_tracked(prefix + name.rstrip("/"))
+            ]
+            return ignores, untracked, list(node.dirs), False
+        self.n_read += 1
+        untracked, dirs = self.read_directory(full, prefix, ignores)
+        node.stat = st
+        node.exclude_oid = oid
+        node.check_only = False
+        node.untracked = sorted(untracked)
+        node.dirs = {
+            name: node.dirs.get(name) or UntrackedCacheDir(name)
+            for name in sorted(dirs)
+        }
+        if rules_changed:
+            for child in node.dirs.values():
+                child.invalidate_tree()
+        self.cache_changed = True
+        return ignores, untracked, dirs, rules_changed
+
+    def walk(self, pathspecs, executor):
+        """sorted paths of the untracked files matching pathspecs
+
+        each level of directories is read with one map over the executor
+        """
+        untracked = []
+        root_node = self.cache.root if self.cache is not None else None
+        level = [("", self.ignores, root_node, False)]
+        while level:
+            next_level = []
+            results = executor.map(self.scan, level)
+            for (path, _, node, _), result in zip(level, results):
+                ignores, names, dirs, rules_changed = result
+                prefix = path + "/" if path else ""
+                for name in names:
+                    is_dir = name.endswith("/")
+                    if matches_pathspec(prefix + name.rstrip("/"), is_dir, pathspecs):
+                        untracked.append(prefix + name)
+                for name in dirs:
+                    child = prefix + name
+                    if matches_pathspec(child, True, pathspecs) or leads_to_pathspec(
+                        child, pathspecs
+                    ):
+                        child_node = node.child(name) if node is not None else None
+                        next_level.append((child, ignores, child_node, rules_changed))
+            level = next_level
+        logger.debug(f"read {self.n_read} directories, {self.n_reused} from cache")
+        return sorted(untracked)